@@ -0,0 +1,170 @@
+import logging
+import os
+from typing import Any, Dict, List
+
+import yaml
+from pydantic import BaseModel, root_validator, validator
+
+from configuration_files.const import DB_NAME_LIST, YAML_CONFIG_FILE
+
+log = logging.getLogger(__name__)
+
+# Reload the configuration file when it changes. Settings that are applied at startup still need a restart
+reload_on_change = False
+
+_config = None
+_config_mtime = None
+_config_path = YAML_CONFIG_FILE
+# The libyaml loader, when PyYAML was built with it, parses the configuration several times faster
+YAML_LOADER = getattr(yaml, "CFullLoader", yaml.FullLoader)
+
+
+class SelectAttribute(BaseModel):
+    original_name: str
+    return_name: str
+
+
+class DbOrganismConfig(BaseModel):
+    path: str
+    columns: List[str] = []
+    select_attributes: List[SelectAttribute] = []
+
+    @validator("columns", "select_attributes", pre=True)
+    def val_empty_list(cls, v):
+        # An empty list in the YAML file is loaded as None
+        return v if v is not None else []
+
+
+class DbConfig(BaseModel):
+    human: DbOrganismConfig
+
+    class Config:
+        extra = "allow"
+
+
+class DatabasesConfig(BaseModel):
+    """
+    The databases section. Every database in DB_NAME_LIST must be configured
+    """
+    base_path: str
+    dbs: Dict[str, DbConfig] = {}
+
+    @root_validator(pre=True)
+    def val_dbs(cls, values):
+        values = dict(values)
+        dbs = {db_name: values.pop(db_name) for db_name in list(values) if db_name not in ["base_path", "dbs"]}
+        unknown_dbs = [db_name for db_name in dbs if db_name not in DB_NAME_LIST]
+        if unknown_dbs:
+            raise ValueError("Unknown databases {}. Valid DB are: {}".format(unknown_dbs, DB_NAME_LIST))
+        missing_dbs = [db_name for db_name in DB_NAME_LIST if db_name not in dbs]
+        if missing_dbs:
+            raise ValueError("Missing configuration for databases {}".format(missing_dbs))
+        values["dbs"] = dbs
+        return values
+
+    def get_db(self, db_name):
+        return self.dbs[db_name]
+
+    def to_dict(self):
+        """
+        Returns: the section as it is written in the configuration file
+        """
+        databases = {"base_path": self.base_path}
+        databases.update({db_name: db_config.dict() for db_name, db_config in self.dbs.items()})
+        return databases
+
+
+class GenomeConfig(BaseModel):
+    full: str
+    chromosomes_folder: str = None
+
+
+class CasOffinderConfig(BaseModel):
+    default_genome: str = "human"
+    device: str = "C"
+
+
+class OffRiskConfig(BaseModel):
+    """
+    The server configuration, loaded from off-risk-config.yaml
+    """
+    genomes: Dict[str, GenomeConfig]
+    databases: DatabasesConfig
+    off_target_result_columns: List[str]
+    cas_offinder: CasOffinderConfig = CasOffinderConfig()
+    log: Dict[str, Any] = {}
+    config: Dict[str, Any] = {}
+    workspace: Dict[str, Any] = {}
+    tool_io: Dict[str, Any] = {}
+    tool_pool: Dict[str, Any] = {}
+    job: Dict[str, Any] = {}
+    proc_runner: Dict[str, Any] = {}
+    warm_up: Dict[str, Any] = {}
+    shared_tables: Dict[str, Any] = {}
+    admin: Dict[str, Any] = {}
+    metrics: Dict[str, Any] = {}
+    profiling: Dict[str, Any] = {}
+    memory_tracking: Dict[str, Any] = {}
+
+    @validator("off_target_result_columns")
+    def val_off_target_result_columns(cls, v):
+        if len(v) == 0:
+            raise ValueError("off_target_result_columns should not be empty")
+        return v
+
+    @root_validator(skip_on_failure=True)
+    def val_default_genome(cls, values):
+        if values["cas_offinder"].default_genome not in values["genomes"]:
+            raise ValueError("cas_offinder default_genome {} is not in genomes: {}".format(
+                values["cas_offinder"].default_genome, list(values["genomes"].keys())))
+        return values
+
+
+def load_config(config_path=None):
+    """
+    Load and validate the configuration file
+    Args:
+        config_path: path of the configuration file. if None the default configuration file is used
+
+    Returns: OffRiskConfig
+    """
+    with open(config_path if config_path else _config_path, "r") as f:
+        return OffRiskConfig(**yaml.load(f, Loader=YAML_LOADER))
+
+
+def get_config():
+    """
+    Get the configuration. It is loaded once, and loaded again when the file changes if reload_on_change is set.
+    A changed file that is not valid is logged and the previous configuration is kept
+    Returns: OffRiskConfig
+    """
+    global _config, _config_mtime, reload_on_change
+    if _config is None:
+        _config_mtime = os.path.getmtime(_config_path)
+        _config = load_config()
+        reload_on_change = bool(_config.config.get("reload_on_change", reload_on_change))
+    elif reload_on_change:
+        try:
+            config_mtime = os.path.getmtime(_config_path)
+        except OSError:
+            return _config
+        if config_mtime != _config_mtime:
+            _config_mtime = config_mtime
+            try:
+                _config = load_config()
+                log.info("Configuration was reloaded from {}".format(_config_path))
+            except Exception as e:
+                log.error("Configuration file {} is not valid, the previous configuration is kept: {}".format(
+                    _config_path, e))
+    return _config
+
+
+def update_config_path(config_path):
+    """
+    Use another configuration file. The configuration is loaded again on the next get_config
+    Args:
+        config_path: path of the configuration file
+    """
+    global _config, _config_path
+    _config_path = config_path
+    _config = None
@@ -8,14 +8,17 @@ CURRENT_DATA_TIME = str(datetime.datetime.now().strftime("%Y-%m-%d-%H:%M"))
 CONF_FILE = "{}/configuration_files/conf_param.json".format(APP_DIR)
 DB_NAME_LIST = ["gencode", "mirgene", "remapepd", "enhanceratlas", "pfam", "targetscan", "omim", "humantf",
                 "protein_atlas", "rbp", "cosmic"]
+# Result tables that can be requested with the "include" field. Per-DB complete tables are requested with "db:<name>"
+RESULT_INCLUDE_LIST = ["off_targets", "risk", "flashfry_score"]
 
 YAML_CONFIG_FILE = "{}/configuration_files/off-risk-config.yaml".format(APP_DIR)
 """
 This file store default values and path for different variables used by this program.
 You can change the default values from here.
 """
-# Cas-OFFinder - default path in docker
-CAS_OFFINDER_BULGE_PATH = "/app/tools/cas-offinder-bulge"
+# Cas-OFFinder - default path in docker. The OFF_RISK_CAS_OFFINDER_BULGE_PATH environment variable overrides it,
+# for example with the stand-in tool in benchmarks/fake_tools
+CAS_OFFINDER_BULGE_PATH = os.environ.get("OFF_RISK_CAS_OFFINDER_BULGE_PATH", "/app/tools/cas-offinder-bulge")
 
 # Cas-OFFinder was installed from 'conda install -c bioconda cas-offinder'.
 # For other uses please specify the path for cas-offinder bellow
@@ -25,8 +28,8 @@ CAS_OFFINDER_INPUT_FILE_PATH = "{}/configuration_files/cas_offinder_input_bulge.
 CAS_OFFINDER_OUTPUT_PATH = "{}/off_target_output/cas_offinder_output_bulge.txt".format(APP_DIR)
 
 
-# FlashFry - - default path in docker
-FLASHFRY_PATH = "/app/tools/FlashFry-assembly-1.12.jar"
+# FlashFry - - default path in docker. The OFF_RISK_FLASHFRY_PATH environment variable overrides it
+FLASHFRY_PATH = os.environ.get("OFF_RISK_FLASHFRY_PATH", "/app/tools/FlashFry-assembly-1.12.jar")
 FLASHFRY_INPUT_PATH = "{}/configuration_files/flashfry_input.fa".format(APP_DIR)
 FLASHFRY_TMP_LOCATION_PATH = "/app/tmp/"
 FLASHFRY_DATABASE_BASE_PATH = "/FlashFry/cas9ngg_database"
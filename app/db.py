@@ -4,14 +4,18 @@ import pandas as pd
 import logging
 import os
 import re
-import wget
-from flask import jsonify, Flask
-from pybedtools import BedTool
+import pybedtools
 from configuration_files.const import BASE_DIR, COMPLETE_GENOME_URL, COMPLETE_GENOME_PATH
 from abc import abstractmethod
 from helper import get_logger, extract_gz_file
+from lazy_import import lazy_import
+from table_store import load_table, freeze_loaded_tables
+from gene_risk import encode_expression, load_gene_risk_table
 
-log = get_logger(logger_name=__name__, debug_level=logging.DEBUG)
+log = get_logger(logger_name=__name__)
+
+# Only the database update downloads files
+wget = lazy_import("wget")
 database_base_path = "{}/databases".format(BASE_DIR)
 
 
@@ -33,8 +37,10 @@ class Db(object):
         self.dtype_to_intersect = {}
         self.column_name_for_intersection = "gene_ensembl_id"
         self.db_bed = None
-        self.db_df = pd.DataFrame()
+        self.table = None
+        self._db_df = None
         self.pr_df = list()
+        self.keep_complete_result = True
 
         if not os.path.exists(self.file_path):
             log.error("File for db {} in {} does not exist".format(self.db_name, self.file_path))
@@ -48,6 +54,49 @@ class Db(object):
         """
         pass
 
+    @property
+    def db_df(self):
+        """
+        The db as a dataframe. For a db loaded as a table it is built from the table on first use
+        """
+        if self._db_df is None:
+            self._db_df = self.table.to_frame() if self.table is not None else pd.DataFrame()
+        return self._db_df
+
+    @db_df.setter
+    def db_df(self, value):
+        self._db_df = value
+
+    def get_db_size(self):
+        """
+        Returns: number of rows in the db
+        """
+        if self.table is not None and self._db_df is None:
+            return len(self.table)
+        return len(self.db_df.index)
+
+    def get_rows(self, rows):
+        """
+        Args:
+            rows: positions of the rows, a position can repeat
+
+        Returns: dataframe of the rows, without building the complete db_df
+        """
+        if self.table is not None and self._db_df is None:
+            return self.table.to_frame(rows=rows)
+        return self.db_df.iloc[rows].copy()
+
+    def get_columns(self, columns):
+        """
+        Args:
+            columns: list of columns
+
+        Returns: dataframe of the db with only the given columns
+        """
+        if self.table is not None and self._db_df is None:
+            return self.table.to_frame(columns=columns)
+        return self.db_df[columns]
+
     def analyze(self, off_target_bed):
         """
         Analyze the off-target with the db
@@ -57,7 +106,7 @@ class Db(object):
         Returns: save the result in "complete_result"
 
         """
-        if type(self.db_bed) is not BedTool:
+        if type(self.db_bed) is not pybedtools.BedTool:
             log.error("The data for {} was not loaded".format(self.db_name))
             return
         log.info("Starting to analyze {}".format(self.db_name))
@@ -68,14 +117,12 @@ class Db(object):
         if intersection_bed.count() != 0:
             intersection_group = intersection_bed.to_dataframe(header=None, names=self.columns_name, index_col=False,
                                                                dtype=self.dtype_to_intersect)
-            intersection_group.to_csv('/databases/temp_{}.csv'.format(self.db_name), sep='#')
 
             if self.separate_attributes:
                 intersection_group = separate_attributes(intersection_group)
 
             self.complete_result = intersection_group
-            self.pr_df.append({"name": self.db_name, "description": "Complete result",
-                               "data": intersection_group.reset_index().to_json(orient="columns")})
+            self.save_complete_result(intersection_group.reset_index(), orient="columns")
         else:
             # if count is 0, it means that there is not result for the intersection
             log.info("There is no result from {} intersection".format(self.db_name))
@@ -104,6 +151,22 @@ class Db(object):
         """
         return self.pr_df
 
+    def save_complete_result(self, result_df, orient="records"):
+        """
+        Serialize the complete result into pr_df. Skipped when the complete result of this DB was not requested
+        Args:
+            result_df: the complete result dataframe
+            orient: orient for the json serialization
+        """
+        if not self.keep_complete_result:
+            return
+        complete_result = {"name": self.db_name, "description": "Complete result",
+                           "data": result_df.to_json(orient=orient)}
+        if self.pr_df:
+            self.pr_df[0] = complete_result
+        else:
+            self.pr_df.append(complete_result)
+
     def update_db(self):
         """
         Update the database if possible
@@ -112,14 +175,18 @@ class Db(object):
         """
         log.info("Update function is not implemented for {}".format(self.db_name))
 
-    def process_result(self, off_target_df):
-        return off_target_df
+    def process_result(self, off_target_information):
+        """
+        Add the information of the database to the off-targets
+        Args:
+            off_target_information: the OffTargetInformation of the request
+        """
 
 
 class GencodeDb(Db):
 
     def __init__(self, file_path, final_columns):
-        file_path = "{}/{}".format(database_base_path, file_path)
+        file_path = get_db_file_path(file_path)
         super().__init__("GENCODE", file_path)
         self.url = "ftp://ftp.ebi.ac.uk/pub/databases/gencode/Gencode_human/release_36/gencode.v36.annotation.gff3.gz"
         self.separate_attributes = True
@@ -134,7 +201,7 @@ class GencodeDb(Db):
         Load the GENCODE file v42 from GRCh38. Downloaded on 6.11.2022.
         :return: pybedtools object with GENCODE information
         """
-        self.db_bed = BedTool(self.file_path)
+        self.db_bed = pybedtools.BedTool(self.file_path)
 
     def update_db(self):
         gencode_file = wget.download(url=self.url, out="{}/GENCODE".format(database_base_path))
@@ -143,7 +210,7 @@ class GencodeDb(Db):
         extract_gz_file(gencode_file, self.file_path["GENCODE"])
         log.info("{} was downloaded to: {}".format(self.db_name, gencode_file))
 
-    def process_result(self, off_target_df):
+    def process_result(self, off_target_information):
         """
         Returns:
 
@@ -163,17 +230,13 @@ class GencodeDb(Db):
             column_to_keep = sorted(set(self.final_columns).intersection(self.complete_result.columns),
                                     key=lambda x: self.final_columns.index(x))
             self.complete_result = self.complete_result[column_to_keep]
-            self.pr_df[0] = {"name": self.db_name, "description": "Complete result",
-                             "data": self.complete_result.to_json(orient="records")}
+            self.save_complete_result(self.complete_result)
 
             # Update relevant fields in global off_target dataframe
             intersection_group = self.complete_result.groupby("off_target_id", as_index=False).agg(
                 {"gene_ensembl_id": lambda x: list(set(x)), "gene_symbol": lambda x: list(set(x)),
                  "segment": lambda x: list(set(x)), "gene_type": lambda x: list(set(x))})
-            off_target_df = merge_off_target_information(off_target_df, intersection_group,
-                                                         ["gene_ensembl_id", "gene_symbol", "segment", "gene_type"])
-
-        return off_target_df
+            off_target_information.add(intersection_group, ["gene_ensembl_id", "gene_symbol", "segment", "gene_type"])
 
     def segment_filtered_result(self):
         group_gencode = self.complete_result.groupby(["off_target_id", "gene_ensembl_id"])
@@ -199,7 +262,7 @@ class GencodeDb(Db):
 class MirGeneDB(Db):
 
     def __init__(self, file_path, final_columns):
-        file_path = "{}/{}".format(database_base_path, file_path)
+        file_path = get_db_file_path(file_path)
         super().__init__("MirGene", file_path)
         self.url = "https://mirgenedb.org/static/data/hsa/hsa-all.bed"
 
@@ -215,7 +278,7 @@ class MirGeneDB(Db):
         :return: pybedtools object with MirGene information
         """
         log.debug("Loading MirGene data")
-        self.db_bed = BedTool(self.file_path)
+        self.db_bed = pybedtools.BedTool(self.file_path)
 
     def update_db(self):
         """
@@ -228,7 +291,7 @@ class MirGeneDB(Db):
         mirgene_file = wget.download(url=self.url, out=self.file_path["MirGene"])
         log.info("{} was downloaded to: {}".format(self.db_name, mirgene_file))
 
-    def process_result(self, off_target_df):
+    def process_result(self, off_target_information):
         """
         Process the result of MirGeneDB.
         Add information to global off-target dataframe
@@ -256,22 +319,19 @@ class MirGeneDB(Db):
 
             # Update final result
             self.complete_result = self.complete_result[self.final_columns]
-            self.pr_df[0] = {"name": self.db_name, "description": "Complete result",
-                             "data": self.complete_result.to_json(orient="records")}
+            self.save_complete_result(self.complete_result)
 
             # Update relevant fields in global off_target dataframe
             off_target_mirgene = self.complete_result.groupby("off_target_id").agg(
                 {"mir_symbol": lambda x: list(set(x))})
             off_target_mirgene.rename(columns={"mir_symbol": "mir_gene"}, inplace=True)
-            off_target_df = merge_off_target_information(off_target_df, off_target_mirgene, ["mir_gene"])
-
-        return off_target_df
+            off_target_information.add(off_target_mirgene, ["mir_gene"])
 
 
 class ReMapEPD(Db):
 
     def __init__(self, file_path, final_columns):
-        file_path = "{}/{}".format(database_base_path, file_path)
+        file_path = get_db_file_path(file_path)
         super().__init__("ReMapEPD", file_path)
         self.separate_attributes = True
         self.columns_name = ["chromosome", "start", "end", "attributes", "score", "strand", "ot_chromosome",
@@ -287,9 +347,9 @@ class ReMapEPD(Db):
         :return: pybedtools object with epd information
         """
         log.debug("Loading ReMap and EPD data")
-        self.db_bed = BedTool(self.file_path)
+        self.db_bed = pybedtools.BedTool(self.file_path)
 
-    def process_result(self, off_target_df):
+    def process_result(self, off_target_information):
         """
         Process the result of ReMap and EPD.
         Add information to global off-target dataframe
@@ -297,23 +357,20 @@ class ReMapEPD(Db):
         if len(self.complete_result.index) != 0:
             # Update final result
             self.complete_result = self.complete_result[self.final_columns]
-            self.pr_df[0] = {"name": self.db_name, "description": "Complete result",
-                             "data": self.complete_result.to_json(orient="records")}
+            self.save_complete_result(self.complete_result)
 
             # Update relevant fields in global off_target dataframe
             off_target_remap_epd = self.complete_result.groupby("off_target_id").agg(
                 {"gene_ensembl_id": lambda x: list(set(x))})
             off_target_remap_epd.rename(columns={"gene_ensembl_id": "remap_epd_gene_ensembl_id"},
                                         inplace=True)
-            off_target_df = merge_off_target_information(off_target_df, off_target_remap_epd,
-                                                         ["remap_epd_gene_ensembl_id"])
-        return off_target_df
+            off_target_information.add(off_target_remap_epd, ["remap_epd_gene_ensembl_id"])
 
 
 class EnhancerAtlas(Db):
 
     def __init__(self, file_path, final_columns):
-        file_path = "{}/{}".format(database_base_path, file_path)
+        file_path = get_db_file_path(file_path)
         super().__init__("EnhancerAtlas", file_path)
         self.columns_name = ["chr_enhancer", "enh_start", "enh_stop", "name", "ot_chromosome",
                              "ot_start", "ot_end", "off_target_id", "ot_score", "ot_strand",
@@ -328,9 +385,9 @@ class EnhancerAtlas(Db):
         :return: pybedtools object with EnhancerAtlas information
         """
         log.debug("Loading Enhancer Atlas data")
-        self.db_bed = BedTool(self.file_path)
+        self.db_bed = pybedtools.BedTool(self.file_path)
 
-    def process_result(self, off_target_df):
+    def process_result(self, off_target_information):
         """
         Process the result of MirGeneDB.
         Add information to global off-target dataframe
@@ -348,24 +405,20 @@ class EnhancerAtlas(Db):
 
             # Update final result
             self.complete_result = self.complete_result[self.final_columns]
-            self.pr_df[0] = {"name": self.db_name, "description": "Complete result",
-                             "data": self.complete_result.to_json(orient="records")}
+            self.save_complete_result(self.complete_result)
 
             # Update relevant fields in global off_target dataframe
             off_target_enhancer_atlas = self.complete_result.groupby("off_target_id").agg(
                 {"gene_ensembl_id": lambda x: list(set(x))})
             off_target_enhancer_atlas.rename(columns={"gene_ensembl_id": "enhancer_atlas_gene_ensembl_id"},
                                              inplace=True)
-            off_target_df = merge_off_target_information(off_target_df, off_target_enhancer_atlas,
-                                                         ["enhancer_atlas_gene_ensembl_id"])
-
-        return off_target_df
+            off_target_information.add(off_target_enhancer_atlas, ["enhancer_atlas_gene_ensembl_id"])
 
 
 class Pfam(Db):
 
     def __init__(self, file_path, final_columns):
-        file_path = "{}/{}".format(database_base_path, file_path)
+        file_path = get_db_file_path(file_path)
         super().__init__("Pfam", file_path)
         self.separate_attributes = True
         self.columns_name = ["chromosome", "start", "end", "attributes", "ot_chromosome",
@@ -380,27 +433,25 @@ class Pfam(Db):
         :return: pybedtools object with Pfam protein domains information
         """
         log.debug("Loading Pfam protein domain data")
-        self.db_bed = BedTool(self.file_path)
+        self.db_bed = pybedtools.BedTool(self.file_path)
 
-    def process_result(self, off_target_df):
+    def process_result(self, off_target_information):
         if len(self.complete_result.index) != 0:
             # Update final result
             self.complete_result = self.complete_result[self.final_columns]
-            self.pr_df[0] = {"name": self.db_name, "description": "Complete result",
-                             "data": self.complete_result.to_json(orient="records")}
+            self.save_complete_result(self.complete_result)
 
             # Update relevant fields in global off_target dataframe
             off_target_pfam = self.complete_result.groupby("off_target_id").agg(
                 {"pfam_domain_name": lambda x: list(set(x))})
             off_target_pfam.rename(columns={"pfam_domain_name": "pfam_protein_domains"}, inplace=True)
-            off_target_df = merge_off_target_information(off_target_df, off_target_pfam, ["pfam_protein_domains"])
-        return off_target_df
+            off_target_information.add(off_target_pfam, ["pfam_protein_domains"])
 
 
 class TargetScan(Db):
 
     def __init__(self, file_path, final_columns):
-        file_path = "{}/{}".format(database_base_path, file_path)
+        file_path = get_db_file_path(file_path)
         super().__init__("TargetScan", file_path)
         self.columns_name = ["chromosome", "start", "end", "name", "score", "strand", "ot_chromosome",
                              "ot_start", "ot_end", "off_target_id", "ot_score", "ot_strand",
@@ -414,30 +465,28 @@ class TargetScan(Db):
         :return: pybedtools object with TargetScan information
         """
         log.debug("Loading TargetScan protein domain data")
-        self.db_bed = BedTool(self.file_path)
+        self.db_bed = pybedtools.BedTool(self.file_path)
 
-    def process_result(self, off_target_df):
+    def process_result(self, off_target_information):
         if len(self.complete_result.index) != 0:
             self.complete_result[["gene_symbol", "mir_symbol", "gene_ensembl_id"]] = \
                 self.complete_result["name"].str.rsplit(":", expand=True)
 
             # Update final result
             self.complete_result = self.complete_result[self.final_columns]
-            self.pr_df[0] = {"name": self.db_name, "description": "Complete result",
-                             "data": self.complete_result.to_json(orient="records")}
+            self.save_complete_result(self.complete_result)
 
             # Update relevant fields in global off_target dataframe
             off_target_targetscan = self.complete_result.groupby("off_target_id").agg(
                 {"mir_symbol": lambda x: list(set(x))})
             off_target_targetscan.rename(columns={"mir_symbol": "targetscan"}, inplace=True)
-            off_target_df = merge_off_target_information(off_target_df, off_target_targetscan, ["targetscan"])
-        return off_target_df
+            off_target_information.add(off_target_targetscan, ["targetscan"])
 
 
 class OmimDb(Db):
 
     def __init__(self, file_path, final_columns):
-        file_path = "{}/{}".format(database_base_path, file_path)
+        file_path = get_db_file_path(file_path)
         super().__init__("OMIM", file_path)
         self.enhancer_atlas = pd.DataFrame()
         self.remap_epd = pd.DataFrame()
@@ -448,9 +497,9 @@ class OmimDb(Db):
         Load the OMIM db. downloaded on 24/12/2020.
         :return: dataframe with OMIM information
         """
-        self.db_df = pd.read_csv(self.file_path, sep="\t")
+        self.table = load_table(self.file_path, sep="\t")
 
-    def process_result(self, off_target_df):
+    def process_result(self, off_target_information):
         if len(self.complete_result.index) != 0:
             self.complete_result = self.complete_result.astype({"disease_related": "string",
                                                                 "inheritance_model": "string"})
@@ -458,16 +507,14 @@ class OmimDb(Db):
 
             # Update final result
             self.complete_result = self.complete_result[self.final_columns]
-            self.pr_df[0] = {"name": self.db_name, "description": "Complete result",
-                             "data": self.complete_result.to_json(orient="records")}
+            self.save_complete_result(self.complete_result)
 
             # Update relevant fields in global off_target dataframe
             intersection_group = self.complete_result.groupby("off_target_id", as_index=False).agg(
                 {"disease_related": lambda x: list(set(x)),
                  "inheritance_model": lambda x: list(set(x))})
-            off_target_df = merge_off_target_information(off_target_df,
-                                                         intersection_group.astype({"off_target_id": int}),
-                                                         ["disease_related", "inheritance_model"])
+            off_target_information.add(intersection_group.astype({"off_target_id": int}),
+                                       ["disease_related", "inheritance_model"])
 
             # Update fields for Enhancer Atlas
             if len(self.enhancer_atlas.index) != 0:
@@ -480,10 +527,8 @@ class OmimDb(Db):
                 intersection_group = intersection_group.rename(
                     columns={"disease_related": "enhancer_atlas_disease_related",
                              "inheritance_model": "enhancer_atlas_inheritance_model"})
-                off_target_df = merge_off_target_information(off_target_df,
-                                                             intersection_group.astype({"off_target_id": int}),
-                                                             ["enhancer_atlas_disease_related",
-                                                              "enhancer_atlas_inheritance_model"])
+                off_target_information.add(intersection_group.astype({"off_target_id": int}),
+                                           ["enhancer_atlas_disease_related", "enhancer_atlas_inheritance_model"])
 
             # Update fields for ReMap EPD
             if len(self.remap_epd.index) != 0:
@@ -496,17 +541,14 @@ class OmimDb(Db):
                 intersection_group = intersection_group.rename(
                     columns={"disease_related": "remap_epd_disease_related",
                              "inheritance_model": "remap_epd_inheritance_model"})
-                off_target_df = merge_off_target_information(off_target_df,
-                                                             intersection_group.astype({"off_target_id": int}),
-                                                             ["remap_epd_disease_related",
-                                                              "remap_epd_inheritance_model"])
-        return off_target_df
+                off_target_information.add(intersection_group.astype({"off_target_id": int}),
+                                           ["remap_epd_disease_related", "remap_epd_inheritance_model"])
 
 
 class HumanTFDb(Db):
 
     def __init__(self, file_path, final_columns):
-        file_path = "{}/{}".format(database_base_path, file_path)
+        file_path = get_db_file_path(file_path)
         super().__init__("HumanTF", file_path)
         human_tf_url = "http://bioinfo.life.hust.edu.cn/static/AnimalTFDB3/download/Homo_sapiens_TF"
         human_tf_cofactor_url = \
@@ -520,22 +562,19 @@ class HumanTFDb(Db):
         :return: dataframe with HumanTFDb information
         """
         log.debug("Loading Human TF data")
-        self.db_df = pd.read_csv(self.file_path, sep="\t")
+        self.table = load_table(self.file_path, sep="\t")
 
-    def process_result(self, off_target_df):
+    def process_result(self, off_target_information):
         if len(self.complete_result.index) != 0:
             # Update final result
             self.complete_result = self.complete_result[self.final_columns]
-            self.pr_df[0] = {"name": self.db_name, "description": "Complete result",
-                             "data": self.complete_result.to_json(orient="records")}
+            self.save_complete_result(self.complete_result)
 
             # Update relevant fields in global off_target dataframe
-            off_target_df = merge_off_target_information(off_target_df,
-                                                         self.complete_result[["off_target_id", "HumanTF_source"]].astype(
-                                                             {"off_target_id": int, "HumanTF_source": str}),
-                                                         ["HumanTF_source"],
-                                                         "string")
-        return off_target_df
+            off_target_information.add(self.complete_result[["off_target_id", "HumanTF_source"]].astype(
+                                           {"off_target_id": int, "HumanTF_source": str}),
+                                       ["HumanTF_source"],
+                                       "string")
 
     def update_db(self):
         if os.path.exists(self.file_path["TF_PATH"]):
@@ -553,8 +592,14 @@ class HumanTFDb(Db):
 
 class ProteinAtlas(Db):
 
-    def __init__(self, file_path):
-        file_path = "{}/{}".format(database_base_path, file_path)
+    def __init__(self, file_path, gene_risk_table=None):
+        """
+        Args:
+            file_path: path of the Protein Atlas file
+            gene_risk_table: GeneRiskTable with the encoded expression of the genes. None will encode the result
+        """
+        file_path = get_db_file_path(file_path)
+        self.gene_risk_table = gene_risk_table
         super().__init__("Protein_Atlas", file_path)
 
     def load_data(self):
@@ -564,44 +609,28 @@ class ProteinAtlas(Db):
         :return: dataframe with Protein Atlas information
         """
         log.debug("Loading Protein Atlas data")
-        self.db_df = pd.read_csv(self.file_path)
+        self.table = load_table(self.file_path)
 
-    def process_result(self, off_target_df):
+    def process_result(self, off_target_information):
         """
         Process the result of Protein Atlas.
         Add information to global off-target dataframe
         """
         if len(self.complete_result.index) != 0:
-            df_to_vector = self.complete_result.fillna("None")
-
-            # create dictionary with value to integer mappings
-            value_to_int = {value: i for i, value in
-                            enumerate(["Not representative", "None", "Not detected", "Low", "Medium", "High"])}
-            value_to_int['Ascending'] = 1
-
-            df_to_vector = df_to_vector.replace(value_to_int).drop(
-                ["gene_ensembl_id", "gene_symbol", "off_target_id"], axis=1)
-            df_to_vector["expression_information"] = df_to_vector.apply(
-                lambda row: ",".join(row.values.astype(str)), axis=1)
-            self.complete_result = pd.concat([self.complete_result, df_to_vector], axis=1)
-            off_target_protein_atlas = self.complete_result.astype(
-                {"off_target_id": int, "expression_information": "string", "gene_symbol": "string"})
-            off_target_protein_atlas["expression_information"] = \
-                off_target_protein_atlas[["gene_symbol", "expression_information"]].apply(lambda row: "{}:({})".format(
-                    row["gene_symbol"], row["expression_information"]), axis=1)
-
-            off_target_protein_atlas = off_target_protein_atlas.groupby("off_target_id", as_index=False).agg(
-                {"expression_information": lambda x: list(set(x))})
-            off_target_df = merge_off_target_information(off_target_df, off_target_protein_atlas,
-                                                         ["expression_information"])
-
-        return off_target_df
+            if self.gene_risk_table is not None:
+                off_target_protein_atlas = self.gene_risk_table.get_expression(self.complete_result)
+            else:
+                off_target_protein_atlas = self.complete_result[["off_target_id"]].assign(
+                    expression_information=encode_expression(self.complete_result.drop("off_target_id", axis=1)))
+            off_target_protein_atlas = off_target_protein_atlas.astype({"off_target_id": int}).groupby(
+                "off_target_id", as_index=False).agg({"expression_information": lambda x: list(set(x))})
+            off_target_information.add(off_target_protein_atlas, ["expression_information"])
 
 
 class RBP(Db):
 
     def __init__(self, file_path, final_columns):
-        file_path = "{}/{}".format(database_base_path, file_path)
+        file_path = get_db_file_path(file_path)
         super().__init__("RBP", file_path)
         self.final_columns = final_columns
 
@@ -612,28 +641,26 @@ class RBP(Db):
         :return: dataframe with RBP information
         """
         log.debug("Loading RBP data")
-        self.db_df = pd.read_csv(self.file_path, sep="\t")
+        self.table = load_table(self.file_path, sep="\t")
 
-    def process_result(self, off_target_df):
+    def process_result(self, off_target_information):
         if len(self.complete_result.index) != 0:
             # Update final result
             self.complete_result = self.complete_result[self.final_columns]
-            self.pr_df[0] = {"name": self.db_name, "description": "Complete result",
-                             "data": self.complete_result.to_json(orient="records")}
+            self.save_complete_result(self.complete_result)
 
             # Update relevant fields in global off_target dataframe
             off_target_cosmic = self.complete_result.astype(
                 {"off_target_id": int}).groupby("off_target_id").agg(
                 {"gene_ensembl_id": lambda x: list(set(x))})
             off_target_cosmic.rename(columns={"gene_ensembl_id": "rbp_gene_ensembl_id"}, inplace=True)
-            off_target_df = merge_off_target_information(off_target_df, off_target_cosmic, ["rbp_gene_ensembl_id"])
-        return off_target_df
+            off_target_information.add(off_target_cosmic, ["rbp_gene_ensembl_id"])
 
 
 class COSMIC(Db):
 
     def __init__(self, file_path, final_columns):
-        file_path = "{}/{}".format(database_base_path, file_path)
+        file_path = get_db_file_path(file_path)
         super().__init__("COSMIC", file_path)
         self.enhancer_atlas = pd.DataFrame()
         self.remap_epd = pd.DataFrame()
@@ -646,9 +673,9 @@ class COSMIC(Db):
         :return: dataframe with COSMIC information
         """
         log.debug("Loading COSMIC data")
-        self.db_df = pd.read_csv(self.file_path, sep="\t")
+        self.table = load_table(self.file_path, sep="\t")
 
-    def process_result(self, off_target_df):
+    def process_result(self, off_target_information):
         """
         Process the result of COSMIC.
         Add information to global off-target dataframe
@@ -656,15 +683,14 @@ class COSMIC(Db):
         if len(self.complete_result.index) != 0:
             # Update final result
             self.complete_result = self.complete_result[self.final_columns]
-            self.pr_df[0] = {"name": self.db_name, "description": "Complete result",
-                             "data": self.complete_result.to_json(orient="records")}
+            self.save_complete_result(self.complete_result)
 
             # Update relevant fields in global off_target dataframe
             off_target_cosmic = self.complete_result.astype(
                 {"off_target_id": int}).groupby("off_target_id").agg(
                 {"Role in Cancer": lambda x: list(set(x))})
             off_target_cosmic.rename(columns={"Role in Cancer": "cancer_related"}, inplace=True)
-            off_target_df = merge_off_target_information(off_target_df, off_target_cosmic, ["cancer_related"])
+            off_target_information.add(off_target_cosmic, ["cancer_related"])
 
         # Update fields for Enhancer Atlas
         if len(self.enhancer_atlas.index) != 0:
@@ -672,8 +698,7 @@ class COSMIC(Db):
                 {"off_target_id": int}).groupby("off_target_id").agg(
                 {"Role in Cancer": lambda x: list(set(x))})
             off_target_cosmic.rename(columns={"Role in Cancer": "enhancer_atlas_cancer_related"}, inplace=True)
-            off_target_df = merge_off_target_information(off_target_df, off_target_cosmic,
-                                                         ["enhancer_atlas_cancer_related"])
+            off_target_information.add(off_target_cosmic, ["enhancer_atlas_cancer_related"])
 
         # Update fields for ReMap EPD
         if len(self.remap_epd.index) != 0:
@@ -681,9 +706,7 @@ class COSMIC(Db):
                 {"off_target_id": int}).groupby("off_target_id").agg(
                 {"Role in Cancer": lambda x: list(set(x))})
             off_target_cosmic.rename(columns={"Role in Cancer": "remap_epd_cancer_related"}, inplace=True)
-            off_target_df = merge_off_target_information(off_target_df, off_target_cosmic,
-                                                         ["remap_epd_cancer_related"])
-        return off_target_df
+            off_target_information.add(off_target_cosmic, ["remap_epd_cancer_related"])
 
 
 class ANonHumanDB(object):
@@ -692,7 +715,7 @@ class ANonHumanDB(object):
         self._name = name
         self._location = location
         self._columns = columns
-        self._db_bed = BedTool(self.location)
+        self._db_bed = pybedtools.BedTool(self.location)
 
     @abstractmethod
     def select(self, query):
@@ -762,35 +785,53 @@ def separate_attributes(df_to_separate):
         return df_to_separate
 
 
-def analyze_with_id_list(current_db, off_target_df, ensembl_id_list, db_name, column_to_search):
+# The result that the gene hits of every hit source are set to in the gene databases
+GENE_HIT_RESULTS = {"gencode": "complete_result", "enhancer_atlas": "enhancer_atlas", "remap_epd": "remap_epd"}
+
+
+def get_gene_hits(gencode_db=None, enhancer_atlas_db=None, remap_epd_db=None):
+    """
+    Args:
+        gencode_db: GENCODE db with its result
+        enhancer_atlas_db: Enhancer Atlas db with its result
+        remap_epd_db: ReMap EPD db with its result
+
+    Returns: dataframe with off_target_id, gene_ensembl_id and hit_source of the gene hits in the results
+    """
+    hits = []
+    for hit_source, hit_db in [("gencode", gencode_db), ("enhancer_atlas", enhancer_atlas_db),
+                               ("remap_epd", remap_epd_db)]:
+        if hit_db and "gene_ensembl_id" in hit_db.complete_result.columns:
+            hits.append(hit_db.complete_result[["off_target_id", "gene_ensembl_id"]].assign(hit_source=hit_source))
+    if len(hits) == 0:
+        return pd.DataFrame(columns=["off_target_id", "gene_ensembl_id", "hit_source"])
+    return pd.concat(hits, ignore_index=True)
+
+
+def analyze_gene_hits(current_db, gene_hits_df, db_name, hit_source):
+    """
+    Set the rows of a gene database that the off-targets hit through the genes of a hit source, with the off_target_id
+    of every hit. A row of a gene that is hit by several off-targets is repeated for every one of them
+    Args:
+        current_db: the gene db (OMIM, COSMIC, HumanTF, RBP or Protein Atlas)
+        gene_hits_df: the gene hits of the off-targets joined to the gene databases, see GeneRiskTable.join_gene_hits
+        db_name: the name of the db in the request
+        hit_source: gencode, enhancer_atlas or remap_epd. The rows are set to the result of GENE_HIT_RESULTS
+    """
     log.info("Starting to analyze {}".format(current_db.db_name))
-    if len(current_db.db_df) == 0:
+    if current_db.get_db_size() == 0:
         log.error("The data for {} was not loaded".format(current_db.db_name))
         return
-    db_result = current_db.db_df[current_db.db_df[current_db.column_name_for_intersection].isin(ensembl_id_list)]
-    if current_db.separate_attributes:
-        db_result = separate_attributes(db_result)
-
-    # Add the off_target_id to the complete result
-    if len(db_result.index) != 0:
-        db_result["off_target_id"] = ""
-        if column_to_search in off_target_df.columns:
-            # For each off_target add the id to the complete result if it is the ensemble_id
-            for result in off_target_df.itertuples():
-                if type(getattr(result, column_to_search)) is list:
-                    result_id_list = list(getattr(result, column_to_search))
-                    db_result.loc[:, "off_target_id"] = db_result.apply(
-                        lambda x: "{},".format(result.off_target_id)
-                        if x[current_db.column_name_for_intersection] in result_id_list
-                        else x["off_target_id"], axis=1)
-            db_result["off_target_id"] = db_result["off_target_id"].str.strip(",")
-            db_result.reset_index(inplace=True, drop=True)
-            setattr(current_db, db_name, db_result)
-            if db_name == "complete_result":
-                current_db.pr_df.append({"name": current_db.db_name, "description": "Complete result",
-                                         "data": current_db.complete_result.to_json(orient="records")})
-        else:
-            log.info("No Gene ensembl ID therefore there are no result for {}".format(current_db.db_name))
+    db_hits_df = gene_hits_df.loc[(gene_hits_df["db_name"] == db_name) & (gene_hits_df["hit_source"] == hit_source)]
+    if len(db_hits_df.index) == 0:
+        log.info("No gene hits of {} therefore there are no result for {}".format(hit_source, current_db.db_name))
+        return
+    db_result = current_db.get_rows(db_hits_df["row"].to_numpy())
+    db_result["off_target_id"] = db_hits_df["off_target_id"].to_numpy()
+    db_result.reset_index(inplace=True, drop=True)
+    setattr(current_db, GENE_HIT_RESULTS[hit_source], db_result)
+    if hit_source == "gencode":
+        current_db.save_complete_result(current_db.complete_result)
 
 
 def initialize_off_target_df(off_target_df):
@@ -802,45 +843,141 @@ def initialize_off_target_df(off_target_df):
     return off_target_df
 
 
-def merge_off_target_information(left_df, right_df, columns_name, column_type="list"):
+class OffTargetInformation(object):
     """
-    Args:
-        right_df: right dataframe to merge
-        left_df: usually the off_target_df
-        columns_name: a list of column type to add to the left dataframe
-        column_type: data type of the columns
+    The information of the databases about the off-targets. The process_result of every database adds its columns,
+    grouped by off_target_id, and they are joined to the off-target table once, after all the databases
     """
-    df_result = left_df.merge(right_df, how="left", on="off_target_id")
-    if column_type == "list":
-        for column in columns_name:
-            df_result[column] = df_result[column].apply(lambda x: [] if isinstance(x, float) else x)
-            df_result[column] = df_result[column].apply(lambda x: [i for i in x if i not in [np.nan, ""]])
 
-    return df_result
+    def __init__(self):
+        self.tables = list()
+        self.list_columns = list()
+        self._information_df = None
 
+    @property
+    def columns(self):
+        return [column for table in self.tables for column in table.columns]
 
-def save_global_off_target_results(off_target_df, flashfry_score, columns_order=None):
+    def add(self, information_df, columns_name, column_type="list"):
+        """
+        Add information to the off-targets
+        Args:
+            information_df: dataframe with off_target_id as a column or as the index
+            columns_name: a list of the columns to add to the off-target table
+            column_type: data type of the columns. The nan and empty values are removed from the "list" columns, and
+            the off-targets without information get an empty list
+        """
+        if "off_target_id" in information_df.columns:
+            information_df = information_df.set_index("off_target_id")
+        else:
+            information_df = information_df.copy()
+        if column_type == "list":
+            # Only the off-targets with information are cleaned here, the others get their empty list in join
+            for column in columns_name:
+                information_df[column] = [[] if isinstance(values, float) else
+                                          [value for value in values if value is not np.nan and value != ""]
+                                          for values in information_df[column].tolist()]
+            self.list_columns.extend(columns_name)
+        self.tables.append(information_df)
+        self._information_df = None
+
+    def get_information_df(self):
+        """
+        Returns: dataframe of the information of all the databases, by off_target_id. An off-target has several rows
+        when a database added several rows for it
+        """
+        if self._information_df is None and self.tables:
+            # Most databases have one row per off-target, they are aligned on the index without a merge
+            unique_tables = [table for table in self.tables if table.index.is_unique]
+            information_df = pd.concat(unique_tables, axis=1) if unique_tables else None
+            for table in self.tables:
+                if not table.index.is_unique:
+                    information_df = table if information_df is None else \
+                        information_df.merge(table, how="outer", left_index=True, right_index=True)
+            information_df.index.name = "off_target_id"
+            self._information_df = information_df[self.columns]
+        return self._information_df
+
+    def get_column(self, column_name):
+        """
+        Returns: the values of the column by off_target_id, in the order of the off-targets, without the off-targets
+        that have no value
+        """
+        column = self.get_information_df()[column_name]
+        return column[column.notna()].sort_index(kind="stable")
+
+    def join(self, off_target_df):
+        """
+        Join the information to the off-targets, in one merge
+        Args:
+            off_target_df: the global off_target_df
+
+        Returns: the off_target_df with the information columns
+        """
+        if not self.tables:
+            return off_target_df
+        df_result = off_target_df.merge(self.get_information_df().reset_index(), how="left", on="off_target_id")
+
+        # The off-targets without information share one empty list, as fillna would. The lists are not changed in
+        # place. The columns are set at once, setting them one by one copies the table for every column
+        empty_list = np.empty(1, dtype=object)
+        empty_list[0] = []
+        columns = dict()
+        for column in df_result.columns:
+            columns[column] = df_result[column]
+            if column in self.list_columns:
+                values = df_result[column].to_numpy(dtype=object, copy=True)
+                values[pd.isna(values)] = empty_list
+                columns[column] = values
+        return pd.DataFrame(columns, index=df_result.index)
+
+
+def save_global_off_target_results(off_target_df, flashfry_score, columns_order=None, include_off_targets=True,
+                                   include_flashfry_score=True):
     """
     Args
     save the result as a json file that can be loaded later.
+    include_off_targets: when False the off-targets table is not serialized
+    include_flashfry_score: when False the FlashFry score table is not serialized
     :return:
     """
-    off_target_df = off_target_df.astype({"chromosome": "string"})
-    if columns_order:
-        for value in columns_order:
-            if value not in off_target_df.columns:
-                off_target_df[value] = ""
-        off_target_df = off_target_df[columns_order]
-    if flashfry_score is not None:
+    off_targets = "[]"
+    if include_off_targets:
+        off_target_df = off_target_df.astype({"chromosome": "string"})
+        if columns_order:
+            for value in columns_order:
+                if value not in off_target_df.columns:
+                    off_target_df[value] = ""
+            off_target_df = off_target_df[columns_order]
+        off_targets = off_target_df.to_json(orient="records")
+    if not include_flashfry_score:
+        flashfry_score = "[]"
+    elif flashfry_score is not None:
         flashfry_score = flashfry_score.to_json(orient="records")
     else:
         flashfry_score = pd.DataFrame().to_json()
-    save_result = {"off_targets": off_target_df.to_json(orient="records"),
+    save_result = {"off_targets": off_targets,
                    "flashfry_score": flashfry_score}
     return save_result
 
 
-def calculate_score(off_target_df, gencode_db = None, enhancer_atlas_db = None, remap_epd_db = None, omim_db = None, cosmic_db = None):
+def calculate_score(off_target_df, gene_risk_table, gencode_db=None, enhancer_atlas_db=None, remap_epd_db=None,
+                    omim_db=None, cosmic_db=None):
+    """
+    Set the risk score of the off-targets from their gene hits. An exon of a protein coding gene is High_coding if the
+    gene has a disease and else Medium_coding, a transcript of a protein coding gene is Low_coding, and the other
+    off-targets with ReMap EPD or Enhancer Atlas hits are Medium_regulatory or Low_regulatory
+    Args:
+        off_target_df: the global off-target dataframe
+        gene_risk_table: GeneRiskTable with the disease genes
+        gencode_db: GENCODE db with its result
+        enhancer_atlas_db: Enhancer Atlas db with its result
+        remap_epd_db: ReMap EPD db with its result
+        omim_db: OMIM db of the request. None will not count the OMIM diseases
+        cosmic_db: COSMIC db of the request. None will not count the COSMIC roles in cancer
+
+    Returns: the off-target dataframe with the risk_score column
+    """
     off_target_complete_col = ["chromosome", "start", "end", "off_target_id", "score", "strand", "mismatch"
                                "attributes", "id", "dna", "cr_rna", "gene_ensembl_id", "gene_symbol",
                                "segment", "mir_gene", "remap_epd_gene_ensembl_id",
@@ -855,107 +992,55 @@ def calculate_score(off_target_df, gencode_db = None, enhancer_atlas_db = None,
 
 
     off_target_df[missing_col] = ""
-    off_target_gencode_df = pd.DataFrame(columns=["gene_ensembl_id", "gene_type", "segment"])
-    off_target_remap_epd_df = pd.DataFrame(columns=["gene_ensembl_id"])
-    off_target_enhancer_atlas_df = pd.DataFrame(columns=["gene_ensembl_id"])
+    # All the gene hits of the off-targets, joined to the disease genes at once
+    hits = []
+    for hit_source, hit_db in [("gencode", gencode_db), ("remap_epd", remap_epd_db),
+                               ("enhancer_atlas", enhancer_atlas_db)]:
+        if hit_db and len(hit_db.complete_result.index) > 0:
+            hit_columns = ["off_target_id", "gene_ensembl_id"]
+            if hit_source == "gencode":
+                hit_columns += ["gene_type", "segment"]
+            hits.append(hit_db.complete_result[hit_columns].assign(hit_source=hit_source))
+    if len(hits) == 0:
+        off_target_df["risk_score"] = ""
+        return off_target_df
 
-    for row in off_target_df.itertuples():
-        risk_score = ""
-        if gencode_db and len(gencode_db.complete_result.index) > 0:
-            off_target_gencode_df = gencode_db.complete_result.loc[gencode_db.complete_result["off_target_id"] == row.off_target_id,["gene_ensembl_id", "gene_type", "segment"]]
-        if remap_epd_db and len(remap_epd_db.complete_result.index) > 0:
-            off_target_remap_epd_df = remap_epd_db.complete_result.loc[remap_epd_db.complete_result["off_target_id"] == row.off_target_id, ["gene_ensembl_id"]]
-        if enhancer_atlas_db and len(enhancer_atlas_db.complete_result.index) > 0:
-            off_target_enhancer_atlas_df = enhancer_atlas_db.complete_result.loc[enhancer_atlas_db.complete_result["off_target_id"] == row.off_target_id, ["gene_ensembl_id"]]
-
-        if len(off_target_gencode_df.index) > 0:
-            off_target_protein_coding_df = off_target_gencode_df.loc[off_target_gencode_df["gene_type"] == "protein_coding"]
-            if len(off_target_protein_coding_df.index) > 0:
-                off_target_exon_df = off_target_protein_coding_df.loc[off_target_protein_coding_df["segment"] == "exon"]
-
-                if len(off_target_exon_df.index) > 0:
-                    if query_have_disease(list(off_target_exon_df["gene_ensembl_id"]), omim_db, cosmic_db):
-                        risk_score = "High_coding"
-                    else:
-                        risk_score = "Medium_coding"
-
-                elif len(off_target_protein_coding_df.loc[off_target_protein_coding_df["segment"] == "transcript"].index) > 0:
-                    risk_score = "Low_coding"
-
-
-        if risk_score == "":
-            if len(off_target_remap_epd_df.index) > 0 or len(off_target_enhancer_atlas_df.index) > 0:
-                if query_have_disease(list(off_target_remap_epd_df["gene_ensembl_id"]), omim_db, cosmic_db) or \
-                        query_have_disease(list(off_target_enhancer_atlas_df["gene_ensembl_id"]), omim_db, cosmic_db):
-                    risk_score = "Medium_regulatory"
-                else:
-                    risk_score = "Low_regulatory"
+    hits_df = pd.concat(hits, ignore_index=True).reindex(
+        columns=["off_target_id", "gene_ensembl_id", "gene_type", "segment", "hit_source"])
+    disease_genes = gene_risk_table.get_disease_genes(omim_db is not None, cosmic_db is not None)
+    hits_df["has_disease"] = hits_df["gene_ensembl_id"].isin(disease_genes)
 
+    is_gencode = hits_df["hit_source"] == "gencode"
+    coding_df = hits_df.loc[is_gencode & (hits_df["gene_type"] == "protein_coding")]
+    exon_disease = coding_df.loc[coding_df["segment"] == "exon"].groupby("off_target_id")["has_disease"].any()
+    transcript_ids = coding_df.loc[coding_df["segment"] == "transcript", "off_target_id"].unique()
+    regulatory_disease = hits_df.loc[~is_gencode].groupby("off_target_id")["has_disease"].any()
 
-        off_target_df.loc[row.Index, "risk_score"] = risk_score
+    # The later scores take precedence: an exon over a transcript, and both over the regulatory hits
+    risk_score = pd.concat([regulatory_disease.map({True: "Medium_regulatory", False: "Low_regulatory"}),
+                            pd.Series("Low_coding", index=transcript_ids, dtype=object),
+                            exon_disease.map({True: "High_coding", False: "Medium_coding"})])
+    risk_score = risk_score[~risk_score.index.duplicated(keep="last")]
+    off_target_df["risk_score"] = off_target_df["off_target_id"].map(risk_score).fillna("")
 
     return off_target_df
 
 
-
-def query_omim_disease(gene_ensembl_id = [], omim_db = None):
-
-    result = pd.DataFrame(columns=["gene_ensembl_id", "disease_related", "inheritance_model"])
-    result = result.set_index("gene_ensembl_id")
-    if omim_db:
-        omim_db_df = omim_db.db_df[["gene_ensembl_id", "disease_related", "inheritance_model"]]
-        omim_db_df = omim_db_df.loc[~omim_db_df["gene_ensembl_id"].isna()].set_index("gene_ensembl_id")
-
-        if len(gene_ensembl_id) == 0:
-            result = pd.DataFrame(columns=["gene_ensembl_id", "disease_related", "inheritance_model"])
-            result = result.set_index("gene_ensembl_id")
-        else:
-            indices = set(gene_ensembl_id)
-            indices = list(indices.intersection(omim_db_df.index))
-            result = omim_db_df.loc[indices]
-
-    return result
-
-
-def query_cosmic_disease(gene_ensembl_id = [], cosmic_db = None):
-
-    result = pd.DataFrame(columns=["gene_ensembl_id", "role_in_cancer"])
-    result = result.set_index("gene_ensembl_id")
-
-    if cosmic_db:
-        cosmic_db_df = cosmic_db.db_df[["gene_ensembl_id", "Role in Cancer"]].rename(
-            columns={"Role in Cancer": "role_in_cancer"})
-        cosmic_db_df = cosmic_db_df.loc[~cosmic_db_df["gene_ensembl_id"].isna()].set_index("gene_ensembl_id")
-
-        if len(gene_ensembl_id) == 0:
-            result = pd.DataFrame(columns=["gene_ensembl_id", "role_in_cancer"])
-            result = result.set_index("gene_ensembl_id")
-        else:
-            indices = set(gene_ensembl_id)
-            indices = list(indices.intersection(cosmic_db_df.index))
-            result = cosmic_db_df.loc[indices]
-
-    return result
-
-def query_have_disease(gene_ensembl_id = [], omim_db = None, cosmic_db = None):
-
-    b_disease = False
-    omim_disease_df = query_omim_disease(gene_ensembl_id, omim_db)
-    cosmic_disease_df = query_cosmic_disease(gene_ensembl_id, cosmic_db)
-
-
-    if len(omim_disease_df.index) > 0:
-        b_disease = b_disease or len(omim_disease_df.loc[
-                                         ((~omim_disease_df["disease_related"].isna()) & (omim_disease_df["disease_related"].str.strip().str.len() > 0)) |
-                                         (~omim_disease_df["inheritance_model"].isna()) & (omim_disease_df["inheritance_model"].str.strip().str.len() > 0)].index) > 0
-    if len(cosmic_disease_df.index) > 0:
-        b_disease = b_disease or len(cosmic_disease_df.loc[(~cosmic_disease_df["role_in_cancer"].isna()) & (cosmic_disease_df["role_in_cancer"].str.strip().str.len() > 0)].index) > 0
-
-
-    return b_disease
-
-
-def get_enhanced_off_target_risk_summary(off_target_df, gencode_db = None, enhancer_atlas_db = None, remap_epd_db = None, omim_db = None, cosmic_db = None):
+def get_enhanced_off_target_risk_summary(off_target_df, gene_risk_table, gencode_db=None, enhancer_atlas_db=None,
+                                         remap_epd_db=None, omim_db=None, cosmic_db=None):
+    """
+    Args:
+        off_target_df: the global off-target dataframe, with the risk_score column
+        gene_risk_table: GeneRiskTable with the OMIM and COSMIC rows of the genes
+        gencode_db: GENCODE db with its result
+        enhancer_atlas_db: Enhancer Atlas db with its result
+        remap_epd_db: ReMap EPD db with its result
+        omim_db: OMIM db of the request. None will not add the OMIM columns
+        cosmic_db: COSMIC db of the request. None will not add the COSMIC columns
+
+    Returns: dataframe indexed by off_target_id with a row for every gene hit of the off-targets with a risk score,
+    and the OMIM and COSMIC rows of the gene
+    """
     off_target_risk_df = off_target_df.loc[off_target_df["risk_score"] != "",
                                            ["off_target_id", "cr_rna", "dna", "chromosome",
                                             "start", "end", "strand", "mismatch"]]
@@ -965,20 +1050,8 @@ def get_enhanced_off_target_risk_summary(off_target_df, gencode_db = None, enhan
     off_target_risk_df = off_target_risk_df.set_index("off_target_id")
 
 
-    omim_db_df = pd.DataFrame(columns=["gene_ensembl_id", "disease_related", "inheritance_model"])
-    omim_db_df = omim_db_df.set_index("gene_ensembl_id")
-    cosmic_db_df = pd.DataFrame(columns=["gene_ensembl_id", "role_in_cancer"])
-    cosmic_db_df = cosmic_db_df.set_index("gene_ensembl_id")
-
-    if omim_db:
-        omim_db_df = omim_db.db_df[["gene_ensembl_id", "disease_related", "inheritance_model"]]
-        omim_db_df = omim_db_df.loc[~omim_db_df["gene_ensembl_id"].isna()].set_index("gene_ensembl_id")
-
-    if cosmic_db:
-        cosmic_db_df = cosmic_db.db_df[["gene_ensembl_id", "Role in Cancer"]].rename(
-            columns={"Role in Cancer": "role_in_cancer"})
-        cosmic_db_df = cosmic_db_df.loc[~cosmic_db_df["gene_ensembl_id"].isna()].set_index("gene_ensembl_id")
-
+    # The OMIM and COSMIC rows of the genes, joined once for every database version
+    disease_df = gene_risk_table.get_disease_df(omim_db is not None, cosmic_db is not None)
 
     if gencode_db and len(gencode_db.complete_result.index) > 0:
         custom_gencode_db = gencode_db.complete_result[["off_target_id", "gene_ensembl_id", "gene_symbol", "gene_type", "segment"]]
@@ -989,14 +1062,9 @@ def get_enhanced_off_target_risk_summary(off_target_df, gencode_db = None, enhan
         off_target_risk_df = pd.merge(left=off_target_risk_df, right=custom_gencode_db,
                                       left_index=True, right_index=True, how='left')
 
-        if len(omim_db_df.index) > 0:
-            off_target_risk_df = pd.merge(left=off_target_risk_df,
-                                          right=omim_db_df.add_prefix('{}_'.format("gencode_omim")),
-                                          left_on='gencode_gene_ensembl_id', right_index=True, how='left')
-        if len(cosmic_db_df.index) > 0:
-            off_target_risk_df = pd.merge(left=off_target_risk_df,
-                                          right=cosmic_db_df.add_prefix('{}_'.format("gencode_cosmic")),
-                                          left_on='gencode_gene_ensembl_id', right_index=True, how='left')
+        if disease_df is not None:
+            off_target_risk_df = pd.merge(left=off_target_risk_df, right=disease_df.add_prefix("gencode_"),
+                                          left_on="gencode_gene_ensembl_id", right_index=True, how="left")
 
     if enhancer_atlas_db and len(enhancer_atlas_db.complete_result.index) > 0:
         custom_enhancer_atlas_db = enhancer_atlas_db.complete_result[
@@ -1009,14 +1077,9 @@ def get_enhanced_off_target_risk_summary(off_target_df, gencode_db = None, enhan
         off_target_risk_df = pd.merge(left=off_target_risk_df, right=custom_enhancer_atlas_db,
                                       left_index=True, right_index=True, how='left')
 
-        if len(omim_db_df.index) > 0:
-            off_target_risk_df = pd.merge(left=off_target_risk_df,
-                                          right=omim_db_df.add_prefix('{}_'.format("enhanceratlas_omim")),
-                                          left_on='enhanceratlas_gene_ensembl_id', right_index=True, how='left')
-        if len(cosmic_db_df.index) > 0:
-            off_target_risk_df = pd.merge(left=off_target_risk_df,
-                                          right=cosmic_db_df.add_prefix('{}_'.format("enhanceratlas_cosmic")),
-                                          left_on='enhanceratlas_gene_ensembl_id', right_index=True, how='left')
+        if disease_df is not None:
+            off_target_risk_df = pd.merge(left=off_target_risk_df, right=disease_df.add_prefix("enhanceratlas_"),
+                                          left_on="enhanceratlas_gene_ensembl_id", right_index=True, how="left")
 
     if remap_epd_db and len(remap_epd_db.complete_result.index) > 0:
         custom_remap_epd_db = remap_epd_db.complete_result[
@@ -1030,14 +1093,9 @@ def get_enhanced_off_target_risk_summary(off_target_df, gencode_db = None, enhan
         off_target_risk_df = pd.merge(left=off_target_risk_df, right=custom_remap_epd_db,
                                       left_index=True, right_index=True, how='left')
 
-        if len(omim_db_df.index) > 0:
-            off_target_risk_df = pd.merge(left=off_target_risk_df,
-                                          right=omim_db_df.add_prefix('{}_'.format("remapepd_omim")),
-                                          left_on='remapepd_gene_ensembl_id', right_index=True, how='left')
-        if len(cosmic_db_df.index) > 0:
-            off_target_risk_df = pd.merge(left=off_target_risk_df,
-                                          right=cosmic_db_df.add_prefix('{}_'.format("remapepd_cosmic")),
-                                          left_on='remapepd_gene_ensembl_id', right_index=True, how='left')
+        if disease_df is not None:
+            off_target_risk_df = pd.merge(left=off_target_risk_df, right=disease_df.add_prefix("remapepd_"),
+                                          left_on="remapepd_gene_ensembl_id", right_index=True, how="left")
 
 
     return off_target_risk_df
@@ -1108,21 +1166,19 @@ def update_database(db_list):
 def save_db_result(db_list):
     """
     Save all the dataframe complete_result for all db
-    Returns: jsonify object
+    Returns: dictionary of "<db name>_result_list" to the processed result of the db
 
     """
-    app = Flask(__name__)
-    with app.app_context():
-        all_result = dict()
-        for db in db_list:
-            result_db_list = db.get_pr_df()
-            db_name = db.get_db_name()
-            if result_db_list:
-                log.info("Saving {}".format(db_name))
-                all_result.update({"{}_result_list".format(db.get_db_name()): result_db_list})
-            else:
-                log.info("No result for {}".format(db_name))
-        return jsonify(all_result)
+    all_result = dict()
+    for db in db_list:
+        result_db_list = db.get_pr_df()
+        db_name = db.get_db_name()
+        if result_db_list:
+            log.info("Saving {}".format(db_name))
+            all_result.update({"{}_result_list".format(db.get_db_name()): result_db_list})
+        else:
+            log.info("No result for {}".format(db_name))
+    return all_result
 
 
 def update_database_base_path(new_base_path):
@@ -1140,6 +1196,75 @@ def update_database_base_path(new_base_path):
         log.error("Given path: {} , is not a valid directory".format(new_base_path))
 
 
+# Separator of the databases that are loaded as tables
+TABLE_DB_SEPARATORS = {"omim": "\t", "humantf": "\t", "protein_atlas": ",", "rbp": "\t", "cosmic": "\t"}
+
+
+def get_table_db_paths(databases_conf, organism="human", version_path=None):
+    """
+    Args:
+        databases_conf: the databases section of the configuration
+        organism: the organism of the databases
+        version_path: directory of the database version. if None the files in the base path are used
+
+    Returns: dictionary of the name of every table database with a file to its file path and separator
+    """
+    table_paths = {}
+    for db_name, sep in TABLE_DB_SEPARATORS.items():
+        file_path = databases_conf.get(db_name, {}).get(organism, {}).get("path")
+        if not file_path:
+            continue
+        file_path = get_db_file_path(file_path, version_path)
+        if not os.path.exists(file_path):
+            log.error("File for db {} in {} does not exist".format(db_name, file_path))
+            continue
+        table_paths[db_name] = (file_path, sep)
+    return table_paths
+
+
+def get_gene_risk_table(databases_conf, organism="human", version_path=None):
+    """
+    Returns: the GeneRiskTable of the gene databases of the version. It is built on the first call
+    """
+    return load_gene_risk_table(get_table_db_paths(databases_conf, organism, version_path))
+
+
+def warm_up_databases(databases_conf, organism="human", version_path=None, freeze=True):
+    """
+    Load all the table databases and build their gene risk table once, before the server workers are forked, so the
+    workers share them copy-on-write instead of loading their own copy. The BED databases are read by bedtools from
+    the files
+    Args:
+        databases_conf: the databases section of the configuration
+        organism: the organism to load
+        version_path: directory of the database version to load. if None the files in the base path are loaded
+        freeze: move the loaded objects to the permanent generation of the garbage collector
+    """
+    table_paths = get_table_db_paths(databases_conf, organism, version_path)
+    for file_path, sep in table_paths.values():
+        load_table(file_path, sep=sep)
+    load_gene_risk_table(table_paths)
+    if freeze:
+        freeze_loaded_tables()
+
+
+def get_db_file_path(file_path, version_path=None):
+    """
+    Args:
+        file_path: path of a database file relative to the database base path, or an absolute path
+        version_path: directory of a database version. The file is taken from it if it exists there
+
+    Returns: the full path of the database file
+    """
+    if os.path.isabs(file_path):
+        return file_path
+    if version_path:
+        versioned_file_path = os.path.join(version_path, file_path)
+        if os.path.exists(versioned_file_path):
+            return versioned_file_path
+    return "{}/{}".format(database_base_path, file_path)
+
+
 def get_database_path():
     """
 
@@ -0,0 +1,248 @@
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+from datetime import datetime
+
+import gene_risk
+import table_store
+from db import get_database_path, get_db_file_path, warm_up_databases
+
+log = logging.getLogger(__name__)
+
+VERSIONS_DIR_NAME = "versions"
+CURRENT_LINK_NAME = "current"
+MANIFEST_FILE_NAME = "manifest.json"
+VERSION_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*$")
+
+BUILDING = "building"
+READY = "ready"
+FAILED = "failed"
+
+# The version directory used by the last request of this process
+_last_version_path = None
+_build_lock = threading.Lock()
+
+
+class DbVersionError(Exception):
+    pass
+
+
+def get_versions_path():
+    return os.path.join(get_database_path(), VERSIONS_DIR_NAME)
+
+
+def get_version_path(version):
+    return os.path.join(get_versions_path(), version)
+
+
+def _get_status_path(version):
+    return os.path.join(get_versions_path(), ".{}.status.json".format(version))
+
+
+def _write_json(path, content):
+    """
+    Write a JSON file atomically
+    """
+    tmp_path = "{}.tmp.{}".format(path, os.getpid())
+    with open(tmp_path, "w") as json_file:
+        json.dump(content, json_file, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _set_status(version, status, message=""):
+    _write_json(_get_status_path(version), {"version": version, "status": status, "message": message,
+                                             "updated": datetime.now().isoformat()})
+
+
+def get_current_version_path():
+    """
+    Get the directory of the current database version. A request should call it once and use the returned directory
+    for all its databases, so it keeps using the same version even if a new one is activated meanwhile
+    Returns: the real path of the current version directory, or None if the databases are not versioned
+    """
+    global _last_version_path
+    current_link = os.path.join(get_database_path(), CURRENT_LINK_NAME)
+    if not os.path.islink(current_link):
+        return None
+    version_path = os.path.realpath(current_link)
+    if version_path != _last_version_path:
+        if _last_version_path is not None:
+            log.info("Database version changed from {} to {}".format(_last_version_path, version_path))
+            # Tables of the previous version are dropped from the cache. Running requests keep their own reference
+            table_store.evict_tables(_last_version_path)
+            gene_risk.evict_gene_risk_tables(_last_version_path)
+        _last_version_path = version_path
+    return version_path
+
+
+def get_current_version():
+    """
+    Returns: the name of the current database version, or None if the databases are not versioned
+    """
+    version_path = get_current_version_path()
+    return os.path.basename(version_path) if version_path else None
+
+
+def get_version_status(version):
+    """
+    Returns: the build status of the version, or None if it has none
+    """
+    try:
+        with open(_get_status_path(version)) as status_file:
+            return json.load(status_file).get("status")
+    except (OSError, ValueError):
+        return None
+
+
+def read_manifest(version):
+    with open(os.path.join(get_version_path(version), MANIFEST_FILE_NAME)) as manifest_file:
+        return json.load(manifest_file)
+
+
+def list_versions():
+    """
+    Returns: list of the database versions with their manifest and build status
+    """
+    versions_path = get_versions_path()
+    if not os.path.isdir(versions_path):
+        return []
+    current_version = get_current_version()
+    versions = []
+    for file_name in sorted(os.listdir(versions_path)):
+        match = re.match(r"^\.(.+)\.status\.json$", file_name)
+        if not match:
+            continue
+        version = match.group(1)
+        with open(os.path.join(versions_path, file_name)) as status_file:
+            version_info = json.load(status_file)
+        version_info["current"] = version == current_version
+        if version_info["status"] == READY:
+            version_info["manifest"] = read_manifest(version)
+        versions.append(version_info)
+    return versions
+
+
+def _check_version_name(version):
+    """
+    Raise ValueError if the version name is not a plain directory name, for example "../x"
+    """
+    if not isinstance(version, str) or not VERSION_PATTERN.match(version):
+        raise ValueError("Version name should contain only letters, digits, '.', '_' and '-'")
+
+
+def _link_file(source_path, target_path):
+    """
+    Hard link a file into the new version, or copy it if it is on another file system
+    """
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    try:
+        os.link(source_path, target_path)
+    except OSError:
+        shutil.copy2(source_path, target_path)
+
+
+def build_version(version, source_path, databases_conf, organism="human", activate=True):
+    """
+    Build a new database version. Files found in source_path are used, and the other databases are taken from the
+    current version. The table databases are loaded (and published in shared memory) before the version is
+    activated, so the first requests on the new version do not load them
+    Args:
+        version: the name of the new version
+        source_path: directory with the new database files, in the same layout as the database base path
+        databases_conf: the databases section of the configuration
+        organism: the organism of the databases
+        activate: make the new version the current version when it is ready
+    """
+    with _build_lock:
+        version_path = get_version_path(version)
+        building_path = os.path.join(get_versions_path(), ".{}.building".format(version))
+        # The version directory is removed if the build fails after it was created
+        created_version_path = False
+        try:
+            current_version_path = get_current_version_path()
+            shutil.rmtree(building_path, ignore_errors=True)
+            manifest = {"version": version, "created": datetime.now().isoformat(), "source": source_path,
+                        "databases": {}}
+            for db_name, db_conf in databases_conf.items():
+                if not isinstance(db_conf, dict) or not db_conf.get(organism, {}).get("path"):
+                    continue
+                relative_path = db_conf[organism]["path"]
+                new_file_path = os.path.join(source_path, relative_path)
+                if not os.path.exists(new_file_path):
+                    new_file_path = get_db_file_path(relative_path, current_version_path)
+                if not os.path.exists(new_file_path):
+                    raise DbVersionError("No file for db {}: {}".format(db_name, relative_path))
+                _link_file(new_file_path, os.path.join(building_path, relative_path))
+                file_stat = os.stat(new_file_path)
+                manifest["databases"][db_name] = {"path": relative_path, "source": new_file_path,
+                                                  "size": file_stat.st_size, "mtime": file_stat.st_mtime}
+            _write_json(os.path.join(building_path, MANIFEST_FILE_NAME), manifest)
+            os.rename(building_path, version_path)
+            created_version_path = True
+
+            log.info("Loading the tables of database version {}".format(version))
+            warm_up_databases(databases_conf, organism, version_path, freeze=False)
+            _set_status(version, READY)
+            log.info("Database version {} is ready".format(version))
+        except Exception as e:
+            log.error("Failed to build database version {}: {}".format(version, e))
+            shutil.rmtree(building_path, ignore_errors=True)
+            if created_version_path:
+                table_store.evict_tables(version_path)
+                gene_risk.evict_gene_risk_tables(version_path)
+                shutil.rmtree(version_path, ignore_errors=True)
+            _set_status(version, FAILED, str(e))
+            return
+        if activate:
+            try:
+                activate_version(version)
+            except Exception as e:
+                log.error("Failed to activate database version {}: {}".format(version, e))
+
+
+def start_build_version(version, source_path, databases_conf, organism="human", activate=True):
+    """
+    Build a new database version in a background thread
+    Args:
+        version: the name of the new version
+        source_path: directory with the new database files
+        databases_conf: the databases section of the configuration
+        organism: the organism of the databases
+        activate: make the new version the current version when it is ready
+    """
+    _check_version_name(version)
+    if not os.path.isdir(source_path):
+        raise ValueError("Source path {} is not a directory".format(source_path))
+    if os.path.exists(get_version_path(version)):
+        raise ValueError("Database version {} already exists".format(version))
+    os.makedirs(get_versions_path(), exist_ok=True)
+    _set_status(version, BUILDING)
+    thread = threading.Thread(target=build_version, args=(version, source_path, databases_conf, organism, activate),
+                              daemon=True)
+    thread.start()
+    return thread
+
+
+def activate_version(version):
+    """
+    Make version the current database version. Only a version with the ready status can be activated. The current
+    link is replaced atomically, running requests finish on the version they started with
+    Args:
+        version: the name of the version
+    """
+    _check_version_name(version)
+    version_path = get_version_path(version)
+    if not os.path.isfile(os.path.join(version_path, MANIFEST_FILE_NAME)):
+        raise ValueError("Database version {} does not exist".format(version))
+    if get_version_status(version) != READY:
+        raise ValueError("Database version {} is not ready".format(version))
+    current_link = os.path.join(get_database_path(), CURRENT_LINK_NAME)
+    tmp_link = "{}.tmp.{}".format(current_link, os.getpid())
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(os.path.join(VERSIONS_DIR_NAME, version), tmp_link)
+    os.replace(tmp_link, current_link)
+    log.info("Database version {} is now the current version".format(version))
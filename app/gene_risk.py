@@ -0,0 +1,239 @@
+import logging
+import os
+from functools import reduce
+
+import pandas as pd
+
+from metrics import count_cache
+from table_store import load_table
+
+log = logging.getLogger(__name__)
+
+GENE_COLUMN = "gene_ensembl_id"
+# The Protein Atlas expression levels and the integers they are encoded to
+EXPRESSION_LEVELS = {value: i for i, value in
+                     enumerate(["Not representative", "None", "Not detected", "Low", "Medium", "High"])}
+EXPRESSION_LEVELS["Ascending"] = 1
+# The columns of every gene database in the gene risk table, and their name in it
+GENE_RISK_COLUMNS = {"omim": {"disease_related": "disease_related", "inheritance_model": "inheritance_model"},
+                     "cosmic": {"Role in Cancer": "role_in_cancer"},
+                     "humantf": {"HumanTF_source": "HumanTF_source"},
+                     "rbp": {},
+                     "protein_atlas": None}
+
+# Gene risk tables by the files they were built from
+_gene_risk_tables = {}
+
+
+def is_filled(values):
+    """
+    Returns: boolean series, true where the value is a string that is not blank
+    """
+    return values.map(lambda value: isinstance(value, str) and len(value.strip()) > 0).astype(bool)
+
+
+def encode_expression(protein_atlas_df):
+    """
+    Encode the expression levels of Protein Atlas rows to "<gene symbol>:(<level>,<level>,...)", with the levels as
+    the integers of EXPRESSION_LEVELS and missing levels as "None"
+    Args:
+        protein_atlas_df: rows of Protein Atlas, with the gene id, the gene symbol and a column for every tissue
+
+    Returns: series of the encoded expression of every row
+    """
+    levels_df = protein_atlas_df.drop([GENE_COLUMN, "gene_symbol"], axis=1).fillna("None")
+    levels_df = levels_df.replace(EXPRESSION_LEVELS).astype(str)
+    if len(levels_df.columns) == 0:
+        levels = pd.Series("", index=protein_atlas_df.index)
+    else:
+        levels = reduce(lambda left, right: left + "," + right,
+                        (levels_df[column] for column in levels_df.columns))
+    return protein_atlas_df["gene_symbol"].astype("string").astype(str) + ":(" + levels + ")"
+
+
+class GeneRiskTable(object):
+    """
+    The information of the databases that are keyed by gene, joined to one table indexed by gene id: the disease
+    flags, diseases and inheritance models of OMIM, the role in cancer of COSMIC, the source of HumanTF, whether the
+    gene is an RBP and the encoded expression of Protein Atlas. It is built once for every database version, so the
+    requests join their gene hits to it instead of filtering every database. It also keeps the position of the rows
+    of every gene in its database, so the gene hits of all the off-targets are joined to the rows of the databases in
+    one merge
+    """
+
+    def __init__(self, omim_df=None, cosmic_df=None, humantf_df=None, rbp_df=None, protein_atlas_df=None):
+        """
+        The rows of every database are indexed by their position in the database
+        Args:
+            omim_df: OMIM rows with gene_ensembl_id, disease_related and inheritance_model
+            cosmic_df: COSMIC rows with gene_ensembl_id and role_in_cancer
+            humantf_df: HumanTF rows with gene_ensembl_id and HumanTF_source
+            rbp_df: RBP rows with gene_ensembl_id
+            protein_atlas_df: all the Protein Atlas rows
+        """
+        self.gene_rows_df = self._get_gene_rows({"omim": omim_df, "cosmic": cosmic_df, "humantf": humantf_df,
+                                                 "rbp": rbp_df, "protein_atlas": protein_atlas_df})
+        self.omim_df = self._index_by_gene(omim_df, ["disease_related", "inheritance_model"])
+        self.cosmic_df = self._index_by_gene(cosmic_df, ["role_in_cancer"])
+        humantf_df = self._index_by_gene(humantf_df, ["HumanTF_source"])
+        rbp_df = self._index_by_gene(rbp_df, [])
+        if protein_atlas_df is None:
+            protein_atlas_df = pd.DataFrame(columns=[GENE_COLUMN, "gene_symbol"])
+        protein_atlas_df = protein_atlas_df.loc[protein_atlas_df[GENE_COLUMN].notna()]
+        self.expression_df = pd.DataFrame({GENE_COLUMN: protein_atlas_df[GENE_COLUMN],
+                                           "expression_information": encode_expression(protein_atlas_df)})
+        self._disease_dfs = {}
+
+        omim_disease = is_filled(self.omim_df["disease_related"]) | is_filled(self.omim_df["inheritance_model"])
+        genes = [omim_disease.groupby(level=0).any().rename("omim_disease"),
+                 is_filled(self.cosmic_df["role_in_cancer"]).groupby(level=0).any().rename("cosmic_disease"),
+                 self.omim_df.groupby(level=0).agg(list),
+                 self.cosmic_df.groupby(level=0).agg(list),
+                 humantf_df.groupby(level=0).agg(list),
+                 pd.Series(True, index=rbp_df.index.unique(), name="rbp", dtype=bool),
+                 self.expression_df.groupby(GENE_COLUMN)["expression_information"].agg(list)]
+        self.genes_df = pd.concat(genes, axis=1)
+        self.genes_df.index.name = GENE_COLUMN
+        for column in ["omim_disease", "cosmic_disease", "rbp"]:
+            self.genes_df[column] = self.genes_df[column].fillna(False).astype(bool)
+
+    @staticmethod
+    def _index_by_gene(df, columns):
+        """
+        Returns: the rows of df that have a gene id, indexed by it, with the given columns
+        """
+        if df is None:
+            df = pd.DataFrame(columns=[GENE_COLUMN] + columns)
+        return df.loc[df[GENE_COLUMN].notna(), [GENE_COLUMN] + columns].set_index(GENE_COLUMN)
+
+    @staticmethod
+    def _get_gene_rows(dfs):
+        """
+        Args:
+            dfs: dictionary of database name to its rows, indexed by their position in the database
+
+        Returns: dataframe with gene_ensembl_id, db_name and row, the position of the row in its database, for every
+            row with a gene id
+        """
+        gene_rows = [pd.DataFrame({GENE_COLUMN: df[GENE_COLUMN].to_numpy(), "db_name": db_name,
+                                   "row": df.index.to_numpy()})
+                     for db_name, df in dfs.items() if df is not None]
+        if len(gene_rows) == 0:
+            return pd.DataFrame(columns=[GENE_COLUMN, "db_name", "row"])
+        gene_rows_df = pd.concat(gene_rows, ignore_index=True)
+        return gene_rows_df.loc[gene_rows_df[GENE_COLUMN].notna() & (gene_rows_df[GENE_COLUMN] != "")]
+
+    def __len__(self):
+        return len(self.genes_df.index)
+
+    def get_disease_genes(self, omim=True, cosmic=True):
+        """
+        Args:
+            omim: count the diseases and the inheritance models of OMIM
+            cosmic: count the role in cancer of COSMIC
+
+        Returns: index of the genes with a disease
+        """
+        has_disease = pd.Series(False, index=self.genes_df.index)
+        if omim:
+            has_disease |= self.genes_df["omim_disease"]
+        if cosmic:
+            has_disease |= self.genes_df["cosmic_disease"]
+        return self.genes_df.index[has_disease.values]
+
+    def get_disease_df(self, omim=True, cosmic=True):
+        """
+        The OMIM and COSMIC rows of every gene, joined once, with the columns omim_disease_related,
+        omim_inheritance_model and cosmic_role_in_cancer. A gene hit joined to it gets the same rows as when joined to
+        OMIM and then to COSMIC
+        Args:
+            omim: include OMIM
+            cosmic: include COSMIC
+
+        Returns: dataframe indexed by gene id, or None if there is nothing to join
+        """
+        key = (omim, cosmic)
+        if key not in self._disease_dfs:
+            disease_dfs = []
+            if omim and len(self.omim_df.index) > 0:
+                disease_dfs.append(self.omim_df.add_prefix("omim_"))
+            if cosmic and len(self.cosmic_df.index) > 0:
+                disease_dfs.append(self.cosmic_df.add_prefix("cosmic_"))
+            disease_df = reduce(lambda left, right: pd.merge(left, right, left_index=True, right_index=True,
+                                                             how="outer"), disease_dfs) if disease_dfs else None
+            self._disease_dfs[key] = disease_df
+        return self._disease_dfs[key]
+
+    def get_expression(self, gene_hits_df):
+        """
+        Args:
+            gene_hits_df: dataframe with off_target_id and gene_ensembl_id
+
+        Returns: the encoded expression of the Protein Atlas rows of the genes, with the off_target_id of their hit
+        """
+        gene_hits_df = gene_hits_df[["off_target_id", GENE_COLUMN]].drop_duplicates()
+        return pd.merge(gene_hits_df, self.expression_df, on=GENE_COLUMN)
+
+
+    def join_gene_hits(self, hits_df, db_names=None):
+        """
+        Join the gene hits of the off-targets to the rows of the gene databases, in one merge. A gene that is hit by
+        several off-targets gets its rows for every one of them
+        Args:
+            hits_df: dataframe with off_target_id, gene_ensembl_id and hit_source, the database of the hit (gencode,
+                enhancer_atlas or remap_epd)
+            db_names: the gene databases to join to. None will join to all of them
+
+        Returns: dataframe with off_target_id, gene_ensembl_id, hit_source, db_name and row, the position of the row
+            in its database, sorted by database, hit source and row
+        """
+        hits_df = hits_df.loc[hits_df[GENE_COLUMN].notna() & (hits_df[GENE_COLUMN] != ""),
+                              ["off_target_id", GENE_COLUMN, "hit_source"]].drop_duplicates()
+        hits_df = hits_df.astype({"off_target_id": int})
+        gene_rows_df = self.gene_rows_df
+        if db_names is not None:
+            gene_rows_df = gene_rows_df.loc[gene_rows_df["db_name"].isin(db_names)]
+        gene_hits_df = pd.merge(hits_df, gene_rows_df, on=GENE_COLUMN)
+        return gene_hits_df.sort_values(["db_name", "hit_source", "row", "off_target_id"], ignore_index=True)
+
+
+def load_gene_risk_table(table_paths):
+    """
+    Build the gene risk table of the gene databases. It is built once for every set of files
+    Args:
+        table_paths: dictionary of database name (omim, cosmic, humantf, rbp or protein_atlas) to the path of its
+            file and its separator. Missing databases are empty in the table
+
+    Returns: GeneRiskTable
+    """
+    key = tuple(sorted((db_name, os.path.realpath(file_path)) for db_name, (file_path, sep) in table_paths.items()))
+    if key in _gene_risk_tables:
+        count_cache("gene_risk", "hit")
+        return _gene_risk_tables[key]
+    count_cache("gene_risk", "miss")
+    tables = {}
+    for db_name, (file_path, sep) in table_paths.items():
+        columns = GENE_RISK_COLUMNS[db_name]
+        table = load_table(file_path, sep=sep)
+        if columns is None:
+            tables[db_name] = table.to_frame()
+        else:
+            tables[db_name] = table.to_frame(columns=[GENE_COLUMN] + list(columns)).rename(columns=columns)
+    gene_risk_table = GeneRiskTable(tables.get("omim"), tables.get("cosmic"), tables.get("humantf"),
+                                    tables.get("rbp"), tables.get("protein_atlas"))
+    log.info("Built the gene risk table of {}: {} genes".format(", ".join(sorted(tables)), len(gene_risk_table)))
+    _gene_risk_tables[key] = gene_risk_table
+    return gene_risk_table
+
+
+def evict_gene_risk_tables(path_prefix):
+    """
+    Remove the gene risk tables that were built from files under path_prefix, for example of a replaced database
+    version
+    Args:
+        path_prefix: directory of the files
+    """
+    path_prefix = os.path.join(os.path.realpath(path_prefix), "")
+    for key in [key for key in _gene_risk_tables if any(path.startswith(path_prefix) for _, path in key)]:
+        del _gene_risk_tables[key]
+        log.debug("Evicted gene risk table: {}".format(key))
@@ -2,16 +2,19 @@ import gzip
 import logging
 import os
 import re
-import gffutils
 import pandas as pd
-from validators import url, ValidationFailure
 from pydantic import BaseModel, validator
 from typing import List
 
 import configuration_files.const as const
+from lazy_import import lazy_import
+from structured_log import configure_logging
 
 log = logging.getLogger(__name__)
 
+# Only the CLI configuration validates addresses
+validators = lazy_import("validators")
+
 COL_ORDER = ["chrom", "start", "end", "name", "score", "strand", "frame", "attribute"]
 
 
@@ -35,8 +38,8 @@ class ConfigurationFile(BaseModel):
 
     @validator("run_cas_offinder_api")
     def val_run_cas_offinder_api(cls, v):
-        test = url(v)
-        if type(test) == ValidationFailure:
+        test = validators.url(v)
+        if type(test) == validators.ValidationFailure:
             raise ValueError("Not a valid address")
         return v
 
@@ -126,13 +129,20 @@ def init_logger(log_file=const.LOG_PATH, debug_level=logging.DEBUG, logger_name=
     logger.addHandler(console)
 
 
-def get_logger(logger_name, debug_level=logging.DEBUG):
-    logging.basicConfig(
-        level=debug_level,
-        format="%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S",
-    )
+def get_logger(logger_name, debug_level=None):
+    """
+    Get a logger that writes to the structured handler of the root logger
+    Args:
+        logger_name: name of the logger
+        debug_level: level of this logger only. By default the level of the root logger, see
+        structured_log.update_logging_settings
+
+    Returns: the logger
+    """
+    configure_logging()
     logger = logging.getLogger(logger_name)
+    if debug_level is not None:
+        logger.setLevel(debug_level)
 
     return logger
 
@@ -0,0 +1,180 @@
+import glob
+import hashlib
+import logging
+import os
+import tempfile
+import time
+import uuid
+
+from timings import Timings
+
+log = logging.getLogger(__name__)
+
+# Default time budget in seconds of a request. None means no deadline
+default_deadline = None
+# Directory of the job files, shared by all the workers on the machine so any worker can cancel a job
+jobs_dir = os.path.join(tempfile.gettempdir(), "off-risk-jobs")
+# Seconds to wait after SIGTERM before a tool process is killed
+kill_grace_period = 5
+
+DEADLINE_HEADER = "X-OffRisk-Deadline"
+
+
+class JobError(Exception):
+    status_code = 500
+
+
+class JobCancelled(JobError):
+    status_code = 499
+
+
+class JobDeadlineExceeded(JobError):
+    status_code = 504
+
+
+class Job(object):
+
+    def __init__(self, request_id, deadline=None):
+        """
+        Track a single request, its deadline and cancellation. The job is registered in jobs_dir until close is called
+        Args:
+            request_id: the request ID
+            deadline: time budget of the request in seconds. if None default_deadline is used
+        """
+        self.request_id = str(request_id)
+        self.deadline = deadline if deadline is not None else default_deadline
+        self.start_time = time.time()
+        self.timings = Timings()
+        self.expire_time = time.monotonic() + self.deadline if self.deadline else None
+        os.makedirs(jobs_dir, exist_ok=True)
+        self.job_path = os.path.join(jobs_dir, "{}-{}.job".format(_get_job_key(self.request_id), uuid.uuid4().hex))
+        with open(self.job_path, "w") as job_file:
+            job_file.write(str(os.getpid()))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def remaining(self):
+        """
+        Returns: the remaining seconds until the deadline, or None if there is no deadline
+        """
+        if self.expire_time is None:
+            return None
+        return max(0.0, self.expire_time - time.monotonic())
+
+    def is_expired(self):
+        return self.expire_time is not None and time.monotonic() >= self.expire_time
+
+    def is_cancelled(self):
+        """
+        Returns: True if the job was cancelled after it started, by any worker
+        """
+        cancel_path = _get_cancel_path(self.request_id)
+        try:
+            return os.path.getmtime(cancel_path) >= self.start_time
+        except OSError:
+            return False
+
+    def check(self):
+        """
+        Raise JobCancelled or JobDeadlineExceeded if the job should stop
+        """
+        if self.is_cancelled():
+            raise JobCancelled("Request {} was cancelled".format(self.request_id))
+        if self.is_expired():
+            raise JobDeadlineExceeded("Request {} exceeded its deadline of {} seconds".format(
+                self.request_id, self.deadline))
+
+    def should_stop(self):
+        """
+        Returns: True if the job was cancelled or expired
+        """
+        return self.is_cancelled() or self.is_expired()
+
+    def close(self):
+        """
+        Unregister the job
+        """
+        if os.path.exists(self.job_path):
+            os.remove(self.job_path)
+        # The cancel marker is kept while other jobs with the same request ID are running
+        if not _get_job_paths(self.request_id):
+            cancel_path = _get_cancel_path(self.request_id)
+            if os.path.exists(cancel_path):
+                os.remove(cancel_path)
+
+
+def _get_job_key(request_id):
+    # A hash of the request ID, so distinct IDs never share the file names of their jobs and cancel markers
+    return hashlib.sha256(str(request_id).encode("utf-8")).hexdigest()[:32]
+
+
+def _get_cancel_path(request_id):
+    return os.path.join(jobs_dir, "{}.cancel".format(_get_job_key(request_id)))
+
+
+def _get_job_paths(request_id):
+    """
+    Returns: the job files of running jobs with request_id. Files of dead workers are removed
+    """
+    job_paths = []
+    for job_path in glob.glob(os.path.join(jobs_dir, "{}-*.job".format(_get_job_key(request_id)))):
+        try:
+            with open(job_path) as job_file:
+                os.kill(int(job_file.read()), 0)
+            job_paths.append(job_path)
+        except ProcessLookupError:
+            os.remove(job_path) if os.path.exists(job_path) else None
+        except (OSError, ValueError):
+            continue
+    return job_paths
+
+
+def cancel_job(request_id):
+    """
+    Cancel all the running jobs with request_id
+    Args:
+        request_id: the request ID
+
+    Returns: True if a running job was found
+    """
+    if not _get_job_paths(request_id):
+        return False
+    os.makedirs(jobs_dir, exist_ok=True)
+    with open(_get_cancel_path(request_id), "w") as cancel_file:
+        cancel_file.write(str(time.time()))
+    log.info("Request {} was cancelled".format(request_id))
+    return True
+
+
+def check_job(job):
+    """
+    Raise if job should stop. Does nothing if job is None
+    """
+    if job is not None:
+        job.check()
+
+
+def get_kill_grace_period():
+    return kill_grace_period
+
+
+def update_job_settings(deadline=None, directory=None, grace_period=None):
+    """
+    Update the job settings
+    Args:
+        deadline: default time budget of a request in seconds
+        directory: directory of the job files
+        grace_period: seconds to wait after SIGTERM before a tool process is killed
+    """
+    global default_deadline, jobs_dir, kill_grace_period
+    if deadline is not None:
+        default_deadline = deadline
+    if directory:
+        jobs_dir = directory
+    if grace_period is not None:
+        kill_grace_period = grace_period
+    log.info("Default request deadline: {}, jobs directory: {}".format(default_deadline, jobs_dir))
@@ -0,0 +1,29 @@
+import importlib.util
+import logging
+import sys
+
+log = logging.getLogger(__name__)
+
+
+def lazy_import(module_name):
+    """
+    Import a module on its first use. Only for the libraries that rare paths use (the database update, the
+    Cas-OFFinder API and the CLI validation), so the server workers and the CLI start faster. A library that every
+    request uses, like pybedtools, is imported normally, so it is imported once in the uWSGI master before the workers
+    are forked. The lazy module is not thread safe on its first attribute access before Python 3.9
+    Args:
+        module_name: name of the module, for example "bs4"
+
+    Returns: the module. Its code runs when one of its attributes is first accessed
+    """
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    spec = importlib.util.find_spec(module_name)
+    if spec is None:
+        raise ModuleNotFoundError("No module named '{}'".format(module_name), name=module_name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    loader.exec_module(module)
+    return module
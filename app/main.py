@@ -3,24 +3,38 @@ import os
 import re
 import subprocess
 import sys
-import tempfile
 import warnings
 from datetime import timedelta
 from time import perf_counter
 import concurrent.futures
+import hmac
+import uuid
+from contextvars import copy_context
 
 import pandas as pd
-import yaml
-from flask import Flask, request, make_response, jsonify
+from flask import Flask, request, make_response, jsonify, g
 from pydantic_webargs import webargs
 
-from configuration_files.const import CAS_OFFINDER_OUTPUT_PATH, YAML_CONFIG_FILE
-from db import update_database_base_path, get_database_path
+from app_config import get_config
+from db import update_database_base_path, get_database_path, warm_up_databases
+from db_versions import get_current_version, get_current_version_path, list_versions, start_build_version, \
+    activate_version
 from helper import get_logger
-from obj_def import OffTargetList, AllDbResult, OtResponse, SitesList, DB_NAME_LIST, FlashFrySite, OffTarget
+from obj_def import OffTargetRecords, AllDbResult, OtResponse, SitesList, DB_NAME_LIST, FlashFrySite, \
+    OffTargetUpload
 from off_risk import extract_data
-from off_target import run_flashfry, run_crispritz, run_cas_offinder_locally, load_off_target_from_file, \
-    load_off_target_from_databases
+from off_target import run_flashfry, run_crispritz, run_cas_offinder_locally, load_off_target_from_databases, \
+    load_off_target_from_stream, load_off_target_from_records
+from job import Job, JobError, DEADLINE_HEADER, cancel_job, update_job_settings
+from metrics import generate_metrics, init_metrics, observe_request, update_metrics_settings
+from proc_runner import update_proc_runner_settings
+import profiler
+from shared_tables import update_shared_tables_settings
+from structured_log import log_request, set_request_id, reset_request_id, update_logging_settings
+from tool_io import update_tool_io_settings
+from timings import span, get_stage_stats, update_timings_settings
+from tool_pool import ToolPoolError, update_tool_pool_settings
+from workspace import Workspace, update_workspace_settings
 warnings.filterwarnings("ignore", category=RuntimeWarning)
 pd.options.mode.chained_assignment = None
 
@@ -32,13 +46,27 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 app = Flask(__name__)
 app.config["JSON_SORT_KEYS"] = False
 
-log = get_logger(logger_name=__name__, debug_level=logging.DEBUG)
-
-conf_yaml = None
-with open(YAML_CONFIG_FILE, "r") as f:
-    conf_yaml = yaml.load(f, Loader=yaml.FullLoader)
-
-update_database_base_path(conf_yaml["databases"]["base_path"])
+log = get_logger(logger_name=__name__)
+
+# The configuration is validated here, so a wrong configuration fails at startup and not on a request
+conf = get_config()
+
+update_logging_settings(**conf.log)
+init_metrics()
+update_metrics_settings(conf.metrics.get("enabled"))
+update_database_base_path(conf.databases.base_path)
+update_shared_tables_settings(conf.shared_tables.get("enabled"), conf.shared_tables.get("state_dir"))
+# Load the databases in the uWSGI master, before the workers are forked
+if conf.warm_up.get("enabled", True):
+    warm_up_databases(conf.databases.to_dict(), version_path=get_current_version_path())
+update_workspace_settings(conf.workspace.get("base_paths"), conf.workspace.get("size_budget_mb"))
+update_tool_io_settings(conf.tool_io.get("streaming"), conf.tool_io.get("streaming_tools"))
+update_tool_pool_settings(**conf.tool_pool)
+update_job_settings(**conf.job)
+update_proc_runner_settings(conf.proc_runner.get("buffer_lines"), conf.proc_runner.get("log_interval"),
+                            conf.proc_runner.get("log_sample_every"), conf.proc_runner.get("log_first_lines"))
+profiler.update_profiler_settings(**conf.profiling)
+update_timings_settings(**conf.memory_tracking)
 
 
 def handle_bad_request(e):
@@ -46,6 +74,105 @@ def handle_bad_request(e):
 
 app.register_error_handler(ValueError, handle_bad_request)
 
+
+def handle_tool_pool_error(e):
+    response = make_response(jsonify(error=e.status_code, text=str(e)), e.status_code)
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
+app.register_error_handler(ToolPoolError, handle_tool_pool_error)
+
+
+def handle_job_error(e):
+    return make_response(jsonify(error=e.status_code, text=str(e)), e.status_code)
+
+app.register_error_handler(JobError, handle_job_error)
+
+
+@app.before_request
+def start_request_metrics():
+    g.request_time_start = perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    if "request_time_start" in g:
+        # The route pattern is used and not the path, so every endpoint is a single time series
+        endpoint = request.url_rule.rule if request.url_rule is not None else "unknown"
+        observe_request(endpoint, request.method, response.status_code, perf_counter() - g.request_time_start)
+    return response
+
+
+@app.before_request
+def start_request_profile():
+    """
+    Profile the request when it has the X-OffRisk-Profile header and profiling is allowed by the configuration.
+    The profile is saved under the request id
+    """
+    if request.headers.get(profiler.PROFILE_HEADER, "").lower() not in ["1", "true", "yes"]:
+        return
+    if not profiler.profiling_enabled or (profiler.require_admin and not is_admin_request()):
+        log.info("Profiling was requested but it is not allowed")
+        return
+    body = request.get_json(silent=True)
+    request_id = body.get("request_id") if isinstance(body, dict) else None
+    g.profile_id = str(request_id) if request_id is not None else uuid.uuid4().hex
+    g.profiler = profiler.start_profile()
+
+
+@app.after_request
+def add_profile_header(response):
+    if g.get("profiler") is not None:
+        response.headers[profiler.PROFILE_ID_HEADER] = g.profile_id
+    return response
+
+
+def bind_request_id(request_id):
+    """
+    Add the request id to the log records of this request, until it ends
+    """
+    g.request_id_token = set_request_id(request_id)
+
+
+@app.teardown_request
+def unbind_request_id(exc):
+    if g.get("request_id_token") is not None:
+        reset_request_id(g.request_id_token)
+        g.request_id_token = None
+
+
+@app.teardown_request
+def stop_request_profile(exc):
+    # teardown runs also when the request failed, so the profiler is always stopped
+    if g.get("profiler") is not None:
+        try:
+            profiler.stop_profile(g.profiler, g.profile_id)
+        except Exception as e:
+            log.error("Could not save the profile {}: {}".format(g.profile_id, e))
+        g.profiler = None
+
+
+def get_request_deadline(body):
+    """
+    Get the time budget of the request from the body deadline field or the X-OffRisk-Deadline header
+    Args:
+        body: the request body
+
+    Returns: the deadline in seconds, or None to use the default deadline
+    """
+    if body.get("deadline") is not None:
+        return body["deadline"]
+    header_deadline = request.headers.get(DEADLINE_HEADER)
+    if header_deadline is None:
+        return None
+    try:
+        deadline = float(header_deadline)
+    except ValueError:
+        raise ValueError("{} header should be a number of seconds".format(DEADLINE_HEADER))
+    if deadline <= 0:
+        raise ValueError("{} header should be a positive number of seconds".format(DEADLINE_HEADER))
+    return deadline
+
 @app.route("/")
 def hello():
     """
@@ -57,20 +184,24 @@ def hello():
 
 
 @app.route("/v1/off-target-analyze/", methods=["POST"])
-@webargs(body=OffTargetList)
-def off_target_analyze(**kwargs):
+def off_target_analyze():
     """
     Analyze off-target request. Receive off-target sites.
+    The off-targets are validated as one table, straight into the off-target table (see OffTargetRecords)
     Returns: OtResponse object - off-target analysis
 
     """
     time_start = perf_counter()
-    body = OffTargetList(**kwargs["payload"])
-    body = body.dict()
+    request_body = OffTargetRecords(**request.json)
+    # The off-targets are not copied by dict()
+    body = request_body.dict(exclude={"off_targets"})
+    body["off_targets"] = request_body.off_targets
+    parse_time = perf_counter() - time_start
     dbs = body["db_list"]
-    log.info("Got new request: {}".format(body))
+    bind_request_id(body["request_id"])
+    log_request(log, "Got new request", body, request.get_data())
 
-    if body["organism"] not in conf_yaml["genomes"]:
+    if body["organism"] not in get_config().genomes:
         log.info("request_id: {} - the organism {} is not supported".format(body["request_id"], body["organism"]))
         return OtResponse(request_id=body["request_id"],
                           flashfry_score="[]",
@@ -79,23 +210,78 @@ def off_target_analyze(**kwargs):
                           all_result=AllDbResult(),
                           time=0).dict()
 
-    try:
-        tempinput_file = tempfile.NamedTemporaryFile(mode='w', delete=False,
-                                                     dir='{}/app/configuration_files/'.format(BASE_DIR))
-        log.info("input_file_path: {}".format(tempinput_file.name))
-        input_file_df = pd.DataFrame([{OffTarget.get_field_title(k): v for k, v in dict(s).items()} for s in body["off_targets"]])
-        if not OffTarget.get_field_title("sequence") in input_file_df:
-            input_file_df[OffTarget.get_field_title("sequence")] = None
-        input_file_df["cr_rna"] = body["on_target"]["sequence"] if body["on_target"] else None
-
-        input_file_df.to_csv(tempinput_file, sep="\t", index=False)
-        tempinput_file.close()
-        log.info("Loading off-target from a file in: {}".format(tempinput_file.name))
-        off_target_df = load_off_target_from_file(tempinput_file.name)
-        response = analyze(dbs, body["organism"], body["request_id"], off_target_df, time_start)
+    with Job(body["request_id"], get_request_deadline(body)) as job:
+        job.timings.add("parse_request", parse_time)
+        with span("input_file", job):
+            off_target_df = load_off_target_from_records(body["off_targets"],
+                                                         body["on_target"]["sequence"] if body["on_target"] else None)
+        response = analyze(dbs, body["organism"], body["request_id"], off_target_df, time_start,
+                           include=body["include"], job=job)
 
-    finally:
-        os.remove(tempinput_file.name)
+    time_end = perf_counter()
+    log.info("Total run: {}".format(timedelta(seconds=(time_end - time_start))))
+    return response
+
+
+UPLOAD_LIST_PARAMETERS = ["db_list", "include"]
+UPLOAD_FILE_FIELD = "file"
+
+
+def get_upload_parameters():
+    """
+    Get the parameters of an off-target upload from the query string, and from the form fields of a multipart
+    request. db_list and include can be repeated or comma separated
+    Returns: dictionary of the parameters, for OffTargetUpload
+    """
+    sources = [request.args]
+    # The form of other content types is not parsed, it would consume the uploaded file
+    if request.mimetype == "multipart/form-data":
+        sources.append(request.form)
+    parameters = {}
+    for source in sources:
+        for key in source.keys():
+            if key in UPLOAD_LIST_PARAMETERS:
+                parameters[key] = [item for value in source.getlist(key) for item in value.split(",") if item]
+            else:
+                parameters[key] = source.get(key)
+    return parameters
+
+
+@app.route("/v1/off-target-analyze/upload/", methods=["POST"])
+def off_target_upload_analyze():
+    """
+    Analyze off-targets uploaded as a TSV or BED file, which can be gzip compressed. The file is the request body,
+    or the file field of a multipart request. The parameters are in the query string (see OffTargetUpload).
+    The file is parsed and validated in chunks while it is read, straight into the off-target table
+    Returns: OtResponse object - off-target analysis
+    """
+    time_start = perf_counter()
+    body = OffTargetUpload(**get_upload_parameters()).dict()
+    dbs = body["db_list"]
+    bind_request_id(body["request_id"])
+    log_request(log, "Got new upload request", body)
+
+    if body["organism"] not in get_config().genomes:
+        log.info("request_id: {} - the organism {} is not supported".format(body["request_id"], body["organism"]))
+        return OtResponse(request_id=body["request_id"],
+                          flashfry_score="[]",
+                          off_target_df="[]",
+                          target_risk_results="[]",
+                          all_result=AllDbResult(),
+                          time=0).dict()
+
+    if request.mimetype == "multipart/form-data":
+        if UPLOAD_FILE_FIELD not in request.files:
+            raise ValueError("The off-target file should be in the {} field".format(UPLOAD_FILE_FIELD))
+        stream = request.files[UPLOAD_FILE_FIELD].stream
+    else:
+        stream = request.stream
+
+    with Job(body["request_id"], get_request_deadline(body)) as job:
+        with span("parse_request", job):
+            off_target_df = load_off_target_from_stream(stream, body["format"], body["on_target"])
+        response = analyze(dbs, body["organism"], body["request_id"], off_target_df, time_start,
+                           include=body["include"], job=job)
 
     time_end = perf_counter()
     log.info("Total run: {}".format(timedelta(seconds=(time_end - time_start))))
@@ -115,8 +301,10 @@ def analyze_ot(**kwargs):
     time_start = perf_counter()
     body = SitesList(**kwargs["payload"])
     body = body.dict()
+    parse_time = perf_counter() - time_start
     dbs = body["db_list"]
-    log.info("Got new request: {}".format(body))
+    bind_request_id(body["request_id"])
+    log_request(log, "Got new request", body, request.get_data())
     tools_list = body["search_tools"]
 
     cas_offinder_output = None
@@ -140,81 +328,92 @@ def analyze_ot(**kwargs):
         target_pattern = "{}{}".format(body["pam"], "N" * len(body["sites"][0]["sequence"]))
 
 
-    if "cas_offinder" in tools_list:
-        # Create the input file for cas-offinder
-        seqs = ",".join(["{} {}".format(s["sequence"] + "N" * len(body["pam"]) if body["downstream"] else
-                                          "N" * len(body["pam"]) + s["sequence"],
-                                          s["mismatch"]) for s in body["sites"]])
-        pattern = "{} {} {}".format(target_pattern, body["pattern_dna_bulge"], body["pattern_rna_bulge"])
-        genome_type = conf_yaml["cas_offinder"]["default_genome"]
-
-        if genome_type not in conf_yaml["genomes"]:
-            log.info("genome_type {} is not supported".format(genome_type))
-            raise Exception(
-                "No such genome {}. Allowed genome: {}".format(genome_type, list(conf_yaml["genomes"].keys())))
-
-        docker_path_to_genome = conf_yaml["genomes"][genome_type]["full"]
-
-        # Run Cas-Offinder
-
-        try:
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                cas_offinder_future = executor.submit(run_cas_offinder_locally, "C", pattern, seqs, docker_path_to_genome)
-
-        except Exception as e:
-            log.error("An error has occurred while running cas-offinder {}".format(e))
-
-    if "flashfry" in tools_list:
-        try:
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                flashfry_future = executor.submit(run_flashfry_from_server, body)
-
-        except Exception as e:
-            log.error("An error has occurred while running flashfry {}".format(e))
-
-
-    if "crispritz" in tools_list:
+    # The job is cancelled or expired by its deadline, the running tools are stopped
+    job = Job(body["request_id"], get_request_deadline(body))
+    job.timings.add("parse_request", parse_time)
+    try:
+        # All the temporary files of the search tools are written to a private workspace of this request
+        workspace = Workspace(body["request_id"])
         try:
-            genome_type = conf_yaml["cas_offinder"]["default_genome"]
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                crispritz_future = executor.submit(run_crispritz_from_server, sites=body["sites"], pam=body["pam"],
-                                                         pattern_dna_bulge=body["pattern_dna_bulge"], pattern_rna_bulge=body["pattern_rna_bulge"],
-                                                         genome_type=genome_type, downstream=body["downstream"])
-            # Remove input file
-            log.info("Finish running CRISPRitz")
-            # return crispritz_output.to_json(orient='records')
-        except Exception as e:
-            log.error("An error has occurred while running CRISPRitz {}".format(e))
-
-    if cas_offinder_future:
-        cas_offinder_output = cas_offinder_future.result()
-        log.info("Finish running cas-offinder")
-    if flashfry_future:
-        flashfry_output, flashfry_score = flashfry_future.result()
-        log.info("Finish running FlashFry")
-    if crispritz_future:
-        crispritz_output = crispritz_future.result()
-        log.info("Finish running CRISPRitz")
-
-
-    # analyze
-    off_target_df, flashfry_score = load_off_target_from_databases(
-        cas_offinder_output=cas_offinder_output,
-        crispritz_output=crispritz_output,
-        flashfry_output=flashfry_output,
-        flashfry_score=flashfry_score)
-
-    response = analyze(dbs, "human", body["request_id"], off_target_df, time_start, flashfry_score)
-    time_end = perf_counter()
-    log.info("Total run: {}".format(timedelta(seconds=(time_end - time_start))))
-
-    # Remove output files
-    log.info("Cleaning the environment")
-    os.remove(CAS_OFFINDER_OUTPUT_PATH) if os.path.exists(CAS_OFFINDER_OUTPUT_PATH) else None
-    return response
+            if "cas_offinder" in tools_list:
+                # Create the input file for cas-offinder
+                seqs = ",".join(["{} {}".format(s["sequence"] + "N" * len(body["pam"]) if body["downstream"] else
+                                                  "N" * len(body["pam"]) + s["sequence"],
+                                                  s["mismatch"]) for s in body["sites"]])
+                pattern = "{} {} {}".format(target_pattern, body["pattern_dna_bulge"], body["pattern_rna_bulge"])
+                genome_type = get_config().cas_offinder.default_genome
+
+                if genome_type not in get_config().genomes:
+                    log.info("genome_type {} is not supported".format(genome_type))
+                    raise Exception(
+                        "No such genome {}. Allowed genome: {}".format(genome_type, list(get_config().genomes.keys())))
+
+                docker_path_to_genome = get_config().genomes[genome_type].full
+
+                # Run Cas-Offinder
+
+                try:
+                    with concurrent.futures.ThreadPoolExecutor() as executor:
+                        cas_offinder_future = executor.submit(copy_context().run, run_cas_offinder_locally, "C", pattern,
+                                                              seqs, docker_path_to_genome, workspace, job)
+
+                except Exception as e:
+                    log.error("An error has occurred while running cas-offinder {}".format(e))
+
+            if "flashfry" in tools_list:
+                try:
+                    with concurrent.futures.ThreadPoolExecutor() as executor:
+                        flashfry_future = executor.submit(copy_context().run, run_flashfry_from_server, body, workspace, job)
+
+                except Exception as e:
+                    log.error("An error has occurred while running flashfry {}".format(e))
+
+            if "crispritz" in tools_list:
+                try:
+                    genome_type = get_config().cas_offinder.default_genome
+                    with concurrent.futures.ThreadPoolExecutor() as executor:
+                        crispritz_future = executor.submit(copy_context().run, run_crispritz_from_server, sites=body["sites"], pam=body["pam"],
+                                                                 pattern_dna_bulge=body["pattern_dna_bulge"], pattern_rna_bulge=body["pattern_rna_bulge"],
+                                                                 genome_type=genome_type, downstream=body["downstream"],
+                                                                 workspace=workspace, job=job)
+                    # Remove input file
+                    log.info("Finish running CRISPRitz")
+                    # return crispritz_output.to_json(orient='records')
+                except Exception as e:
+                    log.error("An error has occurred while running CRISPRitz {}".format(e))
+
+            if cas_offinder_future:
+                cas_offinder_output = cas_offinder_future.result()
+                log.info("Finish running cas-offinder")
+            if flashfry_future:
+                flashfry_output, flashfry_score = flashfry_future.result()
+                log.info("Finish running FlashFry")
+            if crispritz_future:
+                crispritz_output = crispritz_future.result()
+                log.info("Finish running CRISPRitz")
+        finally:
+            log.info("Cleaning the environment")
+            workspace.cleanup()
+
+        # analyze
+        with span("load_off_targets", job):
+            off_target_df, flashfry_score = load_off_target_from_databases(
+                cas_offinder_output=cas_offinder_output,
+                crispritz_output=crispritz_output,
+                flashfry_output=flashfry_output,
+                flashfry_score=flashfry_score)
+
+        response = analyze(dbs, "human", body["request_id"], off_target_df, time_start, flashfry_score,
+                           include=body["include"], job=job)
+        time_end = perf_counter()
+        log.info("Total run: {}".format(timedelta(seconds=(time_end - time_start))))
+        return response
+    finally:
+        job.close()
 
 
-def analyze(dbs, genome, request_id, off_target_df, time_start=perf_counter(), flashfry_score=pd.DataFrame()):
+def analyze(dbs, genome, request_id, off_target_df, time_start=perf_counter(), flashfry_score=pd.DataFrame(),
+            include=None, job=None):
     """
     Analyze the off-target with extract_data function
     Args:
@@ -223,6 +422,8 @@ def analyze(dbs, genome, request_id, off_target_df, time_start=perf_counter(), f
         dbs: which db to analyze
         request_id: the request ID for this analyzing.
         input_file: path to input file with off-targets
+        include: list of result tables to return. None will return all of them
+        job: the Job of the request, the analysis stops when it is cancelled or expired
 
     Returns:
 
@@ -235,16 +436,19 @@ def analyze(dbs, genome, request_id, off_target_df, time_start=perf_counter(), f
     if genome == 'human':
         try:
             off_t_result, all_result, target_risk_results = extract_data(db_name_list=db_name_list, off_target_df=off_target_df,
-                                                    flashfry_score=flashfry_score)
+                                                    flashfry_score=flashfry_score, include=include, job=job)
+            with span("build_response", job):
+                all_db_result = AllDbResult(**all_result)
             time_end = perf_counter()
-            all_db_result = AllDbResult(**all_result.json)
             total_time = timedelta(seconds=(time_end - time_start))
             response = OtResponse(request_id=request_id,
                                   flashfry_score=off_t_result["flashfry_score"],
                                   off_targets=off_t_result["off_targets"],
                                   target_risk_results=target_risk_results,
                                   all_result=all_db_result,
-                                  time=total_time.total_seconds())
+                                  time=total_time.total_seconds(),
+                                  timings=job.timings.to_dict() if job is not None else None,
+                                  memory=job.timings.memory_to_dict() if job is not None else None)
         except pd.errors.EmptyDataError:
             return make_response({}, 204)
 
@@ -262,9 +466,11 @@ def flashfry(**kwargs):
     time_start = perf_counter()
     body = FlashFrySite(**kwargs["payload"])
     body = body.dict()
-    log.info("Got new request: {}".format(body))
+    bind_request_id(body["request_id"])
+    log_request(log, "Got new request", body, request.get_data())
     try:
-        flashfry_output, flashfry_score = run_flashfry_from_server(body)
+        with Workspace(body["request_id"]) as workspace, Job(body["request_id"], get_request_deadline(body)) as job:
+            flashfry_output, flashfry_score = run_flashfry_from_server(body, workspace, job)
 
         time_end = perf_counter()
         log.info("Total run: {}".format(timedelta(seconds=(time_end - time_start))))
@@ -272,6 +478,8 @@ def flashfry(**kwargs):
                     "message": "Finish running FlashFry"}
         return make_response(jsonify(response), 200)
         # return response
+    except (ToolPoolError, JobError):
+        raise
     except Exception as e:
         message = "An error has occurred while running FlashFry {}".format(e)
         log.error(message)
@@ -281,42 +489,168 @@ def flashfry(**kwargs):
         # return JSONResponse(content=response, status_code=400)
 
 
-def run_flashfry_from_server(body):
+def run_flashfry_from_server(body, workspace=None, job=None):
     """
     Run FlashFry
     Args:
         body: FlashFrySite object
+        workspace: Workspace for the temporary files of FlashFry
+        job: the Job of the request
     """
 
     # Run FlashFry
     flashfry_output = run_flashfry(database_path=get_database_path(), sites=body["sites"], pam="AGG", #pam=body["pam"],
-                                   command="discover")
+                                   command="discover", workspace=workspace, job=job)
 
     flashfry_score = run_flashfry(database_path=get_database_path(), command="score",
-                                  flashfry_output_df=flashfry_output)
+                                  flashfry_output_df=flashfry_output, workspace=workspace, job=job)
     flashfry_output['target'] = flashfry_output['target'].map(lambda t: "{}{}".format(t[:-len("NGG")], "NGG"))
     flashfry_score['target'] = flashfry_score['target'].map(lambda t: "{}{}".format(t[:-len("NGG")], "NGG"))
 
     return flashfry_output, flashfry_score
 
 
-def run_crispritz_from_server(sites, pam, pattern_dna_bulge, pattern_rna_bulge, genome_type, downstream):
+def run_crispritz_from_server(sites, pam, pattern_dna_bulge, pattern_rna_bulge, genome_type, downstream,
+                              workspace=None, job=None):
     """
     Run FlashFry
     Args:
         body: FlashFrySite object
+        workspace: Workspace for the temporary files of CRISPRitz
+        job: the Job of the request
     """
 
 
-    docker_path_to_genome = conf_yaml["genomes"][genome_type]["chromosomes_folder"]
+    docker_path_to_genome = get_config().genomes[genome_type].chromosomes_folder
     crispritz_output = run_crispritz(genome_folder_path=docker_path_to_genome, command="search",sites=sites,
                                      pam=pam, number_of_threads=1000,
                                      pattern_rna_bulge=pattern_rna_bulge, pattern_dna_bulge=pattern_dna_bulge,
-                                     downstream=downstream)
+                                     downstream=downstream, workspace=workspace, job=job)
 
     return crispritz_output
 
 
+def is_admin_request():
+    """
+    Returns: True if the request has the admin token from the configuration. Admin endpoints are disabled when no
+    token is configured
+    """
+    admin_token = get_config().admin.get("token")
+    if not admin_token:
+        return False
+    return hmac.compare_digest(request.headers.get("X-OffRisk-Admin-Token", "").encode(), str(admin_token).encode())
+
+
+@app.route("/v1/admin/databases/versions", methods=["GET"])
+def get_database_versions():
+    """
+    Returns: the database versions with their manifest and status, and the current version
+    """
+    if not is_admin_request():
+        return make_response(jsonify(error=403, text="Admin token is missing or wrong"), 403)
+    return make_response(jsonify(current=get_current_version(), versions=list_versions()), 200)
+
+
+@app.route("/v1/admin/databases/versions", methods=["POST"])
+def build_database_version():
+    """
+    Build a new database version in the background. Body: {"version": name, "source_path": directory with the new
+    database files, "activate": make it the current version when it is ready (default true)}
+
+    Returns: 202 when the build started
+    """
+    if not is_admin_request():
+        return make_response(jsonify(error=403, text="Admin token is missing or wrong"), 403)
+    body = request.get_json(force=True) or {}
+    if not body.get("version") or not body.get("source_path"):
+        raise ValueError("version and source_path are required")
+    start_build_version(str(body["version"]), body["source_path"], get_config().databases.to_dict(),
+                        activate=body.get("activate", True))
+    return make_response(jsonify(version=body["version"], message="Database version build started"), 202)
+
+
+@app.route("/v1/admin/databases/current", methods=["PUT"])
+def activate_database_version():
+    """
+    Make a built database version the current version. Body: {"version": name}
+
+    Returns: the current version
+    """
+    if not is_admin_request():
+        return make_response(jsonify(error=403, text="Admin token is missing or wrong"), 403)
+    body = request.get_json(force=True) or {}
+    activate_version(str(body.get("version", "")))
+    return make_response(jsonify(current=get_current_version()), 200)
+
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """
+    Returns: the metrics of all the workers in the Prometheus text format
+    """
+    metrics_data, content_type = generate_metrics()
+    response = make_response(metrics_data, 200)
+    response.headers["Content-Type"] = content_type
+    return response
+
+
+@app.route("/v1/timings", methods=["GET"])
+def get_timings():
+    """
+    Returns: the count, total, mean and max time in seconds of every analysis stage, for the requests handled by
+    this worker
+    """
+    return make_response(jsonify(pid=os.getpid(), stages=get_stage_stats()), 200)
+
+
+@app.route("/v1/profiles/<profile_id>", methods=["GET"])
+def get_profile(profile_id):
+    """
+    Get the saved profile of a request. Query parameters: format=text (default) for the top functions, or
+    format=raw for the pstats file (for tools like snakeviz), sort (default cumulative) and lines (default 50)
+    Args:
+        profile_id: the profile id returned in the X-OffRisk-Profile-Id header
+
+    Returns: the profile, or 404 if there is no such profile
+    """
+    if profiler.require_admin and not is_admin_request():
+        return make_response(jsonify(error=403, text="Admin token is missing or wrong"), 403)
+    profile_path = profiler.get_profile_path(profile_id)
+    if profile_path is None or not os.path.isfile(profile_path):
+        return make_response(jsonify(error=404, text="No profile {}".format(profile_id)), 404)
+    if request.args.get("format", "text") == "raw":
+        with open(profile_path, "rb") as profile_file:
+            response = make_response(profile_file.read(), 200)
+        response.headers["Content-Type"] = "application/octet-stream"
+        response.headers["Content-Disposition"] = "attachment; filename={}".format(os.path.basename(profile_path))
+        return response
+    try:
+        summary = profiler.get_profile_summary(profile_id, request.args.get("sort", "cumulative"),
+                                               int(request.args.get("lines", 50)))
+    except KeyError:
+        raise ValueError("Unknown sort key {}".format(request.args.get("sort")))
+    response = make_response(summary, 200)
+    response.headers["Content-Type"] = "text/plain; charset=utf-8"
+    return response
+
+
+@app.route("/v1/jobs/<request_id>", methods=["DELETE"])
+def delete_job(request_id):
+    """
+    Cancel a running request. Its external tools are terminated and its workspace is removed. The request ID is
+    chosen by the client, so only the admin can cancel requests
+    Args:
+        request_id: the request ID
+
+    Returns: 202 if the request was cancelled, 403 without the admin token, 404 if no such request is running
+    """
+    if not is_admin_request():
+        return make_response(jsonify(error=403, text="Admin token is missing or wrong"), 403)
+    if cancel_job(request_id):
+        return make_response(jsonify(request_id=request_id, message="Request cancelled"), 202)
+    return make_response(jsonify(error=404, text="No running request {}".format(request_id)), 404)
+
+
 @app.route("/v1/cas-offinder-bulge/", methods=["GET"])
 def cas_offinder_bulge():
     """
@@ -353,12 +687,12 @@ def run_cas_offinder_server(received_request, cas_offinder_type="default"):
     off_target_df = pd.DataFrame()
     path_in, path_out = "", ""
 
-    if genome_type not in conf_yaml["genomes"]:
+    if genome_type not in get_config().genomes:
         log.info("genome_type {} is not supported".format(genome_type))
         raise Exception(
-            "No such genome {}. Allowed genome: {}".format(genome_type, list(conf_yaml["genomes"].keys())))
+            "No such genome {}. Allowed genome: {}".format(genome_type, list(get_config().genomes.keys())))
 
-    docker_path_to_genome = conf_yaml["genomes"][genome_type]["full"]
+    docker_path_to_genome = get_config().genomes[genome_type].full
 
     try:
 
@@ -366,6 +700,8 @@ def run_cas_offinder_server(received_request, cas_offinder_type="default"):
         off_target_df = cas_offinder_output
         log.info("Finish running cas-offinder")
 
+    except ToolPoolError:
+        raise
     except Exception as e:
         message = "An error has occurred while running cas-offinder {}".format(e)
         log.error(message)
@@ -0,0 +1,133 @@
+import glob
+import logging
+import os
+import tempfile
+
+# The workers write their metrics to files in this directory and /metrics collects all of them. It must be set before
+# prometheus_client is imported
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "off-risk-metrics"))
+os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+from prometheus_client import CollectorRegistry, Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST  # noqa
+from prometheus_client import multiprocess  # noqa
+from prometheus_client.core import GaugeMetricFamily  # noqa
+
+log = logging.getLogger(__name__)
+
+# Record metrics. When disabled the observe functions do nothing
+metrics_enabled = True
+
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, float("inf"))
+COUNT_BUCKETS = (1, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000, float("inf"))
+
+REQUESTS = Counter("offrisk_requests_total", "Handled HTTP requests", ["endpoint", "method", "status"])
+REQUEST_DURATION = Histogram("offrisk_request_duration_seconds", "Time to handle an HTTP request", ["endpoint"],
+                             buckets=DURATION_BUCKETS)
+TOOL_RUNS = Counter("offrisk_tool_runs_total", "Finished search tool processes", ["tool", "exit_code"])
+TOOL_DURATION = Histogram("offrisk_tool_duration_seconds", "Run time of a search tool process", ["tool"],
+                          buckets=DURATION_BUCKETS)
+STAGE_DURATION = Histogram("offrisk_stage_duration_seconds",
+                           "Time of an analysis stage, for example db:gencode:analyze", ["stage"],
+                           buckets=DURATION_BUCKETS)
+OFF_TARGETS = Histogram("offrisk_request_off_targets", "Number of off-targets analyzed by a request",
+                        buckets=COUNT_BUCKETS)
+CACHE_REQUESTS = Counter("offrisk_cache_requests_total", "Cache lookups by result (hit, shared or miss)",
+                         ["cache", "result"])
+
+
+class ToolPoolCollector(object):
+    """
+    Report the tool pool state when the metrics are collected. The pool state is shared by all the workers
+    """
+
+    def collect(self):
+        # Imported here so the metrics module does not depend on the pool settings at import time
+        from tool_pool import get_pool_status, tool_slots
+        running = GaugeMetricFamily("offrisk_tool_slots_in_use", "Running search tool processes", labels=["tool"])
+        waiting = GaugeMetricFamily("offrisk_tool_queue_depth", "Search tool processes waiting for a slot",
+                                    labels=["tool"])
+        slots = GaugeMetricFamily("offrisk_tool_slots", "Maximum search tool processes", labels=["tool"])
+        try:
+            status = get_pool_status()
+        except Exception as e:
+            log.error("Could not read the tool pool state: {}".format(e))
+            return
+        for tool, tool_status in status.items():
+            running.add_metric([tool], tool_status["running"])
+            waiting.add_metric([tool], tool_status["waiting"])
+            slots.add_metric([tool], tool_slots.get(tool, 1))
+        yield running
+        yield waiting
+        yield slots
+
+
+def _observe(metric, value, *labels):
+    if not metrics_enabled:
+        return
+    try:
+        (metric.labels(*labels) if labels else metric).observe(value)
+    except Exception as e:
+        log.debug("Could not record metric {}: {}".format(metric, e))
+
+
+def _increment(metric, *labels):
+    if not metrics_enabled:
+        return
+    try:
+        metric.labels(*labels).inc()
+    except Exception as e:
+        log.debug("Could not record metric {}: {}".format(metric, e))
+
+
+def observe_request(endpoint, method, status, seconds):
+    _increment(REQUESTS, endpoint, method, str(status))
+    _observe(REQUEST_DURATION, seconds, endpoint)
+
+
+def observe_tool(tool, exit_code, seconds):
+    _increment(TOOL_RUNS, tool, str(exit_code))
+    _observe(TOOL_DURATION, seconds, tool)
+
+
+def observe_stage(name, seconds):
+    _observe(STAGE_DURATION, seconds, name)
+
+
+def observe_off_targets(count):
+    _observe(OFF_TARGETS, count)
+
+
+def count_cache(cache, result):
+    _increment(CACHE_REQUESTS, cache, result)
+
+
+def generate_metrics():
+    """
+    Collect the metrics of all the workers
+    Returns: the metrics in the Prometheus text format and its content type
+    """
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    registry.register(ToolPoolCollector())
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def init_metrics():
+    """
+    Remove the metric files of a previous server run. Should be called once when the server starts, before the
+    workers are forked
+    """
+    for metric_file in glob.glob(os.path.join(os.environ["PROMETHEUS_MULTIPROC_DIR"], "*.db")):
+        os.remove(metric_file)
+
+
+def update_metrics_settings(enabled=None):
+    """
+    Update the settings of the metrics
+    Args:
+        enabled: record metrics
+    """
+    global metrics_enabled
+    if enabled is not None:
+        metrics_enabled = bool(enabled)
+    log.info("Metrics enabled: {}, directory: {}".format(metrics_enabled, os.environ["PROMETHEUS_MULTIPROC_DIR"]))
@@ -1,8 +1,108 @@
 import re
 from pydantic import BaseModel, Json, validator, Field, root_validator
-from typing import List, Union
+from typing import Any, Dict, List, Union
 
-from configuration_files.const import DB_NAME_LIST
+from configuration_files.const import DB_NAME_LIST, RESULT_INCLUDE_LIST
+
+# Valid off-target sequences, also used by the vectorized validation of uploaded off-target files
+OFF_TARGET_SEQUENCE_PATTERN = r"^[AaGcTtCcUu]*$"
+OFF_TARGET_MAX_SEQUENCE_LENGTH = 23
+OFF_TARGET_STRANDS = ["+", "-"]
+UPLOAD_FORMATS = ["tsv", "bed"]
+
+# Field titles of the models, by model class. The schema of a model is built once, not for every field lookup
+_field_titles = {}
+
+
+def get_model_field_titles(model):
+    """
+    Args:
+        model: pydantic model class
+
+    Returns: dictionary of the field names to their titles, in the field order
+    """
+    if model not in _field_titles:
+        _field_titles[model] = {name: field["title"] for name, field in model.schema(False).get("properties").items()}
+    return _field_titles[model]
+
+
+def validate_include(v):
+    """
+    Validate the list of result tables to return and normalize the per-DB entries to the db_list names
+    Args:
+        v: list of result tables. for example ["off_targets", "risk", "flashfry_score", "db:GENCODE"]
+
+    Returns: the normalized list
+    """
+    if v is None:
+        return v
+    include = []
+    for item in v:
+        if item.startswith("db:"):
+            db_name = item[len("db:"):].lower()
+            if db_name not in DB_NAME_LIST + ["all"]:
+                raise ValueError("{} is not a valid DB. Valid DB are: {}".format(item[len("db:"):], DB_NAME_LIST))
+            include.append("db:{}".format(db_name))
+        elif item in RESULT_INCLUDE_LIST:
+            include.append(item)
+        else:
+            raise ValueError("{} is not a valid result. Valid results are: {} or db:<db name>".format(
+                item, RESULT_INCLUDE_LIST))
+    return include
+
+
+def validate_db_list(v):
+    """
+    Validate the list of databases to analyze, and move the databases that others depend on to the start
+    Args:
+        v: list of database names, or ["all"]
+
+    Returns: the ordered list
+    """
+    gencode_dependent = ["omim", "humantf", "rbp", "protein_atlas", "cosmic"]
+    remap_epd_dependent = ["omim", "cosmic"]
+    enhancer_atlas_dependent = ["omim", "cosmic"]
+
+    db = DB_NAME_LIST + ["all"]
+    test = all(item in db for item in v)
+    if not test:
+        raise ValueError("Not a valid DB")
+
+    if "enhanceratlas" in v:
+        v.remove("enhanceratlas")
+        v.insert(0, "enhanceratlas")
+    else:
+        if any(dependency in v for dependency in enhancer_atlas_dependent):
+            raise ValueError("the databases {} dependent on Enhancer Atlas so it must be selected as well".format(enhancer_atlas_dependent))
+
+    if "remapepd" in v:
+        v.remove("remapepd")
+        v.insert(0, "remapepd")
+    else:
+        if any(dependency in v for dependency in remap_epd_dependent):
+            raise ValueError("the databases {} dependent on RemapEMD so it must be selected as well".format(remap_epd_dependent))
+
+    if "gencode" in v:
+        v.remove("gencode")
+        v.insert(0, "gencode")
+    else:
+        if any(dependency in v for dependency in gencode_dependent):
+            raise ValueError("the databases {} dependent on GenCode so it must be selected as well".format(gencode_dependent))
+
+    return v
+
+
+def validate_deadline(v):
+    """
+    Validate the time budget of a request
+    Args:
+        v: the deadline in seconds
+
+    Returns: the deadline
+    """
+    if v is not None and v <= 0:
+        raise ValueError("deadline should be a positive number of seconds")
+    return v
 
 
 class ProcessedResult(BaseModel):
@@ -42,6 +142,8 @@ class OtResponse(BaseModel):
     target_risk_results: Json
     all_result: AllDbResult  # All the databases inforamtion
     time: float  # Totoal time for running the analysis
+    timings: Dict[str, float] = None  # Time in seconds of every stage of the analysis
+    memory: Dict[str, Dict[str, Any]] = None  # Memory usage of every stage, when memory tracking is enabled
 
 
 class OffTarget(BaseModel):
@@ -61,12 +163,11 @@ class OffTarget(BaseModel):
 
     @classmethod
     def get_fields_title(cls):
-        return [field['title'] for field in cls.schema(False).get("properties").values()]
+        return list(get_model_field_titles(cls).values())
 
     @classmethod
     def get_field_title(cls, field_name):
-        fields = cls.schema(False).get("properties")
-        return fields[field_name]['title'] if field_name in fields else None
+        return get_model_field_titles(cls).get(field_name)
 
     @validator("end")
     def val_end(cls, v, values):
@@ -77,15 +178,15 @@ class OffTarget(BaseModel):
 
     @validator("strand")
     def val_strand(cls, v):
-        assert v in ["+", "-"]
+        assert v in OFF_TARGET_STRANDS
         return v
 
     @validator("sequence")
     def val_seq(cls, v):
         if v:
-            if not re.fullmatch(r"^[AaGcTtCcUu]*$", v):
+            if not re.fullmatch(OFF_TARGET_SEQUENCE_PATTERN, v):
                 raise ValueError("Got invalid string for site. Only A, T, U, C and G are allowed")
-            if not len(v) < 24:
+            if not len(v) <= OFF_TARGET_MAX_SEQUENCE_LENGTH:
                 raise ValueError("seq can not be longer then 24")
         return v
 
@@ -99,42 +200,74 @@ class OffTargetList(BaseModel):
     off_targets: List[OffTarget]
     on_target: OffTarget = None
     db_list: List[str] = ["all"]
+    include: List[str] = None  # Result tables to return. None will return all of them
+    deadline: float = None  # Time budget of the request in seconds. None will use the default deadline
 
     @validator("db_list")
     def val_db_list(cls, v):
-        gencode_dependent = ["omim", "humantf", "rbp", "protein_atlas", "cosmic"]
-        remap_epd_dependent = ["omim", "cosmic"]
-        enhancer_atlas_dependent = ["omim", "cosmic"]
+        return validate_db_list(v)
 
-        db = DB_NAME_LIST + ["all"]
-        test = all(item in db for item in v)
-        if not test:
-            raise ValueError("Not a valid DB")
+    @validator("include")
+    def val_include(cls, v):
+        return validate_include(v)
 
-        if "enhanceratlas" in v:
-            v.remove("enhanceratlas")
-            v.insert(0, "enhanceratlas")
-        else:
-            if any(dependency in v for dependency in enhancer_atlas_dependent):
-                raise ValueError("the databases {} dependent on Enhancer Atlas so it must be selected as well".format(enhancer_atlas_dependent))
+    @validator("deadline")
+    def val_deadline(cls, v):
+        return validate_deadline(v)
 
-        if "remapepd" in v:
-            v.remove("remapepd")
-            v.insert(0, "remapepd")
-        else:
-            if any(dependency in v for dependency in remap_epd_dependent):
-                raise ValueError("the databases {} dependent on RemapEMD so it must be selected as well".format(remap_epd_dependent))
 
-        if "gencode" in v:
-            v.remove("gencode")
-            v.insert(0, "gencode")
-        else:
-            if any(dependency in v for dependency in gencode_dependent):
-                raise ValueError("the databases {} dependent on GenCode so it must be selected as well".format(gencode_dependent))
+class OffTargetRecords(OffTargetList):
+    """
+    Object definition for the off-target analysis request, as OffTargetList. The off-targets are kept as the
+    received objects and are validated as one table by off_target.load_off_target_from_records, which is much faster
+    than an OffTarget model for every off-target
+    """
+    off_targets: list
 
+    @validator("off_targets", pre=True)
+    def val_off_targets(cls, v):
+        # Checked here and not by the field type, which would copy every off-target
+        if not isinstance(v, list) or not all(isinstance(item, dict) for item in v):
+            raise ValueError("off_targets should be a list of off-target objects")
         return v
 
 
+class OffTargetUpload(BaseModel):
+    """
+    Object definition for the parameters of an off-target file upload. The off-targets are the request body, a TSV
+    or BED file that can be gzip compressed
+    """
+    request_id: int
+    organism: str = 'human'
+    format: str = "tsv"  # tsv: the off-target input file format with a header, bed: BED3 to BED6 without a header
+    on_target: str = None  # Sequence of the on-target, set as the cr_rna of every off-target
+    db_list: List[str] = ["all"]
+    include: List[str] = None  # Result tables to return. None will return all of them
+    deadline: float = None  # Time budget of the request in seconds. None will use the default deadline
+
+    @validator("format")
+    def val_format(cls, v):
+        if v not in UPLOAD_FORMATS:
+            raise ValueError("format should be one of {}".format(UPLOAD_FORMATS))
+        return v
+
+    @validator("on_target")
+    def val_on_target(cls, v):
+        return OffTarget.val_seq(v)
+
+    @validator("db_list")
+    def val_db_list(cls, v):
+        return validate_db_list(v)
+
+    @validator("include")
+    def val_include(cls, v):
+        return validate_include(v)
+
+    @validator("deadline")
+    def val_deadline(cls, v):
+        return validate_deadline(v)
+
+
 class Site(BaseModel):
     """
     Object definition for on-target search
@@ -183,43 +316,20 @@ class SitesList(BaseModel):
     sites: List[Site]
     db_list: List[str] = ["all"]
     search_tools: List[str] = ["flashfry"]
+    include: List[str] = None  # Result tables to return. None will return all of them
+    deadline: float = None  # Time budget of the request in seconds. None will use the default deadline
 
     @validator("db_list")
     def val_db_list(cls, v):
+        return validate_db_list(v)
 
-        gencode_dependent = ["omim", "humantf", "rbp", "protein_atlas", "cosmic"]
-        remap_epd_dependent = ["omim", "cosmic"]
-        enhancer_atlas_dependent = ["omim", "cosmic"]
-
-        db = DB_NAME_LIST + ["all"]
-        test = all(item in db for item in v)
-        if not test:
-            raise ValueError("Not a valid DB")
+    @validator("include")
+    def val_include(cls, v):
+        return validate_include(v)
 
-        if "enhanceratlas" in v:
-            v.remove("enhanceratlas")
-            v.insert(0, "enhanceratlas")
-        else:
-            if any(dependency in v for dependency in enhancer_atlas_dependent):
-                raise ValueError("the databases {} dependent on Enhancer Atlas so it must be selected as well".format(enhancer_atlas_dependent))
-
-        if "remapepd" in v:
-            v.remove("remapepd")
-            v.insert(0, "remapepd")
-        else:
-            if any(dependency in v for dependency in remap_epd_dependent):
-                raise ValueError("the databases {} dependent on RemapEMD so it must be selected as well".format(remap_epd_dependent))
-
-        if "gencode" in v:
-            v.remove("gencode")
-            v.insert(0, "gencode")
-        else:
-            if any(dependency in v for dependency in gencode_dependent):
-                raise ValueError("the databases {} dependent on GenCode so it must be selected as well".format(gencode_dependent))
-
-
-
-        return v
+    @validator("deadline")
+    def val_deadline(cls, v):
+        return validate_deadline(v)
 
     @validator("pam")
     def val_pam(cls, v):
@@ -274,3 +384,8 @@ class SitesList(BaseModel):
 class FlashFrySite(BaseModel):
     request_id: int
     sites: List[Site]
+    deadline: float = None  # Time budget of the request in seconds. None will use the default deadline
+
+    @validator("deadline")
+    def val_deadline(cls, v):
+        return validate_deadline(v)
@@ -6,15 +6,20 @@ from datetime import timedelta
 from time import perf_counter
 
 import pandas as pd
-import yaml
-from pybedtools import BedTool
+import pybedtools
 
-from configuration_files.const import DB_NAME_LIST, CONF_FILE, YAML_CONFIG_FILE
+from app_config import get_config
+from configuration_files.const import DB_NAME_LIST, CONF_FILE
 from db import GencodeDb, OmimDb, MirGeneDB, HumanTFDb, ProteinAtlas, RBP, COSMIC, ReMapEPD, EnhancerAtlas, Pfam, \
-    initialize_off_target_df, analyze_with_id_list, add_db, calculate_score, save_global_off_target_results, \
+    initialize_off_target_df, analyze_gene_hits, add_db, calculate_score, save_global_off_target_results, \
     save_db_result, update_database_base_path, get_database_path, TargetScan, get_enhanced_off_target_risk_summary, \
-    get_enhanced_off_target_risk_score_summary
+    get_enhanced_off_target_risk_score_summary, get_db_file_path, OffTargetInformation, get_gene_risk_table, \
+    get_gene_hits
 from helper import ConfigurationFile, init_logger, update_cas_offinder_path, update_flashfry_path
+from db_versions import get_current_version_path
+from job import check_job
+from metrics import observe_off_targets
+from timings import span
 from off_target import run_flashfry, run_cas_offinder_api, run_cas_offinder_locally
 
 warnings.filterwarnings("ignore", category=RuntimeWarning)
@@ -23,34 +28,55 @@ pd.options.mode.chained_assignment = None
 log = logging.getLogger("Base_log")
 
 
-def extract_data(db_name_list, off_target_df=None, flashfry_score=pd.DataFrame()):
+def is_result_included(include, result_name):
+    """
+    Check if a result table was requested
+    Args:
+        include: list of requested result tables. None means all the results
+        result_name: name of the result. for example "off_targets", "risk" or "db:gencode"
+
+    Returns: True if the result should be built and serialized
+    """
+    if include is None:
+        return True
+    if result_name.startswith("db:") and "db:all" in include:
+        return True
+    return result_name in include
+
+
+def extract_data(db_name_list, off_target_df=None, flashfry_score=pd.DataFrame(), include=None, job=None):
     """
     Run intersection between the off-target file to other databases specified in db_name_list
 
+    :param include: list of result tables to build and serialize. None will build all of them
+    :param job: the Job of the request. The extraction stops between databases when it is cancelled or expired
     :return:
     """
     log.debug("Starting to extract data")
 
-    time_start = perf_counter()
+    with span("initialize", job):
+        # Create the bed file
+        if off_target_df is not None:
+            off_target_df.reset_index(drop=True, inplace=True)
+            off_target_df["name"] = off_target_df.index
+            off_target_bed = pybedtools.BedTool.from_dataframe(off_target_df, na_rep=".").sort()
+        else:
+            raise \
+                pd.errors.EmptyDataError("Off target dataframe is empty. Please verify there is files in the output folder")
 
-    # Create the bed file
-    if off_target_df is not None:
-        off_target_df.reset_index(drop=True, inplace=True)
-        off_target_df["name"] = off_target_df.index
-        off_target_bed = BedTool.from_dataframe(off_target_df, na_rep=".").sort()
-    else:
-        raise \
-            pd.errors.EmptyDataError("Off target dataframe is empty. Please verify there is files in the output folder")
+        # Initialize the result
+        db_list = []
+        off_target_df = initialize_off_target_df(off_target_df)
+        # The information of all the databases is joined to the off-targets after the last database
+        off_target_information = OffTargetInformation()
+    observe_off_targets(len(off_target_df.index))
 
-    # Initialize the result
-    db_list = []
-    off_target_df = initialize_off_target_df(off_target_df)
-    time_end = perf_counter()
-    log.info("Total run for off-target initialization: {}".format(timedelta(seconds=(time_end - time_start))))
+    conf = get_config()
 
-    conf_yaml = None
-    with open(YAML_CONFIG_FILE) as f:
-        conf_yaml = yaml.load(f, Loader=yaml.FullLoader)
+    # All the databases of this request are taken from the same version, even if a new version is activated meanwhile
+    version_path = get_current_version_path()
+    # The gene level information of OMIM, COSMIC and Protein Atlas, built once for the version
+    gene_risk_table = get_gene_risk_table(conf.databases.to_dict(), version_path=version_path)
 
     # Start extracting information from the databases
     log.info("Begin to run intersection between off-target and data")
@@ -62,16 +88,18 @@ def extract_data(db_name_list, off_target_df=None, flashfry_score=pd.DataFrame()
     enhancer_atlas_db = None
     cosmic_db = None
     omim_db = None
+    gene_hits_df = None
 
 
 
 
 
     for current_db_name in db_name_list:
-        time_start = perf_counter()
+        check_job(job)
         current_db = None
-        file_path = conf_yaml["databases"][current_db_name]["human"].get("path", "")
-        final_columns = conf_yaml["databases"][current_db_name]["human"].get("columns", [])
+        db_conf = conf.databases.get_db(current_db_name).human
+        file_path = get_db_file_path(db_conf.path, version_path)
+        final_columns = db_conf.columns
         if current_db_name == "gencode":
             current_db = GencodeDb(file_path, final_columns)
             gencode_db = current_db
@@ -93,7 +121,7 @@ def extract_data(db_name_list, off_target_df=None, flashfry_score=pd.DataFrame()
         elif current_db_name == "humantf":
             current_db = HumanTFDb(file_path, final_columns)
         elif current_db_name == "protein_atlas":
-            current_db = ProteinAtlas(file_path)
+            current_db = ProteinAtlas(file_path, gene_risk_table)
         elif current_db_name == "rbp":
             current_db = RBP(file_path, final_columns)
         elif current_db_name == "cosmic":
@@ -101,91 +129,100 @@ def extract_data(db_name_list, off_target_df=None, flashfry_score=pd.DataFrame()
             cosmic_db = current_db
 
         if current_db:
-            # Analyze  - intersect between GENCDOE result to the the DB columns for intersection.
-            if (current_db_name in gencode_dependent) and (gencode_db is not None) and \
-                    (gencode_db.complete_result.get("gene_ensembl_id", None) is not None):
-                analyze_with_id_list(current_db, off_target_df,
-                                     gencode_db.complete_result["gene_ensembl_id"].unique(),
-                                     "complete_result", "gene_ensembl_id")
-            # Analyze  - intersect between off-target location to the the DB location with BEDTools.
-            else:
-                current_db.analyze(off_target_bed) ################# Intersect than seperate files #######################
-
-            # Analyze  - intersect between Enhancer Atlas result to the the DB columns for intersection.
-            if (current_db_name in enhancer_atlas_dependent) and (enhancer_atlas_db is not None) and \
-                    (enhancer_atlas_db.complete_result.get("gene_ensembl_id", None) is not None):
-                analyze_with_id_list(current_db, off_target_df,
-                                     enhancer_atlas_db.complete_result["gene_ensembl_id"].unique(),
-                                     "enhancer_atlas", "enhancer_atlas_gene_ensembl_id")
-
-            # Analyze  - intersect between ReMap EPD result to the the DB columns for intersection.
-            if (current_db_name in remap_epd_dependent) and (remap_epd_db is not None) and \
-                    (remap_epd_db.complete_result.get("gene_ensembl_id", None) is not None):
-                analyze_with_id_list(current_db, off_target_df,
-                                     remap_epd_db.complete_result["gene_ensembl_id"].unique(),
-                                     "remap_epd", "remap_epd_gene_ensembl_id")
-
-            off_target_df = current_db.process_result(off_target_df)
+            current_db.keep_complete_result = is_result_included(include, "db:{}".format(current_db_name))
+            if current_db_name in gencode_dependent and gene_hits_df is None:
+                # The gene databases come after GENCODE, ReMap EPD and Enhancer Atlas, so the gene hits of all the
+                # off-targets are joined to the gene databases of the request once, before the first of them
+                with span("join_gene_hits", job):
+                    gene_hits_df = gene_risk_table.join_gene_hits(
+                        get_gene_hits(gencode_db, enhancer_atlas_db, remap_epd_db),
+                        [db_name for db_name in db_name_list if db_name in gencode_dependent])
+            with span("db:{}:analyze".format(current_db_name), job):
+                # Analyze  - intersect between GENCDOE result to the the DB columns for intersection.
+                if (current_db_name in gencode_dependent) and (gencode_db is not None) and \
+                        (gencode_db.complete_result.get("gene_ensembl_id", None) is not None):
+                    analyze_gene_hits(current_db, gene_hits_df, current_db_name, "gencode")
+                # Analyze  - intersect between off-target location to the the DB location with BEDTools.
+                else:
+                    current_db.analyze(off_target_bed) ################# Intersect than seperate files #######################
+
+                # Analyze  - intersect between Enhancer Atlas result to the the DB columns for intersection.
+                if (current_db_name in enhancer_atlas_dependent) and (enhancer_atlas_db is not None) and \
+                        (enhancer_atlas_db.complete_result.get("gene_ensembl_id", None) is not None):
+                    analyze_gene_hits(current_db, gene_hits_df, current_db_name, "enhancer_atlas")
+
+                # Analyze  - intersect between ReMap EPD result to the the DB columns for intersection.
+                if (current_db_name in remap_epd_dependent) and (remap_epd_db is not None) and \
+                        (remap_epd_db.complete_result.get("gene_ensembl_id", None) is not None):
+                    analyze_gene_hits(current_db, gene_hits_df, current_db_name, "remap_epd")
+
+            with span("db:{}:process_result".format(current_db_name), job):
+                current_db.process_result(off_target_information)
             add_db(db_list, current_db)
-            time_end = perf_counter()
-            log.info("Total run for {} analyze: {}".format(current_db.get_db_name(),
-                                                           timedelta(seconds=(time_end - time_start))))
         else:
             log.info("No DB was created. current DB name: {}".format(current_db_name))
 
+    with span("join_results", job):
+        off_target_df = off_target_information.join(off_target_df)
+
     log.info("Saving the results")
-    time_start = perf_counter()
     off_target_df["risk_score"] = ""
 
-    off_target_df = calculate_score(off_target_df, gencode_db, enhancer_atlas_db, remap_epd_db, omim_db, cosmic_db)
-
-    # if gencode_db and enhancer_atlas_db and remap_epd_db and omim_db and cosmic_db:
-    off_target_risk_df = get_enhanced_off_target_risk_summary(off_target_df, gencode_db, enhancer_atlas_db,
-                                                          remap_epd_db, omim_db, cosmic_db)
-
-
-
-    off_target_df_cols = ["gene_ensembl_id", "gene_symbol", "gene_type", "segment", "disease_related", "inheritance_model", "cancer_related",
-                          "remap_epd_gene_ensembl_id", "enhancer_atlas_gene_ensembl_id", "enhancer_atlas_cancer_related",
-                          "enhancer_atlas_inheritance_model", "enhancer_atlas_disease_related",
-                          "remap_epd_cancer_related", "remap_epd_inheritance_model", "remap_epd_disease_related"]
-
-    off_target_risk_df_cols = ["gencode_gene_ensembl_id", "gencode_gene_symbol", "gencode_gene_type",
-                               "gencode_segment", "gencode_omim_disease_related", "gencode_omim_inheritance_model",
-                               "gencode_cosmic_role_in_cancer", "remapepd_gene_ensembl_id",
-                               "enhanceratlas_gene_ensembl_id", "enhanceratlas_cosmic_role_in_cancer",
-                               "enhanceratlas_omim_inheritance_model", "enhanceratlas_omim_disease_related",
-                               "remapepd_cosmic_role_in_cancer", "remapepd_omim_inheritance_model",
-                               "remapepd_omim_disease_related"]
-
-
-
-    for risk_col in off_target_risk_df_cols + ["remapepd_epd_gene_symbol", "enhanceratlas_gene_symbol"]:
-        if risk_col not in off_target_risk_df.columns:
-            off_target_risk_df[risk_col] = None
-
-    off_target_risk_df = get_enhanced_off_target_risk_score_summary(off_target_risk_df)
-    for off_target_id in list(set(off_target_risk_df.index)):
-        off_target_risk = str(off_target_df.loc[off_target_df["off_target_id"] == off_target_id, "risk_score"].iloc[0])
-        off_target_risk_row = off_target_risk_df.loc[(off_target_risk_df.index == off_target_id) &
-                                                     (off_target_risk_df["risk_score"] == off_target_risk)].iloc[0]
-
-
-        row = off_target_risk_row[off_target_risk_df_cols].fillna("")
-        for col_1, col_2 in zip(off_target_df_cols, off_target_risk_df_cols):
-            off_target_df.loc[off_target_df["off_target_id"] == off_target_id, col_1] = row[col_2]
-            off_target_df.loc[off_target_df["off_target_id"] == off_target_id, col_1] = \
-                off_target_df.loc[off_target_df["off_target_id"] == off_target_id, col_1].map(lambda x: [x])
-
-
-
-    ot_results = save_global_off_target_results(off_target_df, flashfry_score, conf_yaml["off_target_result_columns"])
-    db_results = save_db_result(db_list)
-    time_end = perf_counter()
-    log.info("Total run for saving: {}".format(timedelta(seconds=(time_end - time_start))))
+    # The risk summary is needed both for the risk result and for updating the off-targets result
+    build_off_targets = is_result_included(include, "off_targets")
+    build_risk = is_result_included(include, "risk")
+    off_target_risk_df = pd.DataFrame()
+    if build_off_targets or build_risk:
+        with span("calculate_score", job):
+            off_target_df = calculate_score(off_target_df, gene_risk_table, gencode_db, enhancer_atlas_db,
+                                            remap_epd_db, omim_db, cosmic_db)
+
+        with span("risk_summary", job):
+            # if gencode_db and enhancer_atlas_db and remap_epd_db and omim_db and cosmic_db:
+            off_target_risk_df = get_enhanced_off_target_risk_summary(off_target_df, gene_risk_table, gencode_db,
+                                                                      enhancer_atlas_db, remap_epd_db, omim_db,
+                                                                      cosmic_db)
+
+            off_target_df_cols = ["gene_ensembl_id", "gene_symbol", "gene_type", "segment", "disease_related", "inheritance_model", "cancer_related",
+                                  "remap_epd_gene_ensembl_id", "enhancer_atlas_gene_ensembl_id", "enhancer_atlas_cancer_related",
+                                  "enhancer_atlas_inheritance_model", "enhancer_atlas_disease_related",
+                                  "remap_epd_cancer_related", "remap_epd_inheritance_model", "remap_epd_disease_related"]
+
+            off_target_risk_df_cols = ["gencode_gene_ensembl_id", "gencode_gene_symbol", "gencode_gene_type",
+                                       "gencode_segment", "gencode_omim_disease_related", "gencode_omim_inheritance_model",
+                                       "gencode_cosmic_role_in_cancer", "remapepd_gene_ensembl_id",
+                                       "enhanceratlas_gene_ensembl_id", "enhanceratlas_cosmic_role_in_cancer",
+                                       "enhanceratlas_omim_inheritance_model", "enhanceratlas_omim_disease_related",
+                                       "remapepd_cosmic_role_in_cancer", "remapepd_omim_inheritance_model",
+                                       "remapepd_omim_disease_related"]
+
+            for risk_col in off_target_risk_df_cols + ["remapepd_epd_gene_symbol", "enhanceratlas_gene_symbol"]:
+                if risk_col not in off_target_risk_df.columns:
+                    off_target_risk_df[risk_col] = None
+
+            off_target_risk_df = get_enhanced_off_target_risk_score_summary(off_target_risk_df)
+
+            if build_off_targets:
+                for off_target_id in list(set(off_target_risk_df.index)):
+                    off_target_risk = str(off_target_df.loc[off_target_df["off_target_id"] == off_target_id, "risk_score"].iloc[0])
+                    off_target_risk_row = off_target_risk_df.loc[(off_target_risk_df.index == off_target_id) &
+                                                                 (off_target_risk_df["risk_score"] == off_target_risk)].iloc[0]
+
+                    row = off_target_risk_row[off_target_risk_df_cols].fillna("")
+                    for col_1, col_2 in zip(off_target_df_cols, off_target_risk_df_cols):
+                        off_target_df.loc[off_target_df["off_target_id"] == off_target_id, col_1] = row[col_2]
+                        off_target_df.loc[off_target_df["off_target_id"] == off_target_id, col_1] = \
+                            off_target_df.loc[off_target_df["off_target_id"] == off_target_id, col_1].map(lambda x: [x])
+
+    with span("serialization", job):
+        ot_results = save_global_off_target_results(off_target_df, flashfry_score, conf.off_target_result_columns,
+                                                    include_off_targets=build_off_targets,
+                                                    include_flashfry_score=is_result_included(include, "flashfry_score"))
+        db_results = save_db_result(db_list)
+        target_risk_results = off_target_risk_df.reset_index().to_json(orient="records") if build_risk else "[]"
     log.info("Clearing the result")
 
-    return ot_results, db_results, off_target_risk_df.reset_index().to_json(orient="records")
+    return ot_results, db_results, target_risk_results
 
 
 def main():
@@ -1,25 +1,55 @@
+import gzip
+import io
 import logging
-import subprocess
 from datetime import timedelta
 from time import perf_counter
 from collections import defaultdict
+import numpy as np
 import pandas as pd
-import requests
 import tempfile
 import os
 import re
 import itertools
-from bs4 import BeautifulSoup
+from contextlib import ExitStack
 
 
 
 import configuration_files.const as const
 from configuration_files.const import FLASHFRY_TMP_LOCATION_PATH, FLASHFRY_DATABASE_BASE_PATH, \
-    COMPLETE_GENOME_PATH, BASE_DIR
-from obj_def import OffTarget
+    COMPLETE_GENOME_PATH
+from obj_def import OffTarget, OFF_TARGET_SEQUENCE_PATTERN, OFF_TARGET_MAX_SEQUENCE_LENGTH, OFF_TARGET_STRANDS, \
+    get_model_field_titles
+from tool_io import tool_input, tool_output
+from tool_pool import tool_slot
+from job import check_job, get_kill_grace_period
+from metrics import observe_tool
+from proc_runner import run_process
+from timings import span
+from workspace import Workspace
+from lazy_import import lazy_import
 
 log = logging.getLogger("Base_log")
 
+# Only the Cas-OFFinder API client uses them
+requests = lazy_import("requests")
+bs4 = lazy_import("bs4")
+
+# Types of the off-target table columns. The chromosomes, strands, guides and attributes repeat across the
+# off-targets, so they are categorical, and the coordinates fit in 32 bits. The off-target DNA sequences are almost all
+# different, so they are not categorical
+OFF_TARGET_DTYPES = {"chromosome": "category", "start": "int32", "end": "int32", "score": "float32",
+                     "strand": "category", "attributes": "category", "id": "Int64", "cr_rna": "category"}
+OFF_TARGET_MAX_COORDINATE = np.iinfo(np.int32).max
+
+# Rows of an uploaded off-target file that are parsed and validated at a time
+UPLOAD_CHUNK_ROWS = 100000
+UPLOAD_READ_BUFFER = 1024 * 1024
+GZIP_MAGIC = b"\x1f\x8b"
+# Columns of a BED file, as off-target fields. The name column is the off-target id when it is an integer
+BED_COLUMNS = ["chromosome", "start", "end", "id", "score", "strand"]
+# Number of invalid rows reported in the error of an invalid upload
+MAX_REPORTED_ROWS = 5
+
 
 def load_off_target_from_databases(flashfry_output = None, flashfry_score = None,
                                    crispritz_output = None, crispritz_output_file = None,
@@ -55,6 +85,7 @@ def load_off_target_from_databases(flashfry_output = None, flashfry_score = None
             off_target_df[OffTarget.get_field_title("id")] = "."
         # if OffTarget.get_field_title("sequence") not in off_target_df.columns:
         #     off_target_df[OffTarget.get_field_title("sequence")] = "."
+        off_target_df = apply_off_target_schema(off_target_df)
 
     return off_target_df, flashfry_score
 
@@ -230,6 +261,17 @@ def load_off_target_from_file(input_file):
 
     fields_name = OffTarget.get_fields_title() + ["cr_rna"]
     off_target_df = pd.read_csv(input_file, sep="\t", header=0, names=fields_name)
+    return build_off_target_table(off_target_df)
+
+
+def build_off_target_table(off_target_df):
+    """
+    Add the columns the analysis needs to the off-targets and order them
+    Args:
+        off_target_df: dataframe with the OffTarget fields (by title) and cr_rna, with a default index
+
+    Returns: the off-target table of the analysis
+    """
     off_target_df.loc[:, "name"] = off_target_df.index
     off_target_df.loc[:, "score"] = None
     off_target_df.loc[:, "mismatch"] = None
@@ -240,35 +282,261 @@ def load_off_target_from_file(input_file):
                                    "name", "score", OffTarget.get_field_title("strand"), "attributes",
                                    OffTarget.get_field_title("id"), OffTarget.get_field_title("sequence"),
                                    "cr_rna", "mismatch"]]
+    return apply_off_target_schema(off_target_df)
+
+
+def apply_off_target_schema(off_target_df):
+    """
+    Convert the off-target table to the types of OFF_TARGET_DTYPES. The loaders return the table in these types, and
+    the analysis keeps them: the merges with the database results are on off_target_id and keep the column types
+    Args:
+        off_target_df: the off-target table
+
+    Returns: the off-target table with the typed columns
+    """
+    for column, dtype in OFF_TARGET_DTYPES.items():
+        if column not in off_target_df.columns:
+            continue
+        values = off_target_df[column]
+        if column in ["start", "end"]:
+            values = values.astype("int64")
+            if (values > OFF_TARGET_MAX_COORDINATE).any():
+                raise ValueError("{} should be smaller than {}".format(column, OFF_TARGET_MAX_COORDINATE + 1))
+        elif column in ["score", "id"]:
+            # Missing values are None or "."
+            values = pd.to_numeric(values, errors="coerce")
+        off_target_df[column] = values.astype(dtype)
     return off_target_df
 
 
-def run_external_proc(args):
+class _UploadReader(io.RawIOBase):
+    """
+    Raw binary reader of any stream with a read method, such as the WSGI input of a request
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class _BedDataReader(io.RawIOBase):
+    """
+    Raw binary reader of the data lines of a BED file. The track, browser and comment lines of its header are skipped
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.pending = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.pending:
+            lines = self.stream.readlines(len(buffer))
+            if not lines:
+                return 0
+            self.pending = b"".join(line for line in lines if not _is_bed_header(line))
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+
+def _is_bed_header(line):
+    return line.startswith(b"#") or line.split(None, 1)[:1] in ([b"track"], [b"browser"])
+
+
+def open_upload_stream(stream):
     """
-    Run an external program with Popen.
+    Args:
+        stream: binary stream of an uploaded file
+
+    Returns: buffered binary stream of the file content, decompressed when the file is gzip compressed
+    """
+    reader = io.BufferedReader(_UploadReader(stream), buffer_size=UPLOAD_READ_BUFFER)
+    if reader.peek(len(GZIP_MAGIC))[:len(GZIP_MAGIC)] == GZIP_MAGIC:
+        return io.BufferedReader(gzip.GzipFile(fileobj=reader, mode="rb"), buffer_size=UPLOAD_READ_BUFFER)
+    return reader
+
+
+def read_off_target_chunks(stream, input_format="tsv", chunk_rows=UPLOAD_CHUNK_ROWS):
+    """
+    Parse an off-target file in chunks
+    Args:
+        stream: binary stream of the file content
+        input_format: "tsv" for the off-target input file format, with a header line, or "bed" for BED3 to BED6
+        lines. Lines starting with # are skipped, and in BED files the track and browser lines as well
+        chunk_rows: rows in every chunk
+
+    Returns: iterator of dataframes with the OffTarget fields, by title
+    """
+    chromosome = OffTarget.get_field_title("chromosome")
+    if input_format == "bed":
+        stream = io.BufferedReader(_BedDataReader(stream), buffer_size=UPLOAD_READ_BUFFER)
+        # The columns are validated and converted by validate_off_target_chunk
+        chunks = pd.read_csv(stream, sep="\t", header=None, comment="#", dtype=str, chunksize=chunk_rows)
+        for chunk in chunks:
+            chunk = chunk.iloc[:, :len(BED_COLUMNS)]
+            chunk.columns = BED_COLUMNS[:len(chunk.columns)]
+            chunk = chunk.reindex(columns=BED_COLUMNS)
+            # BED names that are not integers are not off-target ids
+            chunk["id"] = pd.to_numeric(chunk["id"], errors="coerce")
+            yield chunk.drop(columns=["score"]).rename(
+                columns={field: OffTarget.get_field_title(field) for field in BED_COLUMNS if field != "score"})
+        return
+
+    chunks = pd.read_csv(stream, sep="\t", header=0, comment="#", dtype={chromosome: str}, chunksize=chunk_rows)
+    for chunk in chunks:
+        # The sequence column can have the field name or its title
+        yield chunk.rename(columns={"sequence": OffTarget.get_field_title("sequence")})
+
+
+def _check_rows(invalid, first_row, message, row_name="row"):
+    if invalid.any():
+        rows = np.flatnonzero(np.asarray(invalid)) + first_row
+        raise ValueError("{} ({} {})".format(message, row_name,
+                                             ", ".join(str(row) for row in rows[:MAX_REPORTED_ROWS])))
+
+
+def validate_off_target_chunk(chunk_df, first_row=1, row_name="row"):
+    """
+    Validate off-targets with vectorized checks over the whole table. The same checks as the OffTarget validators,
+    for off-target lists that are too large to validate one OffTarget at a time
+    Args:
+        chunk_df: dataframe with the OffTarget fields, by title
+        first_row: number of the first row of the chunk, for the error message
+        row_name: name of the rows in the error message, for example "row" for the lines of a file
+
+    Returns: the off-targets with the fields converted to their types
+    """
+    chromosome = OffTarget.get_field_title("chromosome")
+    start = OffTarget.get_field_title("start")
+    end = OffTarget.get_field_title("end")
+    strand = OffTarget.get_field_title("strand")
+    off_target_id = OffTarget.get_field_title("id")
+    sequence = OffTarget.get_field_title("sequence")
+
+    missing = [column for column in [chromosome, start, end] if column not in chunk_df.columns]
+    if missing:
+        raise ValueError("The off-targets have no {} field".format(", ".join(missing)))
+    for column in [strand, off_target_id, sequence]:
+        if column not in chunk_df.columns:
+            chunk_df[column] = None
+
+    _check_rows(chunk_df[chromosome].isna(), first_row, "chromosome is missing", row_name)
+    # The chromosome of a JSON off-target can be a number
+    chunk_df[chromosome] = chunk_df[chromosome].astype(str)
+    for column in [start, end]:
+        values = pd.to_numeric(chunk_df[column], errors="coerce")
+        _check_rows(values.isna() | (values % 1 != 0), first_row, "{} should be an integer".format(column), row_name)
+        chunk_df[column] = values.astype("int64")
+    _check_rows(chunk_df[end] < chunk_df[start], first_row, "End need to be larger then start", row_name)
+
+    # A BED file without strands has "."
+    chunk_df[strand] = chunk_df[strand].mask(chunk_df[strand] == ".")
+    _check_rows(chunk_df[strand].notna() & ~chunk_df[strand].isin(OFF_TARGET_STRANDS), first_row,
+                "strand should be one of {}".format(OFF_TARGET_STRANDS), row_name)
+
+    ids = pd.to_numeric(chunk_df[off_target_id], errors="coerce")
+    _check_rows(chunk_df[off_target_id].notna() & (ids.isna() | (ids % 1 != 0)), first_row, "id should be an integer",
+                row_name)
+    chunk_df[off_target_id] = ids
+
+    sequences = chunk_df[sequence].where(chunk_df[sequence].notna(), "").astype(str)
+    _check_rows(~sequences.str.fullmatch(OFF_TARGET_SEQUENCE_PATTERN), first_row,
+                "Got invalid string for site. Only A, T, U, C and G are allowed", row_name)
+    _check_rows(sequences.str.len() > OFF_TARGET_MAX_SEQUENCE_LENGTH, first_row, "seq can not be longer then 24",
+                row_name)
+    return chunk_df
+
+
+def load_off_target_from_stream(stream, input_format="tsv", on_target_sequence=None, chunk_rows=UPLOAD_CHUNK_ROWS):
+    """
+    Load an uploaded off-target file straight into the off-target table, without a temporary file. The file is
+    parsed and validated in chunks, so it can be larger than a JSON request could be
+    Args:
+        stream: binary stream of the file, can be gzip compressed
+        input_format: "tsv" or "bed", see read_off_target_chunks
+        on_target_sequence: the on-target sequence, set as the cr_rna of every off-target
+        chunk_rows: rows parsed and validated at a time
+
+    Returns: the off-target table, like load_off_target_from_file
+    """
+    chunks = []
+    rows = 0
+    for chunk in read_off_target_chunks(open_upload_stream(stream), input_format, chunk_rows):
+        chunks.append(validate_off_target_chunk(chunk, rows + 1))
+        rows += len(chunk.index)
+    if rows == 0:
+        raise ValueError("The off-target file has no off-targets")
+
+    off_target_df = pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0].reset_index(drop=True)
+    log.info("Loaded {} off-targets from an uploaded {} file".format(rows, input_format))
+    off_target_df["cr_rna"] = on_target_sequence
+    return build_off_target_table(off_target_df)
+
+
+def load_off_target_from_records(off_targets, on_target_sequence=None):
+    """
+    Load the off-targets of a JSON request straight into the off-target table. The off-targets are validated as one
+    table (see validate_off_target_chunk), not as an OffTarget model each, and without a temporary file
+    Args:
+        off_targets: list of dictionaries with the OffTarget fields, by name
+        on_target_sequence: the on-target sequence, set as the cr_rna of every off-target
+
+    Returns: the off-target table, like load_off_target_from_file
+    """
+    if not off_targets:
+        raise ValueError("The request has no off-targets")
+    off_target_df = pd.DataFrame.from_records(off_targets)
+    off_target_df = off_target_df.rename(columns=get_model_field_titles(OffTarget))
+    off_target_df = validate_off_target_chunk(off_target_df, 0, "off_targets index")
+    log.info("Loaded {} off-targets from the request".format(len(off_target_df.index)))
+    off_target_df["cr_rna"] = on_target_sequence
+    return build_off_target_table(off_target_df)
+
+
+def run_external_proc(args, tool=None, job=None, progress_callback=None):
+    """
+    Run an external program.
     Args:
         args: The argument to run, a list of string
+        tool: the tool name. If given, the program waits for a free slot of the tool in the tool pool
+        job: the Job of the request. The program and its children are terminated when the job is cancelled or expired
+        progress_callback: function that receives the stream name and every output line of the program
+
+    Returns: ProcResult with the exit code, resource usage and the last output lines
     """
 
     function_name = "run_external_proc"
     log.debug("Entering {}".format(function_name))
     log.debug("{}: The following command will be run: {}".format(function_name, args))
-    with subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as proc:
-        while True:
-            next_line = proc.stdout.readline().decode("utf-8").strip()
-            if next_line == "" and proc.poll() is not None:
-                break
-            if next_line != "":
-                log.info(next_line)
-
-        err, output = proc.communicate()
-        exit_code = proc.returncode
-
-        if exit_code == 0:
-            log.info(output.decode())
-        else:
-            raise Exception("Error in {}.\nCommand is : {}\nError is: {} {}".format(
-                function_name, args, output.decode(), err.decode()))
+    check_job(job)
+    stage_name = "tool:{}".format(tool if tool else os.path.basename(args[0]))
+    # The wait for a free slot in the tool pool is timed apart from the run of the tool
+    with ExitStack() as slot_stack:
+        with span("{}:wait".format(stage_name), job):
+            slot_stack.enter_context(tool_slot(tool, job))
+        with span(stage_name, job):
+            proc_result = run_process(args, progress_callback=progress_callback,
+                                      stop_callback=job.should_stop if job is not None else None,
+                                      kill_grace_period=get_kill_grace_period())
+    log.info("{}: {} finished. {}".format(function_name, tool if tool else args[0], proc_result.summary()))
+    observe_tool(tool if tool else os.path.basename(args[0]), proc_result.exit_code, proc_result.wall_time)
+    check_job(job)
+
+    if proc_result.exit_code != 0:
+        raise Exception("Error in {}.\nCommand is : {}\nError is: {} {}".format(
+            function_name, args, proc_result.tail("stdout"), proc_result.tail("stderr")))
+    return proc_result
 
 
 def run_cas_offinder_api(cas_offinder_input_file, server_address=""):
@@ -299,18 +567,24 @@ def run_cas_offinder_api(cas_offinder_input_file, server_address=""):
         off_target_result = pd.read_json(result_df)
     else:
         raise Exception("Server returned error code: {}: {}".format(
-            response.status_code, BeautifulSoup(response.text, "html.parser").getText()))
+            response.status_code, bs4.BeautifulSoup(response.text, "html.parser").getText()))
 
     return off_target_result
 
 
-def run_cas_offinder_locally(c_g_option, pattern, seqs, docker_path_to_genome):
+def run_cas_offinder_locally(c_g_option, pattern, seqs, docker_path_to_genome, workspace=None, job=None):
     """
     Run Cas-OFFinder-bulge
     :param c_g_option: run on CPU or GPU
+    :param workspace: Workspace for the temporary files. if None a new workspace is created for this run
+    :param job: Job of the request, to stop Cas-OFFinder on cancellation or deadline
     :return:
     """
 
+    if workspace is None:
+        with Workspace("cas_offinder") as workspace:
+            return run_cas_offinder_locally(c_g_option, pattern, seqs, docker_path_to_genome, workspace, job)
+
     time_start = perf_counter()
     cas_offinder_output = None
 
@@ -318,30 +592,26 @@ def run_cas_offinder_locally(c_g_option, pattern, seqs, docker_path_to_genome):
     if not os.path.exists(const.CAS_OFFINDER_BULGE_PATH):
         raise Exception("No path {} exist. Please change Cas-OFFinder location".format(const.CAS_OFFINDER_BULGE_PATH))
 
+    path_in = workspace.new_file(prefix="cas_offinder_input_")
     try:
-        fd_in, path_in = write_cas_offinder_input(pattern, seqs, docker_path_to_genome)
-        temp_cas_offinder_output_file = tempfile.NamedTemporaryFile(mode='w', delete=False,
-                                                                    dir='{}/app/configuration_files/'.format(BASE_DIR))
+        write_cas_offinder_input(pattern, seqs, docker_path_to_genome, path_in)
 
         log.debug("cas_offinder_input_file_path: {}".format(path_in))
 
-        log.debug("cas_offinder_output_file_path: {}".format(temp_cas_offinder_output_file.name))
-        temp_cas_offinder_output_file.close()
-        args = ["python", const.CAS_OFFINDER_BULGE_PATH, path_in, c_g_option,
-                temp_cas_offinder_output_file.name]
+        # The output is parsed while cas-offinder is still writing it
+        with tool_output(workspace, "cas_offinder", "cas_offinder_output_") as output:
+            log.debug("cas_offinder_output_file_path: {}".format(output.path))
+            args = ["python", const.CAS_OFFINDER_BULGE_PATH, path_in, c_g_option, output.path]
 
-        log.info("Starting to run cas-offinder")
-        run_external_proc(args)
+            log.info("Starting to run cas-offinder")
+            run_external_proc(args, tool="cas_offinder", job=job)
 
-        cas_offinder_output = pd.read_csv(temp_cas_offinder_output_file.name, sep="\t")
+        cas_offinder_output = output.result
         time_end = perf_counter()
         log.info("Finish running cas-offinder in {}".format(timedelta(seconds=(time_end - time_start))))
 
-
     finally:
-        os.remove(temp_cas_offinder_output_file.name)
-        os.remove(path_in)
-
+        os.remove(path_in) if os.path.exists(path_in) else None
 
     return cas_offinder_output
 
@@ -371,14 +641,20 @@ def write_cas_offinder_input(pattern, seqs, docker_path_to_genome, input_file=No
     return fd_in, input_file
 
 
-def run_flashfry(database_path, command=None, **kwargs):
+def run_flashfry(database_path, command=None, workspace=None, job=None, **kwargs):
     """
     Run FlashFry with the commands received
     Args:
         database_path: the base path of the database
         commands: commands to run. can be build_index, discover or score
+        workspace: Workspace for the temporary files. if None a new workspace is created for this run
+        job: Job of the request, to stop FlashFry on cancellation or deadline
     """
 
+    if workspace is None:
+        with Workspace("flashfry") as workspace:
+            return run_flashfry(database_path, command, workspace, job, **kwargs)
+
     if command is None:
         raise Exception('A Command should be one of the following: [discover, score, index]')
 
@@ -387,32 +663,40 @@ def run_flashfry(database_path, command=None, **kwargs):
     if os.path.exists(flashfry_header_path):
         log.info("Database already exist, it will not be build again.")
     else:
-        _run_flashfry_index(flashfry_header_path)
+        _run_flashfry_index(flashfry_header_path, job)
 
     time_start = perf_counter()
 
     if command == 'index':
-        _run_flashfry_index(flashfry_header_path)
+        _run_flashfry_index(flashfry_header_path, job)
 
     elif command == "discover":
-        return _run_flashfry_discover(flashfry_header_path, kwargs.get("sites", []), kwargs.get("pam", "NGG"))
+        return _run_flashfry_discover(flashfry_header_path, kwargs.get("sites", []), kwargs.get("pam", "NGG"),
+                                      workspace, job)
 
     elif command == "score":
-        return _run_flashfry_score(flashfry_header_path, **kwargs)
+        return _run_flashfry_score(flashfry_header_path, workspace=workspace, job=job, **kwargs)
 
     time_end = perf_counter()
 
     log.info("Finish running FlashFry in {}".format(timedelta(seconds=(time_end - time_start))))
 
 def run_crispritz(genome_folder_path, command, sites, pam, downstream=True, number_of_threads=1,
-                  pattern_rna_bulge=0, pattern_dna_bulge=0):
+                  pattern_rna_bulge=0, pattern_dna_bulge=0, workspace=None, job=None):
     """
     Run FlashFry with the commands received
     Args:
         database_path: the base path of the database
         commands: commands to run. can be build_index, discover or score
+        workspace: Workspace for the temporary files. if None a new workspace is created for this run
+        job: Job of the request, to stop CRISPRitz on cancellation or deadline
     """
 
+    if workspace is None:
+        with Workspace("crispritz") as workspace:
+            return run_crispritz(genome_folder_path, command, sites, pam, downstream, number_of_threads,
+                                 pattern_rna_bulge, pattern_dna_bulge, workspace, job)
+
     if command is None:
         raise Exception('A Command should be one of the following: [search, index]')
 
@@ -424,11 +708,11 @@ def run_crispritz(genome_folder_path, command, sites, pam, downstream=True, numb
     time_start = perf_counter()
 
     if command == 'index':
-        _run_flashfry_index(genome_folder_path)
+        _run_flashfry_index(genome_folder_path, job)
 
     elif command == "search" :
         return _run_crispritz_search(genome_folder_path, sites, pattern_dna_bulge, pattern_rna_bulge, pam,
-                                     downstream, number_of_threads)
+                                     downstream, workspace, number_of_threads, job)
 
 
     time_end = perf_counter()
@@ -437,7 +721,7 @@ def run_crispritz(genome_folder_path, command, sites, pam, downstream=True, numb
 
     log.info("Finish running FlashFry in {}".format(timedelta(seconds=(time_end - time_start))))
 
-def _run_flashfry_index(flashfry_header_path):
+def _run_flashfry_index(flashfry_header_path, job=None):
     build_index_args = ["java", "-Xmx4g", "-jar",
                         const.FLASHFRY_PATH, "index",
                         "--tmpLocation", FLASHFRY_TMP_LOCATION_PATH,
@@ -445,11 +729,11 @@ def _run_flashfry_index(flashfry_header_path):
                         "--reference", COMPLETE_GENOME_PATH, "--enzyme", "spcas9ngg"]
 
     log.info("Starting to run FlashFry index building")
-    run_external_proc(build_index_args)
+    run_external_proc(build_index_args, tool="flashfry", job=job)
     log.info("Finish running FlashFry index building")
 
 
-def _run_flashfry_discover(flashfry_header_path, sites, pam):
+def _run_flashfry_discover(flashfry_header_path, sites, pam, workspace, job=None):
 
     flashfry_output = None
     lst_flashfry_outputs = []
@@ -468,39 +752,32 @@ def _run_flashfry_discover(flashfry_header_path, sites, pam):
 
     m_idx = 0
     for mismatch, set_sequences in mismatch_sequence.items():
-        try:
-            sequences = list(set_sequences)
-            temp_flashfry_input_file = tempfile.NamedTemporaryFile(mode='w', delete=False,
-                                                                   dir='{}/app/configuration_files/'.format(BASE_DIR))
-            log.info("flashfry_input_file_path: {}".format(temp_flashfry_input_file.name))
-            temp_flashfry_output_file = tempfile.NamedTemporaryFile(mode='w', delete=False,
-                                                                    dir='{}/app/configuration_files/'.format(BASE_DIR))
-            log.info("flashfry_output_file_path: {}".format(temp_flashfry_output_file.name))
+        sequences = list(set_sequences)
 
-            temp_flashfry_input_file.writelines(
-                [">sequence_{}\n{}\n".format(m_idx + i, sequence) for i, sequence in enumerate(sequences)])
+        def write_fasta(flashfry_input_file, first_idx=m_idx, fasta_sequences=sequences):
+            flashfry_input_file.writelines(
+                [">sequence_{}\n{}\n".format(first_idx + i, sequence) for i, sequence in enumerate(fasta_sequences)])
 
-            m_idx += len(sequences)
+        m_idx += len(sequences)
 
-            temp_flashfry_input_file.close()
-            temp_flashfry_output_file.close()
+        # The FASTA is fed and the output is parsed while FlashFry is running
+        with tool_input(workspace, "flashfry", "flashfry_input_", write_fasta) as flashfry_input_path, \
+                tool_output(workspace, "flashfry", "flashfry_output_") as output:
+            log.info("flashfry_input_file_path: {}".format(flashfry_input_path))
+            log.info("flashfry_output_file_path: {}".format(output.path))
 
             discover_args = ["java", "-Xmx4g", "-jar", const.FLASHFRY_PATH, "discover",
                              "--database={}".format(flashfry_header_path),
-                             "--fasta={}".format(temp_flashfry_input_file.name),
+                             "--fasta={}".format(flashfry_input_path),
                              "--positionOutput",
                              "--maxMismatch={}".format(mismatch),
-                             "--output={}".format(temp_flashfry_output_file.name)]
+                             "--output={}".format(output.path)]
 
             log.info("Starting to run FlashFry discover")
-            run_external_proc(discover_args)
+            run_external_proc(discover_args, tool="flashfry", job=job)
             log.info("Finish running FlashFry discover")
 
-            lst_flashfry_outputs.append(pd.read_csv(temp_flashfry_output_file.name, sep="\t"))
-
-        finally:
-            os.remove(temp_flashfry_input_file.name)
-            os.remove(temp_flashfry_output_file.name)
+        lst_flashfry_outputs.append(output.result)
 
         if len(lst_flashfry_outputs) > 0:
             flashfry_output = pd.concat(lst_flashfry_outputs, axis="index", ignore_index=True)
@@ -509,52 +786,135 @@ def _run_flashfry_discover(flashfry_header_path, sites, pam):
     return flashfry_output
 
 
-def _run_flashfry_score(flashfry_header_path, flashfry_output_file=None, flashfry_output_df=None):
+def _run_flashfry_score(flashfry_header_path, flashfry_output_file=None, flashfry_output_df=None, workspace=None,
+                        job=None):
     flashfry_score = None
-    temp_flashfry_output_file = None
 
     if flashfry_output_df is None and flashfry_output_file is None:
         raise Exception('No FlashFry output to score')
 
     log.info("FlashFry header location: {}".format(flashfry_header_path))
 
-    try:
-        if flashfry_output_file is None:
-            temp_flashfry_output_file = tempfile.NamedTemporaryFile(mode='w', delete=False,
-                                                                    dir='{}/app/configuration_files/'.format(BASE_DIR))
-            log.info("temp_flashfry_output_file: {}".format(temp_flashfry_output_file.name))
-
-            flashfry_output_df.to_csv(temp_flashfry_output_file, sep='\t', index=False)
-            flashfry_output_file = temp_flashfry_output_file.name
-            temp_flashfry_output_file.close()
+    def write_flashfry_output(flashfry_output_input_file):
+        flashfry_output_df.to_csv(flashfry_output_input_file, sep='\t', index=False)
 
-        temp_flashfry_score_output_path = tempfile.NamedTemporaryFile(mode='w', delete=False,
-                                                                      dir='{}/app/configuration_files/'.format(
-                                                                          BASE_DIR))
+    with ExitStack() as stack:
+        if flashfry_output_file is None:
+            # The discover result is serialized straight into FlashFry instead of to an intermediate file
+            flashfry_output_file = stack.enter_context(
+                tool_input(workspace, "flashfry", "flashfry_output_", write_flashfry_output))
+            log.info("temp_flashfry_output_file: {}".format(flashfry_output_file))
 
-        log.info("temp_flashfry_score_output_path: {}".format(temp_flashfry_score_output_path.name))
+        output = stack.enter_context(tool_output(workspace, "flashfry", "flashfry_score_"))
+        log.info("temp_flashfry_score_output_path: {}".format(output.path))
 
         score_args = ["java", "-Xmx4g", "-jar", const.FLASHFRY_PATH, "score",
                       "--input", flashfry_output_file,
-                      "--output", temp_flashfry_score_output_path.name,
+                      "--output", output.path,
                       "--scoringMetrics", "doench2014ontarget,doench2016cfd,dangerous,hsu2013,minot",
                       "--database", flashfry_header_path]
 
         log.info("Starting to run FlashFry score")
-        run_external_proc(score_args)
+        run_external_proc(score_args, tool="flashfry", job=job)
         log.info("Finish running FlashFry score")
 
-        flashfry_score = pd.read_csv(temp_flashfry_score_output_path.name, sep="\t")
-
-    finally:
-        os.remove(temp_flashfry_score_output_path.name)
-        if temp_flashfry_output_file is not None:
-            os.remove(temp_flashfry_output_file.name)
+    flashfry_score = output.result
 
     return flashfry_score
 
 
-def _run_crispritz_search(genome_folder_path, sites, n_dna_bulge, n_rna_bulge, pam, downstream, number_of_threads = 1):
+def process_crispritz_output(crispritz_output, pam, pams, rna_bulges, downstream=True):
+    """
+    Convert the CRISPRitz targets of the N padded search sequences back to off-targets of the sites: keep the targets
+    with a valid PAM, remove the padding and restore the bulges (see _run_crispritz_search)
+    Args:
+        crispritz_output: dataframe of the CRISPRitz targets file
+        pam: the PAM with N for every degenerate base
+        pams: all the nucleotide sequences of the PAM
+        rna_bulges: dictionary of a searched sequence to the (position, bases) of the RNA bulges it stands for
+        downstream: the PAM is downstream of the sequence
+
+    Returns: dataframe of the off-targets in the CRISPRitz output columns
+    """
+    rows = []
+    if downstream:
+        crispritz_output = crispritz_output.loc[crispritz_output["DNA"].str[-len(pam):].isin(pams)]
+        rna_bluge_indices = crispritz_output.loc[crispritz_output["crRNA"].isin(rna_bulges)].index
+        dna_bluge_indices = crispritz_output.loc[~crispritz_output["crRNA"].isin(rna_bulges)].index
+        for index, row in crispritz_output.loc[rna_bluge_indices].iterrows():
+            n_count = len(row["crRNA"]) - len(row["crRNA"].lstrip("N"))
+            for pos, seq in list(rna_bulges[row["crRNA"]]):
+                rows.append({"#Bulge_type": "RNA",
+                             "crRNA": row["crRNA"][n_count:n_count + pos] + seq + row["crRNA"][n_count + pos:-len(pam)] + pam,
+                             "DNA": row["DNA"][n_count:n_count + pos] + '-' * len(seq) + row["DNA"][n_count + pos:],
+                             "Chromosome": row["Chromosome"],
+                             "Position": int(row["Position"]) + n_count if row["Direction"] == "+" else int(row["Position"]),
+                             "Cluster Position": row["Cluster Position"],
+                             "Direction": row["Direction"],
+                             "Mismatches": row["Mismatches"],
+                             "Bulge_Size": len(seq),
+                             "Total": row["Total"]})
+        for index, row in crispritz_output.loc[dna_bluge_indices].iterrows():
+            n_count = len(row["crRNA"]) - len(row["crRNA"].lstrip("N"))
+            b_count = len(row["crRNA"][n_count if row["crRNA"][n_count:][:-len(pam)].find("N") == -1
+                       else n_count + row["crRNA"][n_count:][:-len(pam)].find("N"):][:-len(pam)]) - \
+                      len(row["crRNA"][n_count if row["crRNA"][n_count:][:-len(pam)].find("N") == -1
+                       else n_count + row["crRNA"][n_count:][:-len(pam)].find("N"):][:-len(pam)].lstrip("N"))
+
+            rows.append({"#Bulge_type": "X" if b_count == 0 else "DNA",
+                         "crRNA": row["crRNA"][n_count:][:-len(pam)].replace('N', '-') + pam,
+                         "DNA": row["DNA"][n_count:],
+                         "Chromosome": row["Chromosome"],
+                         "Position": int(row["Position"]) + n_count if row["Direction"] == "+" else int(row["Position"]),
+                         "Cluster Position": row["Cluster Position"],
+                         "Direction": row["Direction"],
+                         "Mismatches": row["Mismatches"],
+                         "Bulge_Size": b_count,
+                         "Total": row["Total"]})
+
+    else:
+        crispritz_output = crispritz_output.loc[crispritz_output['DNA'].str[:len(pam)].isin(pams)]
+        rna_bluge_indices = crispritz_output.loc[crispritz_output["crRNA"].isin(rna_bulges)].index
+        dna_bluge_indices = crispritz_output.loc[~crispritz_output["crRNA"].isin(rna_bulges)].index
+
+        for index, row in crispritz_output.loc[rna_bluge_indices].iterrows():
+            n_count = -len(row["crRNA"]) if len(row["crRNA"]) - len(row["crRNA"].rstrip("N")) == 0 \
+                else len(row["crRNA"]) - len(row["crRNA"].rstrip("N"))
+            for pos, seq in list(rna_bulges[row["crRNA"]]):
+                rows.append({"#Bulge_type": "RNA",
+                             "crRNA": pam + row["crRNA"][len(pam):len(pam) + pos] + seq + row["crRNA"][len(pam) + pos:-n_count],
+                             "DNA": row["DNA"][:len(pam) + pos] + '-' * len(seq) + row["DNA"][len(pam) + pos:-n_count],
+                             "Chromosome": row["Chromosome"],
+                             "Position": int(row["Position"]) + n_count if n_count > 0 and row["Direction"] == "-" else int(row["Position"]),
+                             "Cluster Position": row["Cluster Position"],
+                             "Direction": row["Direction"],
+                             "Mismatches": row["Mismatches"],
+                             "Bulge_Size": len(seq),
+                             "Total": row["Total"]})
+        for index, row in crispritz_output.loc[dna_bluge_indices].iterrows():
+            n_count = -len(row["crRNA"]) if len(row["crRNA"]) - len(row["crRNA"].rstrip("N")) == 0 \
+                else len(row["crRNA"]) - len(row["crRNA"].rstrip("N"))
+            b_count = len(row["crRNA"][n_count if row["crRNA"][:-n_count][len(pam):].find("N") == -1
+                                       else n_count + row["crRNA"][:-n_count][len(pam):].find("N"):][len(pam):]) -\
+                      len(row["crRNA"][n_count if row["crRNA"][:-n_count][len(pam):].find("N") == -1
+                                       else n_count + row["crRNA"][:-n_count][len(pam):].find("N"):][len(pam):].rstrip("N"))
+
+            rows.append({"#Bulge_type": "X" if b_count == 0 else "DNA",
+                         "crRNA": pam + row["crRNA"][:-n_count][len(pam):].replace('N', '-'),
+                         "DNA": row["DNA"][:-n_count],
+                         "Chromosome": row["Chromosome"],
+                         "Position": int(row["Position"]) + n_count if n_count > 0 and row["Direction"] == "-" else int(row["Position"]),
+                         "Cluster Position": row["Cluster Position"],
+                         "Direction": row["Direction"],
+                         "Mismatches": row["Mismatches"],
+                         "Bulge_Size": b_count,
+                         "Total": row["Total"]})
+
+    return pd.DataFrame(rows)
+
+
+def _run_crispritz_search(genome_folder_path, sites, n_dna_bulge, n_rna_bulge, pam, downstream, workspace,
+                          number_of_threads = 1, job=None):
 
     crispritz_output = None
     lst_crispritz_outputs = []
@@ -602,33 +962,26 @@ def _run_crispritz_search(genome_folder_path, sites, n_dna_bulge, n_rna_bulge, p
 
 
     for mismatch, set_sequences in mismatch_sequence.items():
+        sequences = list(set_sequences)
+        pams_input_path = workspace.new_file(prefix="crispritz_pams_")
+        sequences_input_path = workspace.new_file(prefix="crispritz_sequences_")
+        crispritz_output_path = workspace.new_file(prefix="crispritz_output_")
         try:
-            sequences = list(set_sequences)
-            temp_pams_input_file = tempfile.NamedTemporaryFile(mode='w', delete=False,
-                                                         dir='{}/app/configuration_files/'.format(BASE_DIR))
-            log.info("temp_pams_input_file: {}".format(temp_pams_input_file.name))
-            temp_sequences_input_file = tempfile.NamedTemporaryFile(mode='w', delete=False,
-                                                               dir='{}/app/configuration_files/'.format(BASE_DIR))
-            log.info("temp_sequences_input_file: {}".format(temp_sequences_input_file.name))
-            temp_crispritz_output_file = tempfile.NamedTemporaryFile(mode='w', delete=False,
-                                                         dir='{}/app/configuration_files/'.format(BASE_DIR))
-            log.info("temp_crispritz_output_file: {}".format(temp_crispritz_output_file.name))
-
-
-            temp_pams_input_file.writelines(["{}{} {}".format("N" * len(sequences[0]) if downstream else pam,
-                                                              pam if downstream else "N" * len(sequences[0]),
-                                                              len(pam) if downstream else -len(pam))])
-
-            temp_sequences_input_file.writelines(["{}{}\n".format(sequence if downstream else "N" * len(pam),
-                                                                  "N" * len(pam) if downstream else sequence) for sequence in sequences])
+            log.info("temp_pams_input_file: {}".format(pams_input_path))
+            log.info("temp_sequences_input_file: {}".format(sequences_input_path))
+            log.info("temp_crispritz_output_file: {}".format(crispritz_output_path))
 
+            with open(pams_input_path, "w") as pams_input_file:
+                pams_input_file.writelines(["{}{} {}".format("N" * len(sequences[0]) if downstream else pam,
+                                                             pam if downstream else "N" * len(sequences[0]),
+                                                             len(pam) if downstream else -len(pam))])
 
-            temp_pams_input_file.close()
-            temp_sequences_input_file.close()
-            temp_crispritz_output_file.close()
+            with open(sequences_input_path, "w") as sequences_input_file:
+                sequences_input_file.writelines(["{}{}\n".format(sequence if downstream else "N" * len(pam),
+                                                                 "N" * len(pam) if downstream else sequence) for sequence in sequences])
 
             search_args = ["crispritz.py", "search", genome_folder_path,
-                           temp_pams_input_file.name, temp_sequences_input_file.name, temp_crispritz_output_file.name,
+                           pams_input_path, sequences_input_path, crispritz_output_path,
                            "-mm", str(mismatch),
                            # "-bDNA", str(n_dna_bulge),
                            # "-bRNA", str(n_rna_bulge),
@@ -638,94 +991,18 @@ def _run_crispritz_search(genome_folder_path, sites, n_dna_bulge, n_rna_bulge, p
                            ]
 
             log.info("Starting to run CRISPRitz discover")
-            run_external_proc(search_args)
+            run_external_proc(search_args, tool="crispritz", job=job)
             log.info("Finish running CRISPRitz discover")
+            workspace.check_size()
 
-            tmp_crispritz_output = pd.read_csv("{}.targets.txt".format(temp_crispritz_output_file.name), sep="\t")
-
-            rows = []
-            if downstream:
-                tmp_crispritz_output = tmp_crispritz_output.loc[tmp_crispritz_output["DNA"].str[-len(pam):].isin(pams)]
-                rna_bluge_indices = tmp_crispritz_output.loc[tmp_crispritz_output["crRNA"].isin(mismatch_rnabulge_dic[mismatch])].index
-                dna_bluge_indices = tmp_crispritz_output.loc[~tmp_crispritz_output["crRNA"].isin(mismatch_rnabulge_dic[mismatch])].index
-                for index, row in tmp_crispritz_output.loc[rna_bluge_indices].iterrows():
-                    n_count = len(row["crRNA"]) - len(row["crRNA"].lstrip("N"))
-                    for pos, seq in list(mismatch_rnabulge_dic[mismatch][row["crRNA"]]):
-                        rows.append({"#Bulge_type": "RNA",
-                                     "crRNA": row["crRNA"][n_count:n_count + pos] + seq + row["crRNA"][n_count + pos:-len(pam)] + pam,
-                                     "DNA": row["DNA"][n_count:n_count + pos] + '-' * len(seq) + row["DNA"][n_count + pos:],
-                                     "Chromosome": row["Chromosome"],
-                                     "Position": int(row["Position"]) + n_count if row["Direction"] == "+" else int(row["Position"]),
-                                     "Cluster Position": row["Cluster Position"],
-                                     "Direction": row["Direction"],
-                                     "Mismatches": row["Mismatches"],
-                                     "Bulge_Size": len(seq),
-                                     "Total": row["Total"]})
-                for index, row in tmp_crispritz_output.loc[dna_bluge_indices].iterrows():
-                    n_count = len(row["crRNA"]) - len(row["crRNA"].lstrip("N"))
-                    b_count = len(row["crRNA"][n_count if row["crRNA"][n_count:][:-len(pam)].find("N") == -1
-                               else n_count + row["crRNA"][n_count:][:-len(pam)].find("N"):][:-len(pam)]) - \
-                              len(row["crRNA"][n_count if row["crRNA"][n_count:][:-len(pam)].find("N") == -1
-                               else n_count + row["crRNA"][n_count:][:-len(pam)].find("N"):][:-len(pam)].lstrip("N"))
-
-                    rows.append({"#Bulge_type": "X" if b_count == 0 else "DNA",
-                                 "crRNA": row["crRNA"][n_count:][:-len(pam)].replace('N', '-') + pam,
-                                 "DNA": row["DNA"][n_count:],
-                                 "Chromosome": row["Chromosome"],
-                                 "Position": int(row["Position"]) + n_count if row["Direction"] == "+" else int(row["Position"]),
-                                 "Cluster Position": row["Cluster Position"],
-                                 "Direction": row["Direction"],
-                                 "Mismatches": row["Mismatches"],
-                                 "Bulge_Size": b_count,
-                                 "Total": row["Total"]})
-
-            else:
-                tmp_crispritz_output = tmp_crispritz_output.loc[tmp_crispritz_output['DNA'].str[:len(pam)].isin(pams)]
-                rna_bluge_indices = tmp_crispritz_output.loc[tmp_crispritz_output["crRNA"].isin(mismatch_rnabulge_dic[mismatch])].index
-                dna_bluge_indices = tmp_crispritz_output.loc[~tmp_crispritz_output["crRNA"].isin(mismatch_rnabulge_dic[mismatch])].index
-
-                for index, row in tmp_crispritz_output.loc[rna_bluge_indices].iterrows():
-                    n_count = -len(row["crRNA"]) if len(row["crRNA"]) - len(row["crRNA"].rstrip("N")) == 0 \
-                        else len(row["crRNA"]) - len(row["crRNA"].rstrip("N"))
-                    for pos, seq in list(mismatch_rnabulge_dic[mismatch][row["crRNA"]]):
-                        rows.append({"#Bulge_type": "RNA",
-                                     "crRNA": pam + row["crRNA"][len(pam):len(pam) + pos] + seq + row["crRNA"][len(pam) + pos:-n_count],
-                                     "DNA": row["DNA"][:len(pam) + pos] + '-' * len(seq) + row["DNA"][len(pam) + pos:-n_count],
-                                     "Chromosome": row["Chromosome"],
-                                     "Position": int(row["Position"]) + n_count if n_count > 0 and row["Direction"] == "-" else int(row["Position"]),
-                                     "Cluster Position": row["Cluster Position"],
-                                     "Direction": row["Direction"],
-                                     "Mismatches": row["Mismatches"],
-                                     "Bulge_Size": len(seq),
-                                     "Total": row["Total"]})
-                for index, row in tmp_crispritz_output.loc[dna_bluge_indices].iterrows():
-                    n_count = -len(row["crRNA"]) if len(row["crRNA"]) - len(row["crRNA"].rstrip("N")) == 0 \
-                        else len(row["crRNA"]) - len(row["crRNA"].rstrip("N"))
-                    b_count = len(row["crRNA"][n_count if row["crRNA"][:-n_count][len(pam):].find("N") == -1
-                                               else n_count + row["crRNA"][:-n_count][len(pam):].find("N"):][len(pam):]) -\
-                              len(row["crRNA"][n_count if row["crRNA"][:-n_count][len(pam):].find("N") == -1
-                                               else n_count + row["crRNA"][:-n_count][len(pam):].find("N"):][len(pam):].rstrip("N"))
-
-                    rows.append({"#Bulge_type": "X" if b_count == 0 else "DNA",
-                                 "crRNA": pam + row["crRNA"][:-n_count][len(pam):].replace('N', '-'),
-                                 "DNA": row["DNA"][:-n_count],
-                                 "Chromosome": row["Chromosome"],
-                                 "Position": int(row["Position"]) + n_count if n_count > 0 and row["Direction"] == "-" else int(row["Position"]),
-                                 "Cluster Position": row["Cluster Position"],
-                                 "Direction": row["Direction"],
-                                 "Mismatches": row["Mismatches"],
-                                 "Bulge_Size": b_count,
-                                 "Total": row["Total"]})
-
-
-
-            lst_crispritz_outputs.append(pd.DataFrame(rows))
+            crispritz_output_df = pd.read_csv("{}.targets.txt".format(crispritz_output_path), sep="\t")
+            lst_crispritz_outputs.append(process_crispritz_output(crispritz_output_df, pam, pams,
+                                                                  mismatch_rnabulge_dic[mismatch], downstream))
 
         finally:
-            os.remove(temp_pams_input_file.name)
-            os.remove(temp_sequences_input_file.name)
-            os.remove(temp_crispritz_output_file.name)
-            os.remove("{}.targets.txt".format(temp_crispritz_output_file.name))
+            for crispritz_file_path in [pams_input_path, sequences_input_path, crispritz_output_path,
+                                        "{}.targets.txt".format(crispritz_output_path)]:
+                os.remove(crispritz_file_path) if os.path.exists(crispritz_file_path) else None
 
 
         if len(lst_crispritz_outputs) > 0:
@@ -0,0 +1,210 @@
+import logging
+import os
+import signal
+import subprocess
+import threading
+import time
+from collections import deque
+from contextvars import copy_context
+
+import structured_log
+
+log = logging.getLogger(__name__)
+
+# Number of the last output lines kept from each stream of a process
+buffer_lines = 1000
+# Minimum seconds between two logged output lines of the same stream. Lines in between are only counted
+log_interval = 1.0
+# Only every sample_every line of a stream can be logged, so a chatty tool is not logged every log_interval
+sample_every = 1
+# The first lines of a stream are always logged, they usually have the parameters and the errors of the tool
+log_first_lines = 5
+
+POLL_INTERVAL = 0.05
+STOP_CHECK_INTERVAL = 0.5
+
+
+class ProcResult(object):
+
+    def __init__(self, args):
+        """
+        Exit information and resource usage of a finished process
+        Args:
+            args: the command that was run
+        """
+        self.args = args
+        self.pid = None
+        self.exit_code = None
+        self.stopped = False
+        self.wall_time = 0.0
+        self.user_time = 0.0
+        self.system_time = 0.0
+        self.max_rss_kb = 0
+        self.stdout_tail = deque(maxlen=buffer_lines)
+        self.stderr_tail = deque(maxlen=buffer_lines)
+        self.stdout_lines = 0
+        self.stderr_lines = 0
+
+    @property
+    def cpu_time(self):
+        return self.user_time + self.system_time
+
+    @property
+    def stdout(self):
+        return "\n".join(self.stdout_tail)
+
+    @property
+    def stderr(self):
+        return "\n".join(self.stderr_tail)
+
+    def tail(self, stream_name="stderr", lines=20):
+        """
+        Returns: the last lines of stream_name ("stdout" or "stderr") as a single string
+        """
+        stream_tail = self.stdout_tail if stream_name == "stdout" else self.stderr_tail
+        return "\n".join(list(stream_tail)[-lines:])
+
+    def summary(self):
+        return "exit code: {}, wall: {:.2f}s, cpu: {:.2f}s, max rss: {} KB, stdout lines: {}, stderr lines: {}".format(
+            self.exit_code, self.wall_time, self.cpu_time, self.max_rss_kb, self.stdout_lines, self.stderr_lines)
+
+
+def _exit_code_from_status(status):
+    """
+    Convert a wait status to an exit code like Popen.returncode. Negative values are the signal that killed the process
+    """
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def _drain(stream, stream_name, result, progress_callback):
+    """
+    Read all the lines of a process stream into the result buffer. Runs in a background thread
+    """
+    is_stdout = stream_name == "stdout"
+    tail = result.stdout_tail if is_stdout else result.stderr_tail
+    last_log_time = 0.0
+    skipped = 0
+    for raw_line in iter(stream.readline, b""):
+        line = raw_line.decode("utf-8", errors="replace").rstrip("\n")
+        if not line.strip():
+            continue
+        tail.append(line)
+        if is_stdout:
+            result.stdout_lines += 1
+        else:
+            result.stderr_lines += 1
+        if progress_callback is not None:
+            progress_callback(stream_name, line)
+        line_number = result.stdout_lines if is_stdout else result.stderr_lines
+        if structured_log.debug_mode:
+            log.debug("[%s %s] %s", result.pid, stream_name, line)
+            continue
+        current_time = time.monotonic()
+        if line_number <= log_first_lines or \
+                (line_number % sample_every == 0 and current_time - last_log_time >= log_interval):
+            log.info("[%s %s] %s%s", result.pid, stream_name, line,
+                     " ({} lines not logged)".format(skipped) if skipped else "")
+            last_log_time = current_time
+            skipped = 0
+        else:
+            skipped += 1
+    if skipped:
+        log.info("[%s %s] %s lines not logged", result.pid, stream_name, skipped)
+    stream.close()
+
+
+def _signal_group(pid, sig):
+    try:
+        os.killpg(pid, sig)
+    except ProcessLookupError:
+        pass
+
+
+def run_process(args, progress_callback=None, stop_callback=None, kill_grace_period=5):
+    """
+    Run an external program. stdout and stderr are drained concurrently into bounded buffers, so a chatty stream
+    never blocks the program
+    Args:
+        args: the command to run, a list of strings
+        progress_callback: function that receives the stream name ("stdout" or "stderr") and every output line
+        stop_callback: function that returns True when the program should be stopped. The process group is then
+        terminated with SIGTERM, and with SIGKILL after kill_grace_period seconds
+        kill_grace_period: seconds to wait after SIGTERM before SIGKILL
+
+    Returns: ProcResult
+    """
+    result = ProcResult(args)
+    time_start = time.monotonic()
+    # A new session is used so the whole process group can be terminated
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+    result.pid = proc.pid
+    # The readers run in a copy of the context, so their log records have the request id
+    readers = [threading.Thread(target=copy_context().run,
+                                args=(_drain, proc.stdout, "stdout", result, progress_callback), daemon=True),
+               threading.Thread(target=copy_context().run,
+                                args=(_drain, proc.stderr, "stderr", result, progress_callback), daemon=True)]
+    for reader in readers:
+        reader.start()
+
+    term_time = None
+    last_stop_check = 0.0
+    try:
+        while True:
+            # The process is reaped here and not by Popen, to get its resource usage
+            pid, status, rusage = os.wait4(proc.pid, os.WNOHANG)
+            if pid != 0:
+                break
+            current_time = time.monotonic()
+            if term_time is None and stop_callback is not None and \
+                    current_time - last_stop_check >= STOP_CHECK_INTERVAL:
+                last_stop_check = current_time
+                if stop_callback():
+                    log.info("Stopping process {}".format(proc.pid))
+                    result.stopped = True
+                    term_time = current_time
+                    _signal_group(proc.pid, signal.SIGTERM)
+            elif term_time is not None and current_time - term_time >= kill_grace_period:
+                _signal_group(proc.pid, signal.SIGKILL)
+                term_time = float("inf")
+            time.sleep(POLL_INTERVAL)
+    except BaseException:
+        _signal_group(proc.pid, signal.SIGKILL)
+        proc.wait()
+        raise
+
+    proc.returncode = result.exit_code = _exit_code_from_status(status)
+    result.wall_time = time.monotonic() - time_start
+    result.user_time = rusage.ru_utime
+    result.system_time = rusage.ru_stime
+    # ru_maxrss is in KB on Linux
+    result.max_rss_kb = rusage.ru_maxrss
+    for reader in readers:
+        # Children of the program that are still running may keep the streams open
+        reader.join(timeout=kill_grace_period)
+    return result
+
+
+def update_proc_runner_settings(lines=None, interval=None, sample=None, first_lines=None):
+    """
+    Update the settings of the process runner
+    Args:
+        lines: number of the last output lines kept from each stream
+        interval: minimum seconds between two logged output lines of the same stream
+        sample: only every sample line of a stream can be logged
+        first_lines: number of the first lines of every stream that are always logged
+    """
+    global buffer_lines, log_interval, sample_every, log_first_lines
+    if lines is not None:
+        buffer_lines = lines
+    if interval is not None:
+        log_interval = interval
+    if sample is not None:
+        if sample < 1:
+            raise ValueError("proc_runner log_sample_every should be at least 1")
+        sample_every = sample
+    if first_lines is not None:
+        log_first_lines = first_lines
+    log.info("Process output buffer: {} lines, log interval: {} seconds, log sample: 1 of {} lines after the first {}"
+             .format(buffer_lines, log_interval, sample_every, log_first_lines))
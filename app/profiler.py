@@ -0,0 +1,113 @@
+import cProfile
+import glob
+import io
+import logging
+import os
+import pstats
+import re
+import tempfile
+
+log = logging.getLogger(__name__)
+
+# Allow requests to ask for profiling with the X-OffRisk-Profile header
+profiling_enabled = False
+# Profiling requests also need the admin token
+require_admin = True
+# Directory of the saved profiles, shared by all the workers on the machine
+profiles_dir = os.path.join(tempfile.gettempdir(), "off-risk-profiles")
+# Number of the most recent profiles that are kept
+max_profiles = 20
+
+PROFILE_HEADER = "X-OffRisk-Profile"
+PROFILE_ID_HEADER = "X-OffRisk-Profile-Id"
+PROFILE_SUFFIX = ".prof"
+PROFILE_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]+$")
+
+
+def get_profile_path(profile_id):
+    """
+    Returns: path of the profile file, or None if profile_id is not a valid profile id
+    """
+    profile_id = str(profile_id)
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        return None
+    return os.path.join(profiles_dir, profile_id + PROFILE_SUFFIX)
+
+
+def start_profile():
+    """
+    Start profiling the current thread
+    Returns: the running profiler, or None if profiling could not start
+    """
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        # Only one profiler can run at a time in some Python versions
+        log.warning("Could not start the profiler: {}".format(e))
+        return None
+    return profiler
+
+
+def stop_profile(profiler, profile_id):
+    """
+    Stop the profiler and save the profile. The oldest profiles are removed so only max_profiles are kept
+    Args:
+        profiler: the profiler from start_profile
+        profile_id: the profile id, usually the request id
+    """
+    profiler.disable()
+    profile_path = get_profile_path(profile_id)
+    if profile_path is None:
+        return
+    os.makedirs(profiles_dir, exist_ok=True)
+    tmp_path = "{}.tmp.{}".format(profile_path, os.getpid())
+    profiler.dump_stats(tmp_path)
+    os.replace(tmp_path, profile_path)
+    log.info("Saved profile {}".format(profile_path))
+    profile_paths = sorted(glob.glob(os.path.join(profiles_dir, "*" + PROFILE_SUFFIX)), key=os.path.getmtime)
+    for old_path in profile_paths[:-max_profiles] if max_profiles > 0 else []:
+        try:
+            os.remove(old_path)
+        except OSError:
+            pass
+
+
+def get_profile_summary(profile_id, sort_by="cumulative", lines=50):
+    """
+    Args:
+        profile_id: the profile id
+        sort_by: the pstats sort key, for example "cumulative" or "tottime"
+        lines: number of functions to show
+
+    Returns: the profile as text, or None if there is no such profile
+    """
+    profile_path = get_profile_path(profile_id)
+    if profile_path is None or not os.path.isfile(profile_path):
+        return None
+    output = io.StringIO()
+    stats = pstats.Stats(profile_path, stream=output)
+    stats.strip_dirs().sort_stats(sort_by).print_stats(lines)
+    return output.getvalue()
+
+
+def update_profiler_settings(enabled=None, admin_only=None, directory=None, max_files=None):
+    """
+    Update the settings of the request profiler
+    Args:
+        enabled: allow profiling requests
+        admin_only: profiling requests also need the admin token
+        directory: directory of the saved profiles
+        max_files: number of the most recent profiles that are kept
+    """
+    global profiling_enabled, require_admin, profiles_dir, max_profiles
+    if enabled is not None:
+        profiling_enabled = bool(enabled)
+    if admin_only is not None:
+        require_admin = bool(admin_only)
+    if directory:
+        profiles_dir = directory
+    if max_files is not None:
+        max_profiles = max_files
+    log.info("Request profiling enabled: {}, admin only: {}, directory: {}".format(profiling_enabled, require_admin,
+                                                                                 profiles_dir))
@@ -0,0 +1,280 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# Publish the loaded tables in shared memory so other processes attach to them instead of loading them again
+shared_tables_enabled = True
+# Directory of the registry file of the shared tables, shared by all the processes on the machine
+state_dir = tempfile.gettempdir()
+
+REGISTRY_FILE_NAME = "off-risk-shared-tables.json"
+ALIGNMENT = 64
+# The tmpfs of the POSIX shared memory segments. Writing past its size kills the process with SIGBUS, so the free
+# space is checked before a segment is created
+SHARED_MEMORY_PATH = "/dev/shm"
+
+# Segments attached by this process, by segment name
+attached_segments = {}
+
+
+class SharedMemoryFull(Exception):
+    pass
+
+
+def get_free_shared_memory():
+    """
+    Returns: the free space in bytes of the shared memory file system, or None if it is not known
+    """
+    try:
+        stat = os.statvfs(SHARED_MEMORY_PATH)
+    except OSError:
+        return None
+    return stat.f_bavail * stat.f_frsize
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _get_table_key(file_path, sep):
+    return "{}|{}".format(os.path.realpath(file_path), sep)
+
+
+def _get_segment_name(key, generation):
+    # Short names, the segment name length is limited on some systems
+    return "offrisk_{}_{}".format(hashlib.sha1(key.encode("utf-8")).hexdigest()[:12], generation)
+
+
+def _get_source_version(file_path):
+    stat = os.stat(file_path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+@contextmanager
+def _locked_registry():
+    """
+    Lock the registry file and load it. Changes to the registry are saved when the block ends
+    Returns: dictionary with the tables and the segments
+    """
+    os.makedirs(state_dir, exist_ok=True)
+    with open(os.path.join(state_dir, REGISTRY_FILE_NAME), "a+") as registry_file:
+        fcntl.flock(registry_file, fcntl.LOCK_EX)
+        try:
+            registry_file.seek(0)
+            content = registry_file.read()
+            registry = json.loads(content) if content else {}
+            registry.setdefault("tables", {})
+            registry.setdefault("segments", {})
+            for segment in registry["segments"].values():
+                segment["holders"] = [pid for pid in segment["holders"] if _is_alive(pid)]
+            _remove_retired_segments(registry)
+            yield registry
+            registry_file.seek(0)
+            registry_file.truncate()
+            json.dump(registry, registry_file)
+            registry_file.flush()
+        finally:
+            fcntl.flock(registry_file, fcntl.LOCK_UN)
+
+
+def _remove_retired_segments(registry):
+    """
+    Unlink the segments that were replaced by a newer generation and are not attached by any process
+    """
+    for segment_name, segment in list(registry["segments"].items()):
+        if segment["retired"] and not segment["holders"]:
+            _unlink_segment(segment_name)
+            del registry["segments"][segment_name]
+            log.info("Removed shared table segment {}".format(segment_name))
+
+
+def _unlink_segment(segment_name):
+    try:
+        shm = shared_memory.SharedMemory(name=segment_name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    # unlink also removes the segment from the resource tracker
+    shm.unlink()
+
+
+def _untrack(shm):
+    """
+    The segments are removed by the registry reference count and not when the process that created or attached
+    them exits
+    """
+    try:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+
+
+def _get_layout(arrays):
+    """
+    Args:
+        arrays: dictionary of array name to NumPy array
+
+    Returns: the layout of the arrays in the segment and the total size in bytes
+    """
+    layout = {}
+    offset = 0
+    for array_name, array in arrays.items():
+        offset = (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+        layout[array_name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += array.nbytes
+    return layout, max(offset, 1)
+
+
+def _attach(segment_name, segment):
+    """
+    Map the arrays of a segment without copying them
+    Returns: dictionary of array name to read only NumPy array
+    """
+    if segment_name not in attached_segments:
+        shm = shared_memory.SharedMemory(name=segment_name)
+        _untrack(shm)
+        arrays = {}
+        for array_name, array_layout in segment["layout"].items():
+            array = np.ndarray(tuple(array_layout["shape"]), dtype=np.dtype(array_layout["dtype"]), buffer=shm.buf,
+                               offset=array_layout["offset"])
+            array.flags.writeable = False
+            arrays[array_name] = array
+        attached_segments[segment_name] = (shm, arrays)
+    return attached_segments[segment_name][1]
+
+
+def attach_table(file_path, sep):
+    """
+    Attach to the shared arrays of a table if they were published from the current version of the file
+    Args:
+        file_path: path of the table file
+        sep: the separator of the file
+
+    Returns: (metadata, arrays) of the table, or None if the table is not published
+    """
+    key = _get_table_key(file_path, sep)
+    with _locked_registry() as registry:
+        table = registry["tables"].get(key)
+        if table is None or table["source_version"] != _get_source_version(file_path):
+            return None
+        segment_name = table["segment"]
+        segment = registry["segments"].get(segment_name)
+        if segment is None:
+            return None
+        try:
+            arrays = _attach(segment_name, segment)
+        except FileNotFoundError:
+            return None
+        if os.getpid() not in segment["holders"]:
+            segment["holders"].append(os.getpid())
+        log.debug("Attached shared table {} generation {}".format(file_path, table["generation"]))
+        return segment["metadata"], arrays
+
+
+def publish_table(file_path, sep, metadata, arrays):
+    """
+    Copy the arrays of a table to a new shared memory segment. The previous generation of the table is removed when
+    no process is attached to it anymore
+    Args:
+        file_path: path of the table file
+        sep: the separator of the file
+        metadata: JSON serializable description of the table
+        arrays: dictionary of array name to NumPy array
+
+    Returns: dictionary of array name to the read only shared arrays. Raises SharedMemoryFull if the segment does not
+    fit in the free shared memory
+    """
+    key = _get_table_key(file_path, sep)
+    layout, size = _get_layout(arrays)
+    with _locked_registry() as registry:
+        table = registry["tables"].get(key, {"generation": 0, "segment": None})
+        generation = table["generation"] + 1
+        segment_name = _get_segment_name(key, generation)
+        _unlink_segment(segment_name)
+        free_space = get_free_shared_memory()
+        if free_space is not None and free_space < size:
+            raise SharedMemoryFull("{} has {:.1f} MB free, the table needs {:.1f} MB".format(
+                SHARED_MEMORY_PATH, free_space / (1024 * 1024), size / (1024 * 1024)))
+        shm = shared_memory.SharedMemory(name=segment_name, create=True, size=size)
+        _untrack(shm)
+        for array_name, array in arrays.items():
+            target = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf, offset=layout[array_name]["offset"])
+            target[...] = array
+            del target
+        shm.close()
+
+        segment = {"key": key, "generation": generation, "layout": layout, "metadata": metadata,
+                   "holders": [], "retired": False}
+        registry["segments"][segment_name] = segment
+        if table["segment"] in registry["segments"]:
+            previous_segment = registry["segments"][table["segment"]]
+            previous_segment["retired"] = True
+            # The mapping of a removed segment stays valid in the processes that still use it
+            if os.getpid() in previous_segment["holders"]:
+                previous_segment["holders"].remove(os.getpid())
+        registry["tables"][key] = {"generation": generation, "segment": segment_name,
+                                   "source_version": _get_source_version(file_path)}
+        shared_arrays = _attach(segment_name, segment)
+        segment["holders"].append(os.getpid())
+        _remove_retired_segments(registry)
+    log.info("Published shared table {} generation {} ({:.1f} MB)".format(file_path, generation, size / (1024 * 1024)))
+    return shared_arrays
+
+
+def release_tables():
+    """
+    Remove this process from the holders of its shared tables, so replaced generations can be removed. The memory
+    stays mapped until the process exits, since the arrays may still be referenced
+    """
+    with _locked_registry() as registry:
+        for segment_name in attached_segments:
+            segment = registry["segments"].get(segment_name)
+            if segment is not None and os.getpid() in segment["holders"]:
+                segment["holders"].remove(os.getpid())
+        _remove_retired_segments(registry)
+
+
+def release_table(file_path, sep):
+    """
+    Remove this process from the holders of the segments of a table
+    Args:
+        file_path: path of the table file
+        sep: the separator of the file
+    """
+    key = _get_table_key(file_path, sep)
+    with _locked_registry() as registry:
+        for segment_name in attached_segments:
+            segment = registry["segments"].get(segment_name)
+            if segment is not None and segment["key"] == key and os.getpid() in segment["holders"]:
+                segment["holders"].remove(os.getpid())
+        _remove_retired_segments(registry)
+
+
+def update_shared_tables_settings(enabled=None, directory=None):
+    """
+    Update the settings of the shared tables
+    Args:
+        enabled: publish the tables in shared memory
+        directory: directory of the registry file
+    """
+    global shared_tables_enabled, state_dir
+    if enabled is not None:
+        shared_tables_enabled = bool(enabled)
+    if directory:
+        state_dir = directory
+    log.info("Shared tables enabled: {}, registry directory: {}".format(shared_tables_enabled, state_dir))
@@ -0,0 +1,175 @@
+import contextvars
+import hashlib
+import json
+import logging
+import sys
+
+log = logging.getLogger(__name__)
+
+# Minimum level of the log
+log_level = logging.INFO
+# "text" for the classic log lines, "json" for one JSON object per line
+log_format = "text"
+# Verbose capture: log the full request bodies and every tool output line. Only for debugging, the bodies of large
+# requests are megabytes
+debug_mode = False
+
+TEXT_FORMAT = "%(asctime)s.%(msecs)03d %(levelname)s [%(request_id)s] %(module)s - %(funcName)s: %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Lists with more items than this are logged as their length
+MAX_SUMMARY_LIST_ITEMS = 20
+MAX_SUMMARY_STRING_LENGTH = 100
+NO_REQUEST_ID = "-"
+
+_request_id = contextvars.ContextVar("request_id", default=NO_REQUEST_ID)
+_handler = None
+
+
+def set_request_id(request_id):
+    """
+    Set the request id that is added to every log record of the current context. Threads started with
+    contextvars.copy_context().run keep it
+    Args:
+        request_id: the request id
+
+    Returns: token for reset_request_id
+    """
+    return _request_id.set(str(request_id))
+
+
+def reset_request_id(token):
+    _request_id.reset(token)
+
+
+def get_request_id():
+    return _request_id.get()
+
+
+class RequestContextFilter(logging.Filter):
+    """
+    Add the request id of the current context to the log records
+    """
+
+    def filter(self, record):
+        record.request_id = _request_id.get()
+        return True
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Format the log records as text lines or as JSON objects. The fields given with extra={"fields": {...}} are
+    appended as key=value pairs to the text lines, and are keys of the JSON objects
+    """
+
+    def __init__(self, json_format=False):
+        super().__init__(TEXT_FORMAT, DATE_FORMAT)
+        self.json_format = json_format
+
+    def format(self, record):
+        if not hasattr(record, "request_id"):
+            record.request_id = _request_id.get()
+        fields = getattr(record, "fields", None) or {}
+        if not self.json_format:
+            line = super().format(record)
+            if fields:
+                line = "{} {}".format(line, " ".join("{}={}".format(key, json.dumps(value, default=str))
+                                                     for key, value in fields.items()))
+            return line
+        entry = {"time": "{}.{:03d}".format(self.formatTime(record, DATE_FORMAT), int(record.msecs)),
+                 "level": record.levelname, "logger": record.name, "function": record.funcName,
+                 "request_id": record.request_id, "message": record.getMessage()}
+        entry.update(fields)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging():
+    """
+    Add the structured handler to the root logger. Only the first call adds it, the next ones do nothing
+    """
+    global _handler
+    if _handler is not None:
+        return
+    _handler = logging.StreamHandler(sys.stderr)
+    _handler.addFilter(RequestContextFilter())
+    _handler.setFormatter(StructuredFormatter(log_format == "json"))
+    root_logger = logging.getLogger()
+    root_logger.addHandler(_handler)
+    root_logger.setLevel(log_level)
+
+
+def summarize_value(value):
+    """
+    Returns: the value if it is small, else its length
+    """
+    if isinstance(value, dict):
+        return {key: summarize_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if len(value) <= MAX_SUMMARY_LIST_ITEMS and all(isinstance(item, (str, int, float)) for item in value):
+            return list(value)
+        return {"count": len(value)}
+    if isinstance(value, str) and len(value) > MAX_SUMMARY_STRING_LENGTH:
+        return {"length": len(value)}
+    return value
+
+
+def summarize_body(body, raw_body=None):
+    """
+    Summarize a request body for the log: the small fields as they are, and the number of items of the lists, so
+    the log of a request does not grow with its off-targets
+    Args:
+        body: the parsed request body
+        raw_body: the bytes of the request. Its size and hash are added, so a request can be matched to its payload
+
+    Returns: dictionary of the summary
+    """
+    summary = {key: summarize_value(value) for key, value in body.items()}
+    if raw_body is not None:
+        summary["size_bytes"] = len(raw_body)
+        summary["hash"] = hashlib.blake2b(raw_body, digest_size=8).hexdigest()
+    return summary
+
+
+def log_request(logger, message, body, raw_body=None):
+    """
+    Log a new request with the summary of its body. The full body is logged only in debug mode
+    Args:
+        logger: the logger
+        message: the message, for example "Got new request"
+        body: the parsed request body
+        raw_body: the bytes of the request
+    """
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    logger.info(message, extra={"fields": summarize_body(body, raw_body)}, stacklevel=2)
+    if debug_mode:
+        # Formatted only when the record is emitted
+        logger.debug("Request body: %s", body, stacklevel=2)
+
+
+def update_logging_settings(level=None, format=None, debug=None, **kwargs):
+    """
+    Update the settings of the log
+    Args:
+        level: minimum level name, for example "INFO"
+        format: "text" or "json"
+        debug: verbose capture of the request bodies and the tool output. Sets the level to DEBUG
+        kwargs: the other keys of the log section, like log_path, which the CLI uses
+    """
+    global log_level, log_format, debug_mode
+    if level is not None:
+        log_level = logging.getLevelName(level.upper()) if isinstance(level, str) else level
+    if format is not None:
+        if format not in ["text", "json"]:
+            raise ValueError("log format should be text or json, not {}".format(format))
+        log_format = format
+    if debug is not None:
+        debug_mode = debug
+    if debug_mode:
+        log_level = logging.DEBUG
+    configure_logging()
+    _handler.setFormatter(StructuredFormatter(log_format == "json"))
+    logging.getLogger().setLevel(log_level)
+    log.info("Log level: {}, format: {}, debug mode: {}".format(logging.getLevelName(log_level), log_format,
+                                                                debug_mode))
@@ -0,0 +1,237 @@
+import gc
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+import shared_tables
+from metrics import count_cache
+
+log = logging.getLogger(__name__)
+
+# Loaded tables by path and read options. Tables loaded before the workers are forked are shared copy-on-write, and
+# other processes attach to the tables published in shared memory
+loaded_tables = {}
+
+STRING_COLUMN = "string"
+VALUE_COLUMN = "value"
+OBJECT_COLUMN = "object"
+
+
+class PackedTable(object):
+
+    def __init__(self, df):
+        """
+        Keep a dataframe as plain NumPy arrays. String columns are stored as fixed width UTF-8 bytes with a missing
+        values mask, so reading the table never writes to the memory pages of the data (no Python object per value)
+        Args:
+            df: the dataframe to pack
+        """
+        self.columns = list(df.columns)
+        self.length = len(df.index)
+        self.data = {}
+        for column in self.columns:
+            values = df[column].to_numpy()
+            if values.dtype != object:
+                self.data[column] = (VALUE_COLUMN, values, None)
+                continue
+            na_mask = pd.isna(values)
+            if all(isinstance(v, str) for v in values[~na_mask]):
+                encoded = np.array([v.encode("utf-8") if not na else b"" for v, na in zip(values, na_mask)],
+                                   dtype="S")
+                self.data[column] = (STRING_COLUMN, encoded, na_mask)
+            else:
+                log.debug("Column {} has mixed types and is kept as Python objects".format(column))
+                self.data[column] = (OBJECT_COLUMN, values, None)
+
+    @classmethod
+    def from_arrays(cls, metadata, arrays):
+        """
+        Build a table from arrays created by to_arrays, for example arrays in shared memory. The arrays are not copied
+        Args:
+            metadata: the table metadata
+            arrays: dictionary of array name to NumPy array
+
+        Returns: PackedTable
+        """
+        table = cls.__new__(cls)
+        table.columns = metadata["columns"]
+        table.length = metadata["length"]
+        table.data = {}
+        for i, column in enumerate(table.columns):
+            kind = metadata["kinds"][i]
+            table.data[column] = (kind, arrays["{}.values".format(i)],
+                                  arrays["{}.na".format(i)] if kind == STRING_COLUMN else None)
+        return table
+
+    def to_arrays(self):
+        """
+        Returns: JSON serializable metadata and a dictionary of array name to NumPy array, or None if the table has
+        columns of Python objects
+        """
+        arrays = {}
+        kinds = []
+        for i, column in enumerate(self.columns):
+            kind, values, na_mask = self.data[column]
+            if kind == OBJECT_COLUMN:
+                return None
+            kinds.append(kind)
+            arrays["{}.values".format(i)] = values
+            if na_mask is not None:
+                arrays["{}.na".format(i)] = na_mask
+        return {"columns": self.columns, "length": self.length, "kinds": kinds}, arrays
+
+    def __len__(self):
+        return self.length
+
+    def nbytes(self):
+        """
+        Returns: the size in bytes of the arrays
+        """
+        return sum(values.nbytes + (na_mask.nbytes if na_mask is not None else 0)
+                   for _, values, na_mask in self.data.values())
+
+    def _get_column(self, column, rows=None):
+        kind, values, na_mask = self.data[column]
+        if rows is not None:
+            values = values[rows]
+            na_mask = na_mask[rows] if na_mask is not None else None
+        if kind != STRING_COLUMN:
+            return values.copy() if rows is None else values
+        decoded = np.char.decode(values, "utf-8").astype(object)
+        decoded[na_mask] = np.nan
+        return decoded
+
+    def to_frame(self, rows=None, columns=None):
+        """
+        Build a dataframe from the table, like the one read from the file
+        Args:
+            rows: positions of the rows to take. None will take all the rows
+            columns: the columns to take. None will take all the columns
+
+        Returns: a new dataframe. The index is the row position in the table
+        """
+        columns = columns if columns is not None else self.columns
+        index = rows if rows is not None else pd.RangeIndex(self.length)
+        return pd.DataFrame({column: self._get_column(column, rows) for column in columns}, index=index,
+                            columns=columns)
+
+    def isin(self, column, values):
+        """
+        Args:
+            column: the column to search in
+            values: the values to search
+
+        Returns: boolean mask of the rows where column is one of values
+        """
+        kind, column_values, na_mask = self.data[column]
+        values = list(values)
+        if kind == STRING_COLUMN:
+            encoded = np.array([v.encode("utf-8") for v in values if isinstance(v, str)], dtype="S")
+            if len(encoded) == 0:
+                return np.zeros(self.length, dtype=bool)
+            return np.isin(column_values, encoded) & ~na_mask
+        return pd.Series(column_values).isin(values).to_numpy()
+
+    def select(self, column, values, columns=None):
+        """
+        Args:
+            column: the column to search in
+            values: the values to search
+            columns: the columns to return. None will return all the columns
+
+        Returns: dataframe of the rows where column is one of values
+        """
+        return self.to_frame(rows=np.flatnonzero(self.isin(column, values)), columns=columns)
+
+
+def load_table(file_path, sep=","):
+    """
+    Load a csv file as a PackedTable. A file is read only once per process
+    Args:
+        file_path: path of the file
+        sep: the separator of the file
+
+    Returns: PackedTable
+    """
+    key = (os.path.realpath(file_path), sep)
+    if key in loaded_tables:
+        count_cache("tables", "hit")
+        return loaded_tables[key]
+    loaded_tables[key] = _load_shared_table(file_path, sep) if shared_tables.shared_tables_enabled else None
+    if loaded_tables[key] is not None:
+        count_cache("tables", "shared")
+    else:
+        count_cache("tables", "miss")
+        log.debug("Loading table: {}".format(file_path))
+        loaded_tables[key] = PackedTable(pd.read_csv(file_path, sep=sep))
+        if shared_tables.shared_tables_enabled:
+            _publish_shared_table(file_path, sep, loaded_tables[key])
+    return loaded_tables[key]
+
+
+def _load_shared_table(file_path, sep):
+    """
+    Returns: the table attached from shared memory, or None if it was not published
+    """
+    try:
+        shared_table = shared_tables.attach_table(file_path, sep)
+    except Exception as e:
+        log.error("Could not attach the shared table {}: {}".format(file_path, e))
+        return None
+    if shared_table is None:
+        return None
+    metadata, arrays = shared_table
+    return PackedTable.from_arrays(metadata, arrays)
+
+
+def _publish_shared_table(file_path, sep, table):
+    """
+    Publish the table in shared memory and replace its arrays with the shared ones
+    """
+    table_arrays = table.to_arrays()
+    if table_arrays is None:
+        log.info("Table {} has columns of Python objects and is not shared".format(file_path))
+        return
+    metadata, arrays = table_arrays
+    try:
+        shared_arrays = shared_tables.publish_table(file_path, sep, metadata, arrays)
+    except shared_tables.SharedMemoryFull as e:
+        log.warning("Not enough shared memory for the table {}, every process loads its own copy: {}".format(
+            file_path, e))
+        return
+    except Exception as e:
+        log.error("Could not publish the shared table {}: {}".format(file_path, e))
+        return
+    shared_table = PackedTable.from_arrays(metadata, shared_arrays)
+    table.data = shared_table.data
+
+
+def evict_tables(path_prefix):
+    """
+    Remove the tables of the files under path_prefix from the cache, for example the tables of a replaced database
+    version. Tables that are still referenced stay valid
+    Args:
+        path_prefix: directory of the files
+    """
+    path_prefix = os.path.join(os.path.realpath(path_prefix), "")
+    for key in [key for key in loaded_tables if key[0].startswith(path_prefix)]:
+        del loaded_tables[key]
+        if shared_tables.shared_tables_enabled:
+            try:
+                shared_tables.release_table(*key)
+            except Exception as e:
+                log.error("Could not release the shared table {}: {}".format(key[0], e))
+        log.debug("Evicted table: {}".format(key[0]))
+
+
+def freeze_loaded_tables():
+    """
+    Move all the objects created so far to the permanent generation, so the garbage collector of a forked worker
+    does not write to their memory pages
+    """
+    gc.collect()
+    gc.freeze()
+    log.info("Loaded tables: {}, total size: {:.1f} MB".format(
+        len(loaded_tables), sum(table.nbytes() for table in loaded_tables.values()) / (1024 * 1024)))
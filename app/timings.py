@@ -0,0 +1,192 @@
+import logging
+import os
+import resource
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from datetime import timedelta
+from time import perf_counter
+
+from metrics import observe_stage
+
+log = logging.getLogger(__name__)
+
+# Duration statistics of every stage, for all the requests handled by this process
+stage_stats = {}
+_stats_lock = threading.Lock()
+
+# Record the RSS of the process before and after every stage
+memory_tracking = False
+# Also record the top allocations of every stage with tracemalloc. This slows down the requests considerably
+trace_allocations = False
+# Number of the top allocations reported for a stage
+top_allocations = 5
+
+# tracemalloc keeps these files out of the top allocations
+TRACEMALLOC_FILTERS = [tracemalloc.Filter(False, tracemalloc.__file__),
+                       tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                       tracemalloc.Filter(False, "<unknown>")]
+
+
+class Timings(object):
+
+    def __init__(self):
+        """
+        Durations of the stages of a single request. Stages with the same name are summed, for example the two
+        FlashFry runs of a request
+        """
+        self.stages = {}
+        self.memory = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        """
+        Add the duration of a stage to the request and to the process statistics
+        Args:
+            name: the stage name, for example "db:gencode:analyze"
+            seconds: the duration of the stage
+        """
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+        record_stage(name, seconds)
+
+    def add_memory(self, name, memory):
+        """
+        Add the memory usage of a stage. For stages with the same name the changes are summed and the top allocations
+        of the last one are kept
+        Args:
+            name: the stage name
+            memory: dictionary from _get_memory_usage
+        """
+        with self._lock:
+            previous = self.memory.get(name)
+            if previous is not None:
+                memory = dict(memory, rss_delta_mb=round(previous["rss_delta_mb"] + memory["rss_delta_mb"], 1),
+                              max_rss_delta_mb=round(previous["max_rss_delta_mb"] + memory["max_rss_delta_mb"], 1))
+            self.memory[name] = memory
+
+    def to_dict(self):
+        """
+        Returns: dictionary of stage name to duration in seconds, in the order the stages started
+        """
+        with self._lock:
+            return {name: round(seconds, 6) for name, seconds in self.stages.items()}
+
+    def memory_to_dict(self):
+        """
+        Returns: dictionary of stage name to its memory usage, or None if memory tracking is disabled
+        """
+        with self._lock:
+            return {name: dict(memory) for name, memory in self.memory.items()} if self.memory else None
+
+
+def _get_rss():
+    """
+    Returns: the current and the maximum resident set size of the process in MB
+    """
+    max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    try:
+        with open("/proc/self/statm") as statm_file:
+            rss_mb = int(statm_file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        rss_mb = max_rss_mb
+    return rss_mb, max_rss_mb
+
+
+def _get_top_allocations(snapshot_start):
+    """
+    Returns: the lines that allocated the most memory since snapshot_start, as strings
+    """
+    snapshot = tracemalloc.take_snapshot().filter_traces(TRACEMALLOC_FILTERS)
+    differences = snapshot.compare_to(snapshot_start.filter_traces(TRACEMALLOC_FILTERS), "lineno")
+    return ["{}:{} {:+.1f} KB ({:+d} blocks)".format(os.path.basename(difference.traceback[0].filename),
+                                                    difference.traceback[0].lineno, difference.size_diff / 1024,
+                                                    difference.count_diff)
+            for difference in differences[:top_allocations]]
+
+
+def _get_memory_usage(rss_start, snapshot_start):
+    """
+    Returns: dictionary with the RSS at the end of the stage, its change during the stage, the change of the
+    maximum RSS of the process (a stage that set a new peak) and the top allocations if they are traced
+    """
+    rss_mb, max_rss_mb = _get_rss()
+    memory = {"rss_mb": round(rss_mb, 1), "rss_delta_mb": round(rss_mb - rss_start[0], 1),
+              "max_rss_mb": round(max_rss_mb, 1), "max_rss_delta_mb": round(max_rss_mb - rss_start[1], 1)}
+    if snapshot_start is not None:
+        memory["top_allocations"] = _get_top_allocations(snapshot_start)
+    return memory
+
+
+def record_stage(name, seconds):
+    """
+    Add a stage duration to the process statistics
+    """
+    with _stats_lock:
+        stats = stage_stats.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+        stats["count"] += 1
+        stats["total"] += seconds
+        stats["max"] = max(stats["max"], seconds)
+    observe_stage(name, seconds)
+
+
+def get_stage_stats():
+    """
+    Returns: dictionary of stage name to the count, total, mean and max duration in seconds of the stage
+    """
+    with _stats_lock:
+        return {name: {"count": stats["count"], "total": round(stats["total"], 6),
+                       "mean": round(stats["total"] / stats["count"], 6), "max": round(stats["max"], 6)}
+                for name, stats in stage_stats.items()}
+
+
+@contextmanager
+def span(name, job=None):
+    """
+    Time a stage of a request. The duration is added to the timings of the job, or only to the process statistics
+    if there is no job. When memory tracking is enabled the memory usage of the stage is added to the job as well
+    Args:
+        name: the stage name
+        job: the Job of the request
+    """
+    rss_start = _get_rss() if memory_tracking else None
+    snapshot_start = tracemalloc.take_snapshot() if memory_tracking and tracemalloc.is_tracing() else None
+    time_start = perf_counter()
+    try:
+        yield
+    finally:
+        seconds = perf_counter() - time_start
+        if job is not None:
+            job.timings.add(name, seconds)
+        else:
+            record_stage(name, seconds)
+        log.info("Total run for {}: {}".format(name, timedelta(seconds=seconds)))
+        if rss_start is not None:
+            memory = _get_memory_usage(rss_start, snapshot_start)
+            if job is not None:
+                job.timings.add_memory(name, memory)
+            log.info("Memory for {}: RSS {} MB ({:+.1f} MB), max RSS {} MB ({:+.1f} MB){}".format(
+                name, memory["rss_mb"], memory["rss_delta_mb"], memory["max_rss_mb"], memory["max_rss_delta_mb"],
+                "".join("\n  {}".format(line) for line in memory.get("top_allocations", []))))
+
+
+def update_timings_settings(memory=None, allocations=None, top=None):
+    """
+    Update the settings of the stage memory accounting
+    Args:
+        memory: record the RSS before and after every stage
+        allocations: record the top allocations of every stage with tracemalloc
+        top: number of the top allocations reported for a stage
+    """
+    global memory_tracking, trace_allocations, top_allocations
+    if memory is not None:
+        memory_tracking = bool(memory)
+    if allocations is not None:
+        trace_allocations = bool(allocations)
+    if top is not None:
+        top_allocations = top
+    if memory_tracking and trace_allocations and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    elif not trace_allocations and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    log.info("Stage memory tracking: {}, allocation tracing: {}".format(memory_tracking, trace_allocations))
@@ -0,0 +1,195 @@
+import errno
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+log = logging.getLogger(__name__)
+
+# Use named pipes (FIFO) between OffRisk and the external tools instead of intermediate files
+streaming_enabled = True
+# Tools that can read their input / write their output through a named pipe
+streaming_tools = ["cas_offinder", "flashfry"]
+# Number of rows parsed at once from a tool output
+CHUNK_SIZE = 100000
+
+
+class _PipeThread(object):
+
+    def __init__(self, fifo_path, mode, handler):
+        """
+        Run handler on one end of a FIFO in a background thread, while the tool works on the other end
+        Args:
+            fifo_path: path of the FIFO
+            mode: "r" to read the tool output, "w" to write the tool input
+            handler: function that receives the open file object. Its return value is saved in result
+        """
+        self.fifo_path = fifo_path
+        self.mode = mode
+        self.handler = handler
+        self.result = None
+        self.error = None
+        self.cancelled = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            with open(self.fifo_path, self.mode) as fifo:
+                self.result = self.handler(fifo)
+        except BrokenPipeError as e:
+            if not self.cancelled:
+                self.error = e
+        except Exception as e:
+            self.error = e
+
+    def _release(self):
+        """
+        Open the other end of the FIFO without blocking, so a thread that still waits for the tool is released
+        """
+        flags = (os.O_WRONLY if self.mode == "r" else os.O_RDONLY) | os.O_NONBLOCK
+        try:
+            os.close(os.open(self.fifo_path, flags))
+        except OSError as e:
+            # ENXIO - nobody opened the FIFO for reading yet
+            if e.errno != errno.ENXIO:
+                raise
+
+    def finish(self, cancel=False):
+        """
+        Wait for the thread to finish
+        Args:
+            cancel: the tool failed, so the thread is released even if the tool never opened the FIFO
+
+        Returns: the result of handler
+        """
+        self.cancelled = cancel
+        while self.thread.is_alive():
+            self.thread.join(timeout=0.1)
+            # The tool has already exited. If it never opened the FIFO the thread is blocked on open
+            if self.thread.is_alive():
+                self._release()
+                time.sleep(0.01)
+        if self.error is not None and not cancel:
+            raise self.error
+        return self.result
+
+
+class ToolOutput(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.result = None
+
+
+def can_stream(tool):
+    """
+    Args:
+        tool: the tool name
+
+    Returns: True if the tool input and output can be passed through named pipes
+    """
+    return streaming_enabled and hasattr(os, "mkfifo") and tool in streaming_tools
+
+
+def read_tool_table(file_obj):
+    """
+    Parse a tab separated tool output in chunks, so parsing starts while the tool is still writing
+    Args:
+        file_obj: open file object of the output
+
+    Returns: dataframe of the output
+    """
+    chunks = list(pd.read_csv(file_obj, sep="\t", chunksize=CHUNK_SIZE))
+    if len(chunks) == 1:
+        return chunks[0]
+    return pd.concat(chunks, axis="index", ignore_index=True)
+
+
+@contextmanager
+def tool_input(workspace, tool, prefix, write_input):
+    """
+    Create the input of an external tool. When the tool supports it, a named pipe is used and write_input runs in a
+    background thread while the tool reads it
+    Args:
+        workspace: the Workspace of the request
+        tool: the tool name
+        prefix: prefix for the file name
+        write_input: function that receives an open text file and writes the input to it
+
+    Returns: the path the tool should read the input from
+    """
+    stream = can_stream(tool)
+    input_path = workspace.file_path("{}{}".format(prefix, os.urandom(4).hex()))
+    writer = None
+    if stream:
+        os.mkfifo(input_path)
+        writer = _PipeThread(input_path, "w", write_input)
+    else:
+        with open(input_path, "w") as input_file:
+            write_input(input_file)
+    try:
+        yield input_path
+        if writer is not None:
+            writer.finish()
+    except BaseException:
+        if writer is not None:
+            writer.finish(cancel=True)
+        raise
+    finally:
+        if os.path.exists(input_path):
+            os.remove(input_path)
+
+
+@contextmanager
+def tool_output(workspace, tool, prefix, parse_output=read_tool_table):
+    """
+    Create the output of an external tool. When the tool supports it, a named pipe is used and parse_output parses
+    the output in a background thread while the tool is still running
+    Args:
+        workspace: the Workspace of the request
+        tool: the tool name
+        prefix: prefix for the file name
+        parse_output: function that receives an open text file and returns the parsed output
+
+    Returns: ToolOutput with the path the tool should write to. result is set when the block ends
+    """
+    stream = can_stream(tool)
+    output = ToolOutput(workspace.file_path("{}{}".format(prefix, os.urandom(4).hex())))
+    reader = None
+    if stream:
+        os.mkfifo(output.path)
+        reader = _PipeThread(output.path, "r", parse_output)
+    try:
+        yield output
+        if reader is not None:
+            output.result = reader.finish()
+        else:
+            workspace.check_size()
+            with open(output.path, "r") as output_file:
+                output.result = parse_output(output_file)
+    except BaseException:
+        if reader is not None:
+            reader.finish(cancel=True)
+        raise
+    finally:
+        if os.path.exists(output.path):
+            os.remove(output.path)
+
+
+def update_tool_io_settings(streaming=None, tools=None):
+    """
+    Update the settings for passing data to the external tools
+    Args:
+        streaming: use named pipes for the tools that support it
+        tools: the tools that can use named pipes
+    """
+    global streaming_enabled, streaming_tools
+    if streaming is not None:
+        streaming_enabled = bool(streaming)
+    if tools is not None:
+        streaming_tools = list(tools)
+    log.info("Streaming tool input and output: {}, tools: {}".format(streaming_enabled, streaming_tools))
@@ -0,0 +1,227 @@
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+# Use the pool to limit the external tools running at the same time on this machine
+pool_enabled = True
+# Maximum number of processes of each tool that run at the same time
+tool_slots = {"cas_offinder": 2, "flashfry": 1, "crispritz": 1}
+# Memory in MB reserved for a single process of each tool. FlashFry runs in a JVM with -Xmx4g
+tool_memory_mb = {"cas_offinder": 1024, "flashfry": 4096, "crispritz": 2048}
+# Total memory in MB for all the tool processes together
+memory_budget_mb = 8192
+# Maximum number of processes of each tool waiting for a slot. More requests are rejected with 429
+max_queue_depth = 8
+# Maximum time in seconds to wait for a slot. After that the request is rejected with 503
+wait_timeout = 300
+# Value in seconds of the Retry-After header returned when the pool is saturated
+retry_after = 30
+# Directory of the pool state file, shared by all the workers on the machine
+state_dir = tempfile.gettempdir()
+
+POLL_INTERVAL = 0.2
+STATE_FILE_NAME = "off-risk-tool-pool.json"
+
+
+class ToolPoolError(Exception):
+    status_code = 503
+
+    def __init__(self, message, retry_after_seconds=None):
+        super().__init__(message)
+        self.retry_after = retry_after_seconds if retry_after_seconds is not None else retry_after
+
+
+class ToolPoolFull(ToolPoolError):
+    status_code = 429
+
+
+class ToolPoolTimeout(ToolPoolError):
+    status_code = 503
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _get_tool_memory(tool):
+    return tool_memory_mb.get(tool, 0)
+
+
+@contextmanager
+def _locked_state():
+    """
+    Lock the pool state file for the current process and load it. Changes to the state are saved when the block ends
+    Returns: dictionary with the running and waiting entries
+    """
+    os.makedirs(state_dir, exist_ok=True)
+    state_path = os.path.join(state_dir, STATE_FILE_NAME)
+    with open(state_path, "a+") as state_file:
+        fcntl.flock(state_file, fcntl.LOCK_EX)
+        try:
+            state_file.seek(0)
+            content = state_file.read()
+            state = json.loads(content) if content else {}
+            state.setdefault("running", [])
+            state.setdefault("waiting", [])
+            # Remove entries of workers that died without releasing their slot
+            for key in ["running", "waiting"]:
+                state[key] = [entry for entry in state[key] if _is_alive(entry["pid"])]
+            yield state
+            state_file.seek(0)
+            state_file.truncate()
+            json.dump(state, state_file)
+            state_file.flush()
+        finally:
+            fcntl.flock(state_file, fcntl.LOCK_UN)
+
+
+def _can_run(state, entry):
+    """
+    Check if there is a free slot and enough memory for entry. Entries of the same tool are served in order, so a
+    new entry can only run when no entry of its tool is waiting
+    Args:
+        state: the pool state
+        entry: the waiting or new entry
+
+    Returns: True if entry can start running
+    """
+    running_tool = [r for r in state["running"] if r["tool"] == entry["tool"]]
+    if len(running_tool) >= tool_slots.get(entry["tool"], 1):
+        return False
+    used_memory = sum(r["memory_mb"] for r in state["running"])
+    # A single process that is larger than the budget can still run when nothing else is running
+    if state["running"] and used_memory + entry["memory_mb"] > memory_budget_mb:
+        return False
+    for waiting in state["waiting"]:
+        if waiting["id"] == entry["id"]:
+            return True
+        if waiting["tool"] == entry["tool"]:
+            return False
+    return True
+
+
+def _acquire(tool, job=None):
+    entry = {"id": uuid.uuid4().hex, "pid": os.getpid(), "tool": tool, "memory_mb": _get_tool_memory(tool)}
+    with _locked_state() as state:
+        # A free slot is taken right away, only the requests that have to wait count against the queue depth
+        if _can_run(state, entry):
+            state["running"].append(entry)
+            return entry
+        waiting_tool = [w for w in state["waiting"] if w["tool"] == tool]
+        if len(waiting_tool) >= max_queue_depth:
+            raise ToolPoolFull("Too many {} processes are waiting ({}). Please try again later".format(
+                tool, len(waiting_tool)))
+        state["waiting"].append(entry)
+
+    time_start = time.monotonic()
+    try:
+        while True:
+            with _locked_state() as state:
+                if _can_run(state, entry):
+                    state["waiting"] = [w for w in state["waiting"] if w["id"] != entry["id"]]
+                    state["running"].append(entry)
+                    log.debug("Acquired a {} slot after {:.1f} seconds".format(tool, time.monotonic() - time_start))
+                    return entry
+            # Stop waiting when the request is cancelled or expired
+            if job is not None:
+                job.check()
+            if time.monotonic() - time_start > wait_timeout:
+                raise ToolPoolTimeout("No free slot for {} after {} seconds. Please try again later".format(
+                    tool, wait_timeout))
+            time.sleep(POLL_INTERVAL)
+    except BaseException:
+        # The request failed while waiting, make sure the entry does not stay in the queue
+        _remove_waiting(entry)
+        raise
+
+
+def _remove_waiting(entry):
+    with _locked_state() as state:
+        state["waiting"] = [w for w in state["waiting"] if w["id"] != entry["id"]]
+
+
+def _release(entry):
+    with _locked_state() as state:
+        state["running"] = [r for r in state["running"] if r["id"] != entry["id"]]
+
+
+def get_pool_status():
+    """
+    Returns: dictionary of tool name to the number of running and waiting processes of the tool, on this machine
+    """
+    status = {tool: {"running": 0, "waiting": 0} for tool in tool_slots}
+    with _locked_state() as state:
+        for key in ["running", "waiting"]:
+            for entry in state[key]:
+                status.setdefault(entry["tool"], {"running": 0, "waiting": 0})[key] += 1
+    return status
+
+
+@contextmanager
+def tool_slot(tool, job=None):
+    """
+    Wait for a free slot of tool in the pool and hold it until the block ends
+    Args:
+        tool: the tool name
+        job: the Job of the request. Waiting stops when the job is cancelled or expired
+
+    Raises:
+        ToolPoolFull: if the wait queue of the tool is full
+        ToolPoolTimeout: if no slot was free in wait_timeout seconds
+    """
+    if not pool_enabled or tool is None:
+        yield
+        return
+    entry = _acquire(tool, job)
+    try:
+        yield
+    finally:
+        _release(entry)
+
+
+def update_tool_pool_settings(enabled=None, slots=None, memory_mb=None, memory_budget=None, queue_depth=None,
+                              timeout=None, retry_after_seconds=None, state_directory=None):
+    """
+    Update the settings of the tool pool
+    Args:
+        enabled: use the pool
+        slots: dictionary of tool name to the maximum processes of the tool
+        memory_mb: dictionary of tool name to the memory in MB of a single process
+        memory_budget: total memory in MB for all the tool processes
+        queue_depth: maximum number of waiting processes of each tool
+        timeout: maximum time in seconds to wait for a slot
+        retry_after_seconds: value of the Retry-After header when the pool is saturated
+        state_directory: directory of the pool state file
+    """
+    global pool_enabled, memory_budget_mb, max_queue_depth, wait_timeout, retry_after, state_dir
+    if enabled is not None:
+        pool_enabled = bool(enabled)
+    if slots:
+        tool_slots.update(slots)
+    if memory_mb:
+        tool_memory_mb.update(memory_mb)
+    if memory_budget is not None:
+        memory_budget_mb = memory_budget
+    if queue_depth is not None:
+        max_queue_depth = queue_depth
+    if timeout is not None:
+        wait_timeout = timeout
+    if retry_after_seconds is not None:
+        retry_after = retry_after_seconds
+    if state_directory:
+        state_dir = state_directory
+    log.info("Tool pool enabled: {}, slots: {}, memory: {} MB of {} MB, queue depth: {}".format(
+        pool_enabled, tool_slots, tool_memory_mb, memory_budget_mb, max_queue_depth))
@@ -0,0 +1,142 @@
+import logging
+import os
+import shutil
+import tempfile
+
+log = logging.getLogger(__name__)
+
+# Candidate base directories for the scratch workspaces. The first writable one with room for a full workspace is
+# used, RAM backed tmpfs first and then disk
+workspace_base_paths = ["/dev/shm", "/var/tmp"]
+# Maximum size in bytes of the files in a single workspace
+workspace_size_budget = 2048 * 1024 * 1024
+
+
+class WorkspaceSizeExceeded(Exception):
+    pass
+
+
+class Workspace(object):
+
+    def __init__(self, name=None, base_path=None, size_budget=None):
+        """
+        Create a private scratch directory for the temporary files of a single request
+        Args:
+            name: name to add to the directory name, usually the request id
+            base_path: the directory to create the workspace in. if None the first usable workspace_base_paths is used
+            size_budget: maximum size in bytes of the workspace. if None workspace_size_budget is used. It is capped by
+                the free space of the base path, so a full workspace fails the size check before the disk is full
+        """
+        self.base_path = base_path if base_path else get_workspace_base_path()
+        size_budget = size_budget if size_budget is not None else workspace_size_budget
+        free_space = get_free_space(self.base_path)
+        self.size_budget = min(size_budget, free_space) if free_space is not None else size_budget
+        prefix = "off-risk-{}-".format(name) if name is not None else "off-risk-"
+        self.path = tempfile.mkdtemp(prefix=prefix, dir=self.base_path)
+        log.debug("Created workspace: {}".format(self.path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.cleanup()
+
+    def file_path(self, file_name):
+        """
+        Args:
+            file_name: name of the file
+
+        Returns: the path of file_name inside the workspace. The file is not created
+        """
+        return os.path.join(self.path, file_name)
+
+    def new_file(self, prefix="", suffix=""):
+        """
+        Create a new empty file with a unique name in the workspace
+        Args:
+            prefix: prefix for the file name
+            suffix: suffix for the file name
+
+        Returns: the path of the new file
+        """
+        fd, path = tempfile.mkstemp(prefix=prefix, suffix=suffix, dir=self.path)
+        os.close(fd)
+        return path
+
+    def size(self):
+        """
+        Returns: the total size in bytes of the files in the workspace
+        """
+        total_size = 0
+        for dir_path, _, file_names in os.walk(self.path):
+            for file_name in file_names:
+                try:
+                    total_size += os.lstat(os.path.join(dir_path, file_name)).st_size
+                except FileNotFoundError:
+                    continue
+        return total_size
+
+    def check_size(self):
+        """
+        Raise WorkspaceSizeExceeded if the workspace is larger than its budget
+        """
+        current_size = self.size()
+        if current_size > self.size_budget:
+            raise WorkspaceSizeExceeded("Workspace {} size {} bytes exceeded the budget of {} bytes".format(
+                self.path, current_size, self.size_budget))
+
+    def cleanup(self):
+        """
+        Remove the workspace with all its files
+        """
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path, ignore_errors=True)
+            log.debug("Removed workspace: {}".format(self.path))
+
+
+def get_free_space(path):
+    """
+    Returns: the free space in bytes of the file system of path, or None if it is not known
+    """
+    try:
+        stat = os.statvfs(path)
+    except OSError:
+        return None
+    return stat.f_bavail * stat.f_frsize
+
+
+def get_workspace_base_path():
+    """
+
+    Returns: the first writable directory from workspace_base_paths with free space for a full workspace. If none
+    has, the writable one with the most free space, or the system temp directory
+
+    """
+    base_paths = [base_path for base_path in workspace_base_paths
+                  if os.path.isdir(base_path) and os.access(base_path, os.W_OK | os.X_OK)]
+    free_spaces = [get_free_space(base_path) or 0 for base_path in base_paths]
+    for base_path, free_space in zip(base_paths, free_spaces):
+        if free_space >= workspace_size_budget:
+            return base_path
+    if base_paths:
+        base_path = base_paths[free_spaces.index(max(free_spaces))]
+        log.warning("No workspace base path has {} bytes free, using {} with {} bytes free".format(
+            workspace_size_budget, base_path, max(free_spaces)))
+        return base_path
+    return tempfile.gettempdir()
+
+
+def update_workspace_settings(base_paths=None, size_budget_mb=None):
+    """
+    Update the workspace settings
+    Args:
+        base_paths: candidate base directories for the workspaces
+        size_budget_mb: maximum size of a single workspace in MB
+    """
+    global workspace_base_paths, workspace_size_budget
+    if base_paths:
+        workspace_base_paths = list(base_paths)
+    if size_budget_mb is not None:
+        workspace_size_budget = int(size_budget_mb * 1024 * 1024)
+    log.info("Workspace base path: {}, size budget: {} bytes".format(get_workspace_base_path(),
+                                                                     workspace_size_budget))
@@ -0,0 +1,351 @@
+"""
+Differential equivalence harness of the off-target analysis. Runs a frozen reference implementation and a candidate
+engine on the same randomized synthetic inputs and diffs their results: the off-targets, the FlashFry score, the
+target risk results and every <db>_result_list, with canonical row ordering.
+
+The reference is the app directory of the equivalence-reference git tag (REFERENCE_REVISION): the state after the
+parser microbenchmarks change (user-042), before the analysis was optimized. The candidate is the app directory of the
+working tree, or of another revision. Every engine runs in its own process, since both trees have
+the same module names. --engine replaces the candidate extract_data with any function of the same signature, so a
+faster engine can be developed next to the current one and compared to it before it replaces it.
+
+Example:
+    python benchmarks/equivalence.py --cases 20 --seed 1 -o equivalence.json
+    python benchmarks/equivalence.py --engine off_risk_fast:extract_data --reference HEAD
+"""
+import argparse
+import importlib
+import io
+import json
+import logging
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import traceback
+from collections import Counter
+
+import pandas as pd
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(BENCHMARKS_DIR)
+APP_DIR = os.path.join(BASE_DIR, "app")
+
+# Tag of the implementation the candidates are compared to. A tag and not a commit hash, so the reference survives a
+# rebase of the history. Move it forward only after a change of the results was reviewed
+REFERENCE_REVISION = "equivalence-reference"
+WORKTREE = "worktree"
+DEFAULT_ENGINE = "off_risk:extract_data"
+DB_NAME_LIST = ["gencode", "mirgene", "remapepd", "enhanceratlas", "pfam", "targetscan", "omim", "humantf",
+                "protein_atlas", "rbp", "cosmic"]
+INCLUDE_OPTIONS = [None, ["off_targets"], ["risk"], ["off_targets", "risk"], ["db:all"],
+                   ["off_targets", "db:gencode", "db:omim"]]
+CASE_SIZES = [1, 5, 50, 500, 2000]
+SIGNIFICANT_DIGITS = 9
+
+
+def materialize_revision(revision, output_dir):
+    """
+    Extract the app directory of a git revision
+    Returns: path of the app directory
+    """
+    if subprocess.run(["git", "rev-parse", "--verify", "--quiet", "{}^{{commit}}".format(revision)], cwd=BASE_DIR,
+                      capture_output=True).returncode != 0:
+        raise ValueError("Git revision {} was not found. The reference is the {} tag, see benchmarks/README.md".format(
+            revision, REFERENCE_REVISION))
+    archive = subprocess.run(["git", "archive", "--format=tar", revision, "app"], cwd=BASE_DIR, capture_output=True,
+                             check=True).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(output_dir)
+    return os.path.join(output_dir, "app")
+
+
+def get_app_dir(revision, work_dir):
+    if revision == WORKTREE:
+        return APP_DIR
+    return materialize_revision(revision, os.path.join(work_dir, "revision-{}".format(revision.replace("/", "_"))))
+
+
+def generate_cases(work_dir, cases, seed, genes, sizes, dbs):
+    """
+    Write the databases and the random off-target sets of the cases. Every case has its own size, fraction of
+    off-targets in genes, databases and requested results, and some of them have duplicated off-targets
+    Returns: list of the cases, as dictionaries with the off-targets file, the databases and the include list
+    """
+    sys.path.insert(0, APP_DIR)
+    sys.path.insert(0, BENCHMARKS_DIR)
+    from fixtures import DATABASES_DIR_NAME, generate_databases, generate_off_targets
+
+    genes_df = generate_databases(os.path.join(work_dir, DATABASES_DIR_NAME), genes, seed=seed)
+    rng = random.Random(seed)
+    case_list = []
+    for case_id in range(cases):
+        rows = rng.choice(sizes)
+        off_target_df = generate_off_targets(genes_df, rows, seed=seed * 1000 + case_id,
+                                             in_genes_fraction=rng.choice([0.0, 0.3, 0.6, 1.0]))
+        if rows > 1 and rng.random() < 0.3:
+            # The same position found by several guides
+            duplicates = off_target_df.sample(n=max(1, rows // 10), random_state=case_id)
+            off_target_df = pd.concat([off_target_df, duplicates], ignore_index=True)
+            off_target_df["id"] = range(len(off_target_df.index))
+        case_dbs = [db_name for db_name in dbs if rng.random() < 0.8] or [dbs[0]]
+        if "gencode" in dbs and rng.random() < 0.7 and "gencode" not in case_dbs:
+            case_dbs.insert(0, "gencode")
+        off_targets_path = os.path.join(work_dir, "cases", "case_{}.tsv".format(case_id))
+        os.makedirs(os.path.dirname(off_targets_path), exist_ok=True)
+        off_target_df.to_csv(off_targets_path, sep="\t", index=False)
+        case_list.append({"case_id": case_id, "off_targets": len(off_target_df.index), "path": off_targets_path,
+                          "dbs": case_dbs, "include": rng.choice(INCLUDE_OPTIONS)})
+    return case_list
+
+
+def to_records(result):
+    """
+    Returns: the records of a JSON result of the analysis
+    """
+    if isinstance(result, (bytes, str)):
+        result = json.loads(result) if result else []
+    return result if result is not None else []
+
+
+def run_case(engine, case):
+    """
+    Run one case with an engine, in the worker process
+    Returns: dictionary of result table name to its records, or the error of the engine
+    """
+    from job import Job
+    from off_target import load_off_target_from_file
+
+    try:
+        with Job("equivalence-{}".format(case["case_id"]), deadline=0) as job:
+            off_target_df = load_off_target_from_file(case["path"])
+            ot_results, db_results, target_risk_results = engine(case["dbs"], off_target_df=off_target_df,
+                                                                 include=case["include"], job=job)
+    except Exception as e:
+        return {"error": "{}: {}".format(type(e).__name__, e), "traceback": traceback.format_exc()}
+    # save_db_result of older revisions returns a Flask response
+    db_results = db_results.json if hasattr(db_results, "json") else db_results
+    tables = {"off_targets": to_records(ot_results["off_targets"]),
+              "flashfry_score": to_records(ot_results["flashfry_score"]),
+              "target_risk_results": to_records(target_risk_results)}
+    for name, records in (db_results or {}).items():
+        tables[name] = to_records(records)
+    return {"tables": tables}
+
+
+def run_worker(args):
+    """
+    Run all the cases with an engine of an app directory and write the results as JSON
+    """
+    sys.path.insert(0, args.app_dir)
+    from db import update_database_base_path
+    from job import update_job_settings
+    from shared_tables import update_shared_tables_settings
+
+    with open(args.cases) as cases_file:
+        cases = json.load(cases_file)
+    update_database_base_path(args.databases)
+    update_shared_tables_settings(enabled=False)
+    update_job_settings(directory=os.path.join(os.path.dirname(args.output), "jobs"))
+    module_name, function_name = args.engine.split(":")
+    engine = getattr(importlib.import_module(module_name), function_name)
+    results = {str(case["case_id"]): run_case(engine, case) for case in cases}
+    with open(args.output, "w") as output_file:
+        json.dump(results, output_file)
+
+
+def run_engine(app_dir, engine, cases_path, databases_dir, output_path, verbose=False):
+    """
+    Run the cases with an engine in a new process
+    Returns: the results of the worker
+    """
+    command = [sys.executable, os.path.abspath(__file__), "worker", "--app-dir", app_dir, "--engine", engine,
+               "--cases", cases_path, "--databases", databases_dir, "--output", output_path]
+    if verbose:
+        command.append("-v")
+    subprocess.run(command, check=True)
+    with open(output_path) as output_file:
+        return json.load(output_file)
+
+
+def canonical_value(value, ordered_lists=True):
+    """
+    Returns: the value with the floats rounded to SIGNIFICANT_DIGITS, NaN as None and, unless ordered_lists, the
+    lists sorted
+    """
+    if isinstance(value, float):
+        if math.isnan(value):
+            return None
+        return float("{:.{}g}".format(value, SIGNIFICANT_DIGITS))
+    if isinstance(value, dict):
+        return {key: canonical_value(item, ordered_lists) for key, item in value.items()}
+    if isinstance(value, list):
+        items = [canonical_value(item, ordered_lists) for item in value]
+        return items if ordered_lists else sorted(items, key=lambda item: json.dumps(item, sort_keys=True))
+    return value
+
+
+def canonical_rows(records, ordered_lists=True):
+    """
+    Returns: Counter of the canonical JSON of every row, so the order of the rows does not matter
+    """
+    return Counter(json.dumps(canonical_value(record, ordered_lists), sort_keys=True) for record in records)
+
+
+def get_row_key(row):
+    for key in ["off_target_id", "index", "name"]:
+        if key in row:
+            return key, row[key]
+    return None
+
+
+def diff_table(reference_records, candidate_records, ordered_lists=True, max_examples=3):
+    """
+    Returns: None if the tables are equal, else the row counts and examples of the rows that are only in one of them.
+    Rows with the same key (for example the same off_target_id) are paired, with the columns that differ
+    """
+    reference_rows = canonical_rows(reference_records, ordered_lists)
+    candidate_rows = canonical_rows(candidate_records, ordered_lists)
+    if reference_rows == candidate_rows:
+        return None
+    only_reference = [json.loads(row) for row in (reference_rows - candidate_rows).elements()]
+    only_candidate = [json.loads(row) for row in (candidate_rows - reference_rows).elements()]
+    candidate_by_key = {get_row_key(row): row for row in only_candidate if get_row_key(row)}
+    examples = []
+    for reference_row in only_reference[:max_examples]:
+        example = {"reference": reference_row}
+        candidate_row = candidate_by_key.get(get_row_key(reference_row))
+        if candidate_row is not None:
+            example["candidate"] = candidate_row
+            example["columns"] = sorted(column for column in set(reference_row) | set(candidate_row)
+                                        if reference_row.get(column, "<missing>") !=
+                                        candidate_row.get(column, "<missing>"))
+        examples.append(example)
+    if not examples:
+        examples = [{"candidate": row} for row in only_candidate[:max_examples]]
+    return {"reference_rows": len(reference_records), "candidate_rows": len(candidate_records),
+            "only_in_reference": len(only_reference), "only_in_candidate": len(only_candidate),
+            "examples": examples}
+
+
+def diff_case(reference_result, candidate_result, ordered_lists=True, max_examples=3):
+    """
+    Returns: dictionary of table name to its differences. Empty if the results are equal
+    """
+    if "error" in reference_result or "error" in candidate_result:
+        reference_error = reference_result.get("error", "").split(":")[0]
+        candidate_error = candidate_result.get("error", "").split(":")[0]
+        if reference_error == candidate_error:
+            return {}
+        return {"error": {"reference": reference_result.get("error"), "candidate": candidate_result.get("error"),
+                          "traceback": candidate_result.get("traceback") or reference_result.get("traceback")}}
+    differences = {}
+    reference_tables = reference_result["tables"]
+    candidate_tables = candidate_result["tables"]
+    for table in sorted(set(reference_tables) | set(candidate_tables)):
+        if table not in candidate_tables or table not in reference_tables:
+            differences[table] = {"missing_in": "candidate" if table not in candidate_tables else "reference"}
+            continue
+        table_diff = diff_table(reference_tables[table], candidate_tables[table], ordered_lists, max_examples)
+        if table_diff:
+            differences[table] = table_diff
+    return differences
+
+
+def run_equivalence(args):
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="off-risk-equivalence-")
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        dbs = DB_NAME_LIST if "all" in args.dbs else args.dbs
+        cases = generate_cases(work_dir, args.cases, args.seed, args.genes, args.sizes, dbs)
+        cases_path = os.path.join(work_dir, "cases.json")
+        with open(cases_path, "w") as cases_file:
+            json.dump(cases, cases_file)
+        databases_dir = os.path.join(work_dir, "databases")
+
+        reference_results = run_engine(get_app_dir(args.reference, work_dir), DEFAULT_ENGINE, cases_path,
+                                       databases_dir, os.path.join(work_dir, "reference.json"), args.verbose)
+        candidate_results = run_engine(get_app_dir(args.candidate, work_dir), args.engine, cases_path,
+                                       databases_dir, os.path.join(work_dir, "candidate.json"), args.verbose)
+
+        report_cases = []
+        for case in cases:
+            case_id = str(case["case_id"])
+            differences = diff_case(reference_results[case_id], candidate_results[case_id],
+                                    ordered_lists=not args.unordered_lists, max_examples=args.max_examples)
+            report_cases.append(dict(case, equal=not differences, differences=differences,
+                                     error=reference_results[case_id].get("error")))
+        return {"reference": args.reference, "candidate": args.candidate, "engine": args.engine, "seed": args.seed,
+                "cases": len(cases), "different_cases": sum(not case["equal"] for case in report_cases),
+                "reference_errors": sum(bool(case["error"]) for case in report_cases), "results": report_cases}
+    finally:
+        if not args.keep and not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def parse_arg(argv):
+    parser = argparse.ArgumentParser(description="Compare the results of an analysis engine to a frozen reference")
+    subparsers = parser.add_subparsers(dest="command")
+
+    worker_parser = subparsers.add_parser("worker", help="Run the cases with one engine (used internally)")
+    worker_parser.add_argument("--app-dir", required=True)
+    worker_parser.add_argument("--engine", default=DEFAULT_ENGINE)
+    worker_parser.add_argument("--cases", required=True)
+    worker_parser.add_argument("--databases", required=True)
+    worker_parser.add_argument("--output", required=True)
+    worker_parser.add_argument("-v", "--verbose", action="store_true")
+
+    parser.add_argument("--reference", default=REFERENCE_REVISION,
+                        help="Git revision of the reference implementation")
+    parser.add_argument("--candidate", default=WORKTREE,
+                        help="Git revision of the candidate, or worktree for the app directory of the working tree")
+    parser.add_argument("--engine", default=DEFAULT_ENGINE,
+                        help="module:function of the candidate, with the signature of off_risk.extract_data")
+    parser.add_argument("--cases", type=int, default=10, help="Number of random cases")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the cases and the databases")
+    parser.add_argument("--sizes", nargs="+", type=int, default=CASE_SIZES, help="Off-target set sizes to choose from")
+    parser.add_argument("--genes", type=int, default=300, help="Number of genes in the databases")
+    parser.add_argument("--dbs", nargs="+", default=["all"], help="Databases the cases choose from")
+    parser.add_argument("--unordered-lists", action="store_true",
+                        help="Ignore the order of the values in list columns")
+    parser.add_argument("--max-examples", type=int, default=3, help="Example rows of every different table")
+    parser.add_argument("--work-dir", help="Directory of the cases and the results. A temporary directory, "
+                                           "removed at the end, if not given")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary directory")
+    parser.add_argument("-o", "--output", help="Output JSON report. Only the summary is printed if not given")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show the log of the analysis")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_arg(argv[1:])
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if args.command == "worker":
+        run_worker(args)
+        return 0
+    report = run_equivalence(args)
+    for case in report["results"]:
+        if not case["equal"]:
+            print("case {} ({} off-targets, dbs {}, include {}): {} differ".format(
+                case["case_id"], case["off_targets"], ",".join(case["dbs"]), case["include"],
+                ", ".join(sorted(case["differences"]))), file=sys.stderr)
+    print("{} of {} cases differ from the reference {}".format(report["different_cases"], report["cases"],
+                                                               report["reference"]), file=sys.stderr)
+    if report["reference_errors"]:
+        # Cases that fail the same way in both engines are equal, but they do not compare any result
+        print("{} cases failed in the reference, for example: {}".format(
+            report["reference_errors"], next(case["error"] for case in report["results"] if case["error"])),
+            file=sys.stderr)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+    return 1 if report["different_cases"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
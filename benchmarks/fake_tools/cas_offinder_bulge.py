@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Stand-in for cas-offinder-bulge. Set OFF_RISK_CAS_OFFINDER_BULGE_PATH to this file. Runs as
+"python cas_offinder_bulge.py <input file> <C|G|A> <output file>" and reads the same input file format:
+the genome path, then the pattern with the DNA and RNA bulge sizes, then a query sequence and its maximum mismatches
+on every line.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+from fake_tool import fail, get_hits, get_random, random_position, read_text, resolve_base, simulate_latency, \
+    write_text  # noqa: E402
+
+OUTPUT_COLUMNS = ["#Bulge type", "crRNA", "DNA", "Chromosome", "Position", "Direction", "Mismatches", "Bulge Size"]
+
+
+def read_input(input_text):
+    """
+    Returns: the pattern, the maximum DNA and RNA bulge sizes and a list of (query, maximum mismatches)
+    """
+    lines = [line.strip() for line in input_text.splitlines() if line.strip()]
+    if len(lines) < 3:
+        fail("Invalid input: expected the genome, the pattern and at least one query")
+    pattern_fields = lines[1].split()
+    pattern = pattern_fields[0].upper()
+    dna_bulge = int(pattern_fields[1]) if len(pattern_fields) > 1 else 0
+    rna_bulge = int(pattern_fields[2]) if len(pattern_fields) > 2 else 0
+    queries = []
+    for line in lines[2:]:
+        fields = line.split()
+        queries.append((fields[0].upper(), int(fields[1]) if len(fields) > 1 else 0))
+    return pattern, dna_bulge, rna_bulge, queries
+
+
+def get_hit(pattern, query, max_mismatches, dna_bulge, rna_bulge, rng):
+    """
+    Returns: the output fields of a random hit of the query
+    """
+    mismatches = rng.randint(0, max_mismatches)
+    # The query N positions are the PAM, they take their nucleotides from the pattern
+    template = "".join(pattern[i] if base == "N" and i < len(pattern) else base for i, base in enumerate(query))
+    guide_positions = [i for i, base in enumerate(query) if base != "N"]
+    dna = [resolve_base(base, rng) if query[i] == "N" else base for i, base in enumerate(template)]
+    for i in rng.sample(guide_positions, min(mismatches, len(guide_positions))):
+        dna[i] = rng.choice([n for n in "ACGT" if n != dna[i]]).lower()
+    cr_rna = list(query)
+    bulge_types = ["X"] + (["DNA"] if dna_bulge > 0 else []) + (["RNA"] if rna_bulge > 0 else [])
+    bulge_type = rng.choice(bulge_types)
+    bulge_size = 0
+    if bulge_type != "X" and len(guide_positions) > 2:
+        bulge_size = rng.randint(1, dna_bulge if bulge_type == "DNA" else rna_bulge)
+        position = rng.choice(guide_positions[1:-1])
+        if bulge_type == "DNA":
+            dna[position:position] = [rng.choice("ACGT") for _ in range(bulge_size)]
+            cr_rna[position:position] = ["-"] * bulge_size
+        else:
+            dna[position:position + bulge_size] = ["-"] * bulge_size
+    dna = "".join(dna)
+    chromosome, position, strand = random_position(rng, len(dna))
+    return [bulge_type, "".join(cr_rna), dna, chromosome, position, strand, mismatches, bulge_size]
+
+
+def main(argv):
+    if len(argv) < 4:
+        fail("Usage: {} <input file> <C|G|A> <output file>".format(argv[0]))
+    input_path, _, output_path = argv[1:4]
+    pattern, dna_bulge, rna_bulge, queries = read_input(read_text(input_path))
+    simulate_latency("cas_offinder", pattern, *(query for query, _ in queries))
+    lines = ["\t".join(OUTPUT_COLUMNS)]
+    for query, max_mismatches in queries:
+        rng = get_random("cas_offinder", pattern, dna_bulge, rna_bulge, query, max_mismatches)
+        for _ in range(get_hits()):
+            lines.append("\t".join(str(field) for field in
+                                   get_hit(pattern, query, max_mismatches, dna_bulge, rna_bulge, rng)))
+    write_text(output_path, "\n".join(lines) + "\n")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Stand-in for crispritz.py. Put this directory first on PATH. Supports the search command with the options the server
+uses, and writes <output>.targets.txt in the CRISPRitz format.
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+from fake_tool import fail, get_hits, get_random, random_position, read_text, resolve_base, simulate_latency, \
+    write_text  # noqa: E402
+
+OUTPUT_COLUMNS = ["#Bulge_type", "crRNA", "DNA", "Chromosome", "Position", "Cluster Position", "Direction",
+                  "Mismatches", "Bulge_Size", "Total"]
+
+
+def read_pam(pam_text):
+    """
+    Returns: the full pattern of the PAM file, for example NNNNNNNNNNNNNNNNNNNNNGG
+    """
+    fields = pam_text.split()
+    if not fields:
+        fail("Invalid PAM file")
+    return fields[0].upper()
+
+
+def get_hit(pattern, query, max_mismatches, rng):
+    """
+    Returns: the output fields of a random hit of the query
+    """
+    mismatches = rng.randint(0, max_mismatches)
+    # The query N positions take their nucleotides from the PAM pattern
+    dna = [resolve_base(pattern[i] if base == "N" and i < len(pattern) else base, rng) for i, base in enumerate(query)]
+    guide_positions = [i for i, base in enumerate(query) if base != "N"]
+    for i in rng.sample(guide_positions, min(mismatches, len(guide_positions))):
+        dna[i] = rng.choice([n for n in "ACGT" if n != dna[i]]).lower()
+    chromosome, position, strand = random_position(rng, len(dna))
+    return ["X", query, "".join(dna), chromosome, position, position, strand, mismatches, 0, mismatches]
+
+
+def run_search(args):
+    pattern = read_pam(read_text(args.pam_file))
+    queries = [line.strip().upper() for line in read_text(args.sequences_file).splitlines() if line.strip()]
+    simulate_latency("crispritz", pattern, args.mm, *queries)
+    lines = ["\t".join(OUTPUT_COLUMNS)]
+    for query in queries:
+        rng = get_random("crispritz", pattern, query, args.mm)
+        for _ in range(get_hits()):
+            lines.append("\t".join(str(field) for field in get_hit(pattern, query, args.mm, rng)))
+    write_text("{}.targets.txt".format(args.output), "\n".join(lines) + "\n")
+
+
+def parse_arg(argv):
+    parser = argparse.ArgumentParser(description="Stand-in for CRISPRitz")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    search_parser = subparsers.add_parser("search")
+    search_parser.add_argument("genome_folder")
+    search_parser.add_argument("pam_file")
+    search_parser.add_argument("sequences_file")
+    search_parser.add_argument("output")
+    search_parser.add_argument("-mm", type=int, default=0)
+    search_parser.add_argument("-bDNA", type=int, default=0)
+    search_parser.add_argument("-bRNA", type=int, default=0)
+    search_parser.add_argument("-th", type=int, default=1)
+    search_parser.add_argument("-r", action="store_true")
+    search_parser.add_argument("-scores")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_arg(argv[1:])
+    if args.command == "search":
+        run_search(args)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,102 @@
+"""
+Shared code of the stand-in search tools. The tools write outputs in the formats of the real tools, with random hits
+that are derived from the seed and the guide, so the same request always gives the same off-targets.
+
+The tools are configured with environment variables, since the server runs them with fixed arguments:
+    OFF_RISK_FAKE_HITS: off-targets for every guide (default 20)
+    OFF_RISK_FAKE_LATENCY: seconds every run takes (default 0.5)
+    OFF_RISK_FAKE_LATENCY_JITTER: the latency varies randomly by up to this fraction (default 0.2)
+    OFF_RISK_FAKE_SEED: the random seed (default 0)
+    OFF_RISK_FAKE_CHROMOSOMES: number of chromosomes of the hits (default 3, like benchmarks/fixtures.py)
+    OFF_RISK_FAKE_CHROMOSOME_LENGTH: length of every chromosome (default 5000000, like benchmarks/fixtures.py)
+"""
+import os
+import random
+import sys
+import time
+import zlib
+
+NUCLEOTIDES = "ACGT"
+IUPAC_CODES = {"R": "AG", "Y": "CT", "S": "GC", "W": "AT", "K": "GT", "M": "AC", "B": "CGT", "D": "AGT", "H": "ACT",
+               "V": "ACG", "N": "ACGT"}
+
+
+def get_setting(name, default, value_type=int):
+    value = os.environ.get("OFF_RISK_FAKE_{}".format(name))
+    return default if value in (None, "") else value_type(value)
+
+
+def get_hits():
+    return get_setting("HITS", 20)
+
+
+def get_chromosomes():
+    return [str(i + 1) for i in range(get_setting("CHROMOSOMES", 3))]
+
+
+def get_random(*keys):
+    """
+    Returns: random generator seeded by the seed setting and the keys, for example the guide sequence
+    """
+    seed = get_setting("SEED", 0)
+    return random.Random(zlib.crc32("{}:{}".format(seed, ":".join(str(key) for key in keys)).encode()))
+
+
+def simulate_latency(*keys):
+    """
+    Wait the configured latency, as if the tool searched the genome
+    """
+    latency = get_setting("LATENCY", 0.5, float)
+    jitter = get_setting("LATENCY_JITTER", 0.2, float)
+    if latency > 0:
+        time.sleep(max(0.0, latency * (1 + get_random("latency", *keys).uniform(-jitter, jitter))))
+
+
+def resolve_base(base, rng):
+    """
+    Returns: a nucleotide matching the IUPAC code of base
+    """
+    return rng.choice(IUPAC_CODES.get(base.upper(), base.upper()))
+
+
+def mutate(sequence, mismatches, rng, lowercase=True):
+    """
+    Returns: the sequence with mismatches random substitutions (lower case, like the real tools) and the N
+    positions replaced by random nucleotides
+    """
+    bases = [resolve_base(base, rng) for base in sequence]
+    positions = [i for i, base in enumerate(sequence) if base.upper() in NUCLEOTIDES]
+    for i in rng.sample(positions, min(mismatches, len(positions))):
+        base = rng.choice([n for n in NUCLEOTIDES if n != bases[i]])
+        bases[i] = base.lower() if lowercase else base
+    return "".join(bases)
+
+
+def random_position(rng, length):
+    """
+    Returns: random chromosome (with the "chr" prefix, like the genome FASTA), start position and strand of a hit
+    """
+    chromosome_length = get_setting("CHROMOSOME_LENGTH", 5000000)
+    return ("chr{}".format(rng.choice(get_chromosomes())), rng.randint(1, chromosome_length - length - 1),
+            rng.choice("+-"))
+
+
+def read_text(path):
+    """
+    Read a whole input file. The input may be a named pipe the server is still writing
+    """
+    with open(path) as input_file:
+        return input_file.read()
+
+
+def write_text(path, text):
+    """
+    Write a whole output file. The output may be a named pipe the server is reading
+    """
+    with open(path, "w") as output_file:
+        output_file.write(text)
+
+
+def fail(message):
+    print(message, file=sys.stderr)
+    sys.exit(1)
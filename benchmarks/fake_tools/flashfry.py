@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Stand-in for the FlashFry jar. Set OFF_RISK_FLASHFRY_PATH to this file and put this directory first on PATH, so the
+java wrapper here runs it. Supports the index, discover and score commands with the options the server uses.
+"""
+import argparse
+import csv
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+from fake_tool import get_hits, get_random, mutate, random_position, read_text, simulate_latency, \
+    write_text  # noqa: E402
+
+GUIDE_LENGTH = 20
+PAM = "NGG"
+DISCOVER_COLUMNS = ["contig", "start", "stop", "target", "context", "overflow", "orientation", "otCount"]
+SCORE_COLUMNS = {"doench2014ontarget": ["Doench2014OnTarget"],
+                 "doench2016cfd": ["DoenchCFD_maxOT", "DoenchCFD_specificityscore"],
+                 "dangerous": ["dangerous_GC", "dangerous_polyT", "dangerous_in_genome"],
+                 "hsu2013": ["Hsu2013"],
+                 "minot": ["basesDiffToClosestHit", "closestHitCount"]}
+
+
+def read_fasta(fasta):
+    """
+    Returns: list of (name, sequence) of the FASTA records
+    """
+    records = []
+    for line in fasta.splitlines():
+        line = line.strip()
+        if line.startswith(">"):
+            records.append([line[1:].split()[0], ""])
+        elif line and records:
+            records[-1][1] += line.upper()
+    return [tuple(record) for record in records]
+
+
+def find_targets(sequence):
+    """
+    Returns: start positions of the targets (a guide followed by an NGG PAM) on the forward strand
+    """
+    target_length = GUIDE_LENGTH + len(PAM)
+    return [start for start in range(len(sequence) - target_length + 1)
+            if sequence[start + target_length - 2:start + target_length] == "GG"]
+
+
+def get_off_targets(target, max_mismatch):
+    """
+    Returns: the off-targets of a target in the FlashFry position output format:
+    sequence_occurrences_mismatches<chromosome:position^F|chromosome:position^R>, separated by commas
+    """
+    rng = get_random("flashfry", target, max_mismatch)
+    hits = get_hits()
+    off_targets = []
+    while hits > 0:
+        occurrences = min(hits, rng.choice([1, 1, 1, 2]))
+        hits -= occurrences
+        mismatches = rng.randint(1, max(1, max_mismatch))
+        sequence = mutate(target[:GUIDE_LENGTH], mismatches, rng, lowercase=False) + mutate(PAM, 0, rng)
+        positions = []
+        for _ in range(occurrences):
+            chromosome, position, strand = random_position(rng, len(sequence))
+            positions.append("{}:{}^{}".format(chromosome, position, "F" if strand == "+" else "R"))
+        off_targets.append("{}_{}_{}<{}>".format(sequence, occurrences, mismatches, "|".join(positions)))
+    return off_targets
+
+
+def to_tsv(columns, rows):
+    output = io.StringIO()
+    writer = csv.writer(output, delimiter="\t", lineterminator="\n")
+    writer.writerow(columns)
+    writer.writerows(rows)
+    return output.getvalue()
+
+
+def run_index(args):
+    simulate_latency("index", args.database)
+    database_dir = os.path.dirname(args.database)
+    if database_dir:
+        os.makedirs(database_dir, exist_ok=True)
+    write_text(args.database, "fake FlashFry database for {}\n".format(args.enzyme))
+
+
+def run_discover(args):
+    records = read_fasta(read_text(args.fasta))
+    simulate_latency("discover", *(sequence for _, sequence in records))
+    rows = []
+    for contig, sequence in records:
+        for start in find_targets(sequence):
+            target = sequence[start:start + GUIDE_LENGTH + len(PAM)]
+            off_targets = get_off_targets(target, args.maxMismatch)
+            ot_count = sum(int(off_target.split("_")[1]) for off_target in off_targets)
+            rows.append([contig, start, start + len(target), target, target, "OK", "FWD", ot_count,
+                         ",".join(off_targets)])
+    write_text(args.output, to_tsv(DISCOVER_COLUMNS + ["offTargets"], rows))
+
+
+def run_score(args):
+    discover_rows = list(csv.DictReader(io.StringIO(read_text(args.input)), delimiter="\t"))
+    simulate_latency("score", *(row["target"] for row in discover_rows))
+    metrics = [metric.strip().lower() for metric in args.scoringMetrics.split(",") if metric.strip()]
+    score_columns = [column for metric in metrics for column in SCORE_COLUMNS.get(metric, [])]
+    rows = []
+    for discover_row in discover_rows:
+        rng = get_random("flashfry", "score", discover_row["target"])
+        target = discover_row["target"]
+        scores = {"Doench2014OnTarget": round(rng.random(), 4),
+                  "DoenchCFD_maxOT": round(rng.random(), 4),
+                  "DoenchCFD_specificityscore": round(rng.random(), 4),
+                  "dangerous_GC": "GC_TOO_HIGH" if target.count("G") + target.count("C") > 16 else "NONE",
+                  "dangerous_polyT": "TTTT" if "TTTT" in target else "NONE",
+                  "dangerous_in_genome": "NONE",
+                  "Hsu2013": round(rng.uniform(0, 100), 4),
+                  "basesDiffToClosestHit": rng.randint(1, 4),
+                  "closestHitCount": rng.randint(1, 10)}
+        rows.append([discover_row[column] for column in DISCOVER_COLUMNS] +
+                    [scores[column] for column in score_columns])
+    write_text(args.output, to_tsv(DISCOVER_COLUMNS + score_columns, rows))
+
+
+def parse_arg(argv):
+    parser = argparse.ArgumentParser(description="Stand-in for FlashFry")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    index_parser = subparsers.add_parser("index")
+    index_parser.add_argument("--tmpLocation")
+    index_parser.add_argument("--database", required=True)
+    index_parser.add_argument("--reference")
+    index_parser.add_argument("--enzyme", default="spcas9ngg")
+
+    discover_parser = subparsers.add_parser("discover")
+    discover_parser.add_argument("--database", required=True)
+    discover_parser.add_argument("--fasta", required=True)
+    discover_parser.add_argument("--output", required=True)
+    discover_parser.add_argument("--positionOutput", action="store_true")
+    discover_parser.add_argument("--maxMismatch", type=int, default=4)
+
+    score_parser = subparsers.add_parser("score")
+    score_parser.add_argument("--input", required=True)
+    score_parser.add_argument("--output", required=True)
+    score_parser.add_argument("--scoringMetrics", default="doench2014ontarget")
+    score_parser.add_argument("--database")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_arg(argv[1:])
+    {"index": run_index, "discover": run_discover, "score": run_score}[args.command](args)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
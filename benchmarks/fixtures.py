@@ -0,0 +1,389 @@
+"""
+Deterministic synthetic fixtures for the benchmarks: a scaled-down genome, the annotation databases in the formats
+the Db classes read, and off-target sets of any size. The same seed always gives the same files.
+
+Example:
+    python benchmarks/fixtures.py -o /tmp/off-risk-bench --off-targets 10 1000 100000
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(BASE_DIR, "app")
+sys.path.insert(0, APP_DIR)
+
+from app_config import get_config  # noqa: E402
+
+DATABASES_DIR_NAME = "databases"
+GENOME_DIR_NAME = "genome"
+OFF_TARGETS_DIR_NAME = "off_targets"
+
+NUCLEOTIDES = np.array(list("ACGT"))
+GENE_TYPES = ["protein_coding", "lncRNA", "miRNA", "processed_pseudogene"]
+GENE_TYPE_WEIGHTS = [0.7, 0.15, 0.05, 0.1]
+EXPRESSION_LEVELS = ["Not detected", "Low", "Medium", "High"]
+PROTEIN_ATLAS_TISSUES = ["adipose tissue - adipocytes", "brain - neuronal cells", "liver - hepatocytes",
+                         "lung - macrophages", "skin - keratinocytes", "testis - leydig cells"]
+RBP_CATEGORIES = ["Essential Genes", "Splicing regulation", "Spliceosome", "RNA modification", "3' end processing",
+                  "rRNA processing", "Ribosome & basic translation", "RNA stability & decay", "microRNA processing",
+                  "RNA localization", "RNA export", "Translation regulation", "tRNA regulation",
+                  "mitochondrial RNA regulation", "Viral RNA regulation", "snoRNA / snRNA / telomerase",
+                  "P-body / stress granules", "Exon Junction Complex"]
+INHERITANCE_MODELS = ["Autosomal dominant", "Autosomal recessive", "X-linked recessive"]
+CANCER_ROLES = ["oncogene", "TSG", "oncogene, fusion", "TSG, fusion"]
+
+
+def get_chromosomes(chromosomes):
+    """
+    Returns: the chromosome names, without the "chr" prefix like in the preprocessed databases
+    """
+    return [str(i + 1) for i in range(chromosomes)]
+
+
+def generate_genome(output_dir, chromosomes=3, chromosome_length=5000000, seed=0):
+    """
+    Write a random genome as a single FASTA file and as one FASTA file per chromosome (the CRISPRitz layout)
+    Args:
+        output_dir: directory of the genome files
+        chromosomes: number of chromosomes
+        chromosome_length: length of every chromosome
+        seed: the random seed
+
+    Returns: path of the complete genome file
+    """
+    rng = np.random.RandomState(seed)
+    chromosomes_dir = os.path.join(output_dir, "chroms")
+    os.makedirs(chromosomes_dir, exist_ok=True)
+    genome_path = os.path.join(output_dir, "genome.fa")
+    with open(genome_path, "w") as genome_file:
+        for chromosome in get_chromosomes(chromosomes):
+            sequence = "".join(NUCLEOTIDES[rng.randint(0, 4, chromosome_length)])
+            lines = "\n".join(sequence[i:i + 60] for i in range(0, len(sequence), 60))
+            genome_file.write(">chr{}\n{}\n".format(chromosome, lines))
+            with open(os.path.join(chromosomes_dir, "chr{}.fa".format(chromosome)), "w") as chromosome_file:
+                chromosome_file.write(">chr{}\n{}\n".format(chromosome, lines))
+    return genome_path
+
+
+def generate_genes(genes=2000, chromosomes=3, chromosome_length=5000000, seed=0):
+    """
+    Returns: dataframe of random genes, sorted by position, with chromosome, start, end, strand, gene_ensembl_id,
+    gene_symbol and gene_type
+    """
+    rng = np.random.RandomState(seed)
+    chromosome_names = get_chromosomes(chromosomes)
+    lengths = rng.randint(1000, 50000, genes)
+    genes_df = pd.DataFrame({
+        "chromosome": np.array(chromosome_names)[rng.randint(0, chromosomes, genes)],
+        "start": rng.randint(1, chromosome_length - 50000, genes),
+        "strand": np.where(rng.rand(genes) < 0.5, "+", "-"),
+        "gene_ensembl_id": ["ENSG{:011d}".format(i + 1) for i in range(genes)],
+        "gene_symbol": ["GENE{}".format(i + 1) for i in range(genes)],
+        "gene_type": rng.choice(GENE_TYPES, genes, p=GENE_TYPE_WEIGHTS)})
+    genes_df["end"] = genes_df["start"] + lengths
+    return sort_by_position(genes_df)
+
+
+def sort_by_position(df, chromosome_column="chromosome", start_column="start"):
+    return df.sort_values([chromosome_column, start_column], kind="mergesort").reset_index(drop=True)
+
+
+def write_bed(df, file_path):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    df.to_csv(file_path, sep="\t", header=False, index=False)
+
+
+def write_table(df, file_path, sep="\t"):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    df.to_csv(file_path, sep=sep, index=False)
+
+
+def generate_gencode(genes_df, file_path, rng):
+    """
+    GFF3 with a gene, a transcript, exons and for protein coding genes CDS and UTR segments for every gene
+    """
+    rows = []
+    for gene in genes_df.itertuples():
+        gene_number = gene.Index + 1
+        gene_attributes = "gene_id={}.1;gene_type={};gene_name={}".format(gene.gene_ensembl_id, gene.gene_type,
+                                                                          gene.gene_symbol)
+        rows.append([gene.chromosome, "HAVANA", "gene", gene.start, gene.end, ".", gene.strand, ".",
+                     "ID={}.1;{}".format(gene.gene_ensembl_id, gene_attributes)])
+        transcript_id = "ENST{:011d}.1".format(gene_number)
+        transcript_attributes = "{};transcript_id={};transcript_type={};transcript_name={}-201".format(
+            gene_attributes, transcript_id, gene.gene_type, gene.gene_symbol)
+        rows.append([gene.chromosome, "HAVANA", "transcript", gene.start, gene.end, ".", gene.strand, ".",
+                     "ID={};Parent={}.1;{}".format(transcript_id, gene.gene_ensembl_id, transcript_attributes)])
+        exons = rng.randint(2, 5)
+        exon_length = (gene.end - gene.start) // (exons * 2)
+        for exon_number in range(1, exons + 1):
+            exon_start = gene.start + (exon_number - 1) * 2 * exon_length
+            exon_end = exon_start + exon_length
+            exon_id = "ENSE{:011d}.1".format(gene_number * 10 + exon_number)
+            exon_attributes = "{};exon_number={};exon_id={}".format(transcript_attributes, exon_number, exon_id)
+            rows.append([gene.chromosome, "HAVANA", "exon", exon_start, exon_end, ".", gene.strand, ".",
+                         "ID=exon:{}:{};Parent={};{}".format(transcript_id, exon_number, transcript_id,
+                                                             exon_attributes)])
+            if gene.gene_type == "protein_coding":
+                segment = "five_prime_UTR" if exon_number == 1 else "CDS"
+                rows.append([gene.chromosome, "HAVANA", segment, exon_start, exon_end, ".", gene.strand,
+                             "0" if segment == "CDS" else ".",
+                             "ID={}:{}:{};Parent={};{};protein_id=ENSP{:011d}.1".format(
+                                 segment, transcript_id, exon_number, transcript_id, exon_attributes, gene_number)])
+    gencode_df = pd.DataFrame(rows)
+    write_bed(sort_by_position(gencode_df, 0, 3), file_path)
+
+
+def generate_mirgene(genes_df, file_path, rng):
+    mir_genes = genes_df.sample(frac=0.1, random_state=rng)
+    mirgene_df = pd.DataFrame({
+        "chromosome": mir_genes["chromosome"],
+        "start": mir_genes["start"],
+        "end": mir_genes["start"] + rng.randint(60, 120, len(mir_genes.index)),
+        "name": ["hsa-mir-{}-{}".format(i % 500 + 1, "5p" if i % 2 else "3p") for i in range(len(mir_genes.index))],
+        "score": 0,
+        "strand": mir_genes["strand"]})
+    write_bed(sort_by_position(mirgene_df), file_path)
+
+
+def generate_regulatory_regions(genes_df, rng, fraction):
+    """
+    Returns: random regions upstream of a fraction of the genes, with the gene of each region
+    """
+    regulated_genes = genes_df.sample(frac=fraction, random_state=rng)
+    starts = np.maximum(1, regulated_genes["start"].to_numpy() - rng.randint(100, 5000, len(regulated_genes.index)))
+    regions_df = regulated_genes.copy()
+    regions_df["start"] = starts
+    regions_df["end"] = starts + rng.randint(200, 2000, len(regulated_genes.index))
+    return regions_df
+
+
+def generate_remap_epd(genes_df, file_path, rng):
+    regions_df = generate_regulatory_regions(genes_df, rng, 0.5)
+    remap_epd_df = pd.DataFrame({
+        "chromosome": regions_df["chromosome"],
+        "start": regions_df["start"],
+        "end": regions_df["end"],
+        "attributes": ["gene_ensembl_id={};epd_gene_symbol={}_1;remap=TF{},TF{};epd_coding={}".format(
+            gene_id, symbol, i % 50, i % 70, "coding" if gene_type == "protein_coding" else "non_coding")
+            for i, (gene_id, symbol, gene_type) in enumerate(zip(regions_df["gene_ensembl_id"],
+                                                                 regions_df["gene_symbol"],
+                                                                 regions_df["gene_type"]))],
+        "score": 0,
+        "strand": regions_df["strand"]})
+    write_bed(sort_by_position(remap_epd_df), file_path)
+
+
+def generate_enhancer_atlas(genes_df, file_path, rng):
+    regions_df = generate_regulatory_regions(genes_df, rng, 0.3)
+    names = []
+    for i, gene in enumerate(regions_df.itertuples()):
+        # Some enhancers regulate two genes
+        linked_genes = [gene] if i % 3 else [gene, genes_df.iloc[(gene.Index + 1) % len(genes_df.index)]]
+        names.append("[{}]".format(", ".join("'{}${}${}${}${}${:.3f}$tissue{}'".format(
+            linked.gene_ensembl_id, linked.gene_symbol, linked.chromosome, linked.start, linked.strand,
+            1 + (i % 100) / 100, i % 10) for linked in linked_genes)))
+    enhancer_atlas_df = pd.DataFrame({"chromosome": regions_df["chromosome"], "start": regions_df["start"],
+                                      "end": regions_df["end"], "name": names})
+    write_bed(sort_by_position(enhancer_atlas_df), file_path)
+
+
+def generate_pfam(genes_df, file_path, rng):
+    coding_genes = genes_df.loc[genes_df["gene_type"] == "protein_coding"]
+    starts = coding_genes["start"].to_numpy() + rng.randint(0, 500, len(coding_genes.index))
+    pfam_df = pd.DataFrame({
+        "chromosome": coding_genes["chromosome"],
+        "start": starts,
+        "end": starts + rng.randint(100, 600, len(coding_genes.index)),
+        "attributes": ["gene_ensembl_id={};gene_symbol={};pfam_domain_name=PF{:05d}_domain".format(
+            gene_id, symbol, i % 3000) for i, (gene_id, symbol) in
+            enumerate(zip(coding_genes["gene_ensembl_id"], coding_genes["gene_symbol"]))]})
+    write_bed(sort_by_position(pfam_df), file_path)
+
+
+def generate_targetscan(genes_df, file_path, rng):
+    target_genes = genes_df.sample(frac=0.4, random_state=rng)
+    starts = target_genes["end"].to_numpy() - rng.randint(100, 900, len(target_genes.index))
+    targetscan_df = pd.DataFrame({
+        "chromosome": target_genes["chromosome"],
+        "start": starts,
+        "end": starts + 8,
+        "name": ["{}:hsa-miR-{}-5p:{}".format(symbol, i % 400 + 1, gene_id) for i, (symbol, gene_id) in
+                 enumerate(zip(target_genes["gene_symbol"], target_genes["gene_ensembl_id"]))],
+        "score": 90,
+        "strand": target_genes["strand"]})
+    write_bed(sort_by_position(targetscan_df), file_path)
+
+
+def choose_or_na(rng, values, size, na_fraction):
+    chosen = rng.choice(values, size).astype(object)
+    chosen[rng.rand(size) < na_fraction] = np.nan
+    return chosen
+
+
+def generate_omim(genes_df, file_path, rng):
+    omim_genes = genes_df.sample(frac=0.3, random_state=rng)
+    size = len(omim_genes.index)
+    omim_df = pd.DataFrame({
+        "gene_ensembl_id": omim_genes["gene_ensembl_id"], "gene_symbol": omim_genes["gene_symbol"],
+        "omim_id": rng.randint(100000, 700000, size),
+        "disease_related": choose_or_na(rng, ["Syndrome {}".format(i) for i in range(200)], size, 0.3),
+        "inheritance_model": choose_or_na(rng, INHERITANCE_MODELS, size, 0.4)})
+    write_table(omim_df, file_path)
+
+
+def generate_humantf(genes_df, file_path, rng):
+    tf_genes = genes_df.sample(frac=0.1, random_state=rng)
+    size = len(tf_genes.index)
+    humantf_df = pd.DataFrame({"gene_symbol": tf_genes["gene_symbol"], "gene_ensembl_id": tf_genes["gene_ensembl_id"],
+                               "Family": rng.choice(["zf-C2H2", "Homeobox", "bHLH", "bZIP"], size),
+                               "HumanTF_source": rng.choice(["TF", "TF cofactors"], size)})
+    write_table(humantf_df, file_path)
+
+
+def generate_protein_atlas(genes_df, file_path, rng):
+    atlas_genes = genes_df.loc[genes_df["gene_type"] == "protein_coding"]
+    size = len(atlas_genes.index)
+    protein_atlas_df = pd.DataFrame({"gene_ensembl_id": atlas_genes["gene_ensembl_id"],
+                                     "gene_symbol": atlas_genes["gene_symbol"]})
+    for tissue in PROTEIN_ATLAS_TISSUES:
+        protein_atlas_df[tissue] = choose_or_na(rng, EXPRESSION_LEVELS, size, 0.1)
+    write_table(protein_atlas_df, file_path, sep=",")
+
+
+def generate_rbp(genes_df, file_path, rng):
+    rbp_genes = genes_df.sample(frac=0.05, random_state=rng)
+    size = len(rbp_genes.index)
+    rbp_df = pd.DataFrame({"gene_ensembl_id": rbp_genes["gene_ensembl_id"], "gene_symbol": rbp_genes["gene_symbol"]})
+    for category in RBP_CATEGORIES:
+        rbp_df[category] = (rng.rand(size) < 0.2).astype(int)
+    write_table(rbp_df, file_path)
+
+
+def generate_cosmic(genes_df, file_path, rng):
+    cosmic_genes = genes_df.sample(frac=0.05, random_state=rng)
+    size = len(cosmic_genes.index)
+    cosmic_df = pd.DataFrame({
+        "gene_ensembl_id": cosmic_genes["gene_ensembl_id"], "gene_symbol": cosmic_genes["gene_symbol"],
+        "Name": ["{} protein".format(symbol) for symbol in cosmic_genes["gene_symbol"]],
+        "Somatic": rng.choice(["yes", "no"], size), "Germline": rng.choice(["yes", "no"], size),
+        "Tumour Types(Somatic)": choose_or_na(rng, ["AML", "breast", "NSCLC", "melanoma"], size, 0.2),
+        "Tumour Types(Germline)": choose_or_na(rng, ["breast", "ovarian", "colorectal"], size, 0.6),
+        "Molecular Genetics": choose_or_na(rng, ["Dom", "Rec"], size, 0.3),
+        "Role in Cancer": choose_or_na(rng, CANCER_ROLES, size, 0.2)})
+    write_table(cosmic_df, file_path)
+
+
+DB_GENERATORS = {"gencode": generate_gencode, "mirgene": generate_mirgene, "remapepd": generate_remap_epd,
+                 "enhanceratlas": generate_enhancer_atlas, "pfam": generate_pfam, "targetscan": generate_targetscan,
+                 "omim": generate_omim, "humantf": generate_humantf, "protein_atlas": generate_protein_atlas,
+                 "rbp": generate_rbp, "cosmic": generate_cosmic}
+
+
+def generate_databases(output_dir, genes=2000, chromosomes=3, chromosome_length=5000000, seed=0):
+    """
+    Write all the databases under output_dir, in the relative paths of the configuration, so output_dir can be used
+    as the databases base path
+    Args:
+        output_dir: the databases base path
+        genes: number of genes. The size of every database is proportional to it
+        chromosomes: number of chromosomes
+        chromosome_length: length of every chromosome
+        seed: the random seed
+
+    Returns: the genes dataframe the databases were built from
+    """
+    genes_df = generate_genes(genes, chromosomes, chromosome_length, seed)
+    databases = get_config().databases
+    for db_name, generator in DB_GENERATORS.items():
+        # Every database has its own random stream, so changing one generator does not change the others
+        rng = np.random.RandomState(seed + sorted(DB_GENERATORS).index(db_name) + 1)
+        generator(genes_df, os.path.join(output_dir, databases.get_db(db_name).human.path), rng)
+    return genes_df
+
+
+def generate_off_targets(genes_df, rows, chromosomes=3, chromosome_length=5000000, seed=0, in_genes_fraction=0.6):
+    """
+    Random off-targets in the format of the off-target input file (see load_off_target_from_file). A fraction of
+    them is placed inside genes so the databases have results
+    Args:
+        genes_df: the genes from generate_genes
+        rows: number of off-targets
+        chromosomes: number of chromosomes
+        chromosome_length: length of every chromosome
+        seed: the random seed
+        in_genes_fraction: fraction of the off-targets placed inside genes
+
+    Returns: dataframe of the off-targets
+    """
+    rng = np.random.RandomState(seed + rows)
+    in_genes = rng.rand(rows) < in_genes_fraction
+    gene_index = rng.randint(0, len(genes_df.index), rows)
+    gene_starts = genes_df["start"].to_numpy()[gene_index]
+    gene_lengths = genes_df["end"].to_numpy()[gene_index] - gene_starts
+    starts = np.where(in_genes, gene_starts + (rng.rand(rows) * gene_lengths).astype(int),
+                      rng.randint(1, chromosome_length - 100, rows))
+    chromosome_names = np.array(get_chromosomes(chromosomes))
+    sequences = NUCLEOTIDES[rng.randint(0, 4, (rows, 23))]
+    on_target = "".join(NUCLEOTIDES[np.random.RandomState(seed).randint(0, 4, 23)])
+    return pd.DataFrame({
+        "chromosome": np.where(in_genes, genes_df["chromosome"].to_numpy()[gene_index],
+                               chromosome_names[rng.randint(0, chromosomes, rows)]),
+        "start": starts,
+        "end": starts + 23,
+        "strand": np.where(rng.rand(rows) < 0.5, "+", "-"),
+        "id": np.arange(rows),
+        "dna": sequences.view("<U23").ravel() if sequences.dtype == "<U1" else ["".join(s) for s in sequences],
+        "cr_rna": on_target})
+
+
+def get_off_targets_path(output_dir, rows):
+    return os.path.join(output_dir, OFF_TARGETS_DIR_NAME, "off_targets_{}.tsv".format(rows))
+
+
+def generate_fixtures(output_dir, off_target_sizes=(10, 1000), genes=2000, chromosomes=3, chromosome_length=5000000,
+                      seed=0, genome=True):
+    """
+    Write the genome, the databases and an off-target file for every size
+    Returns: dictionary of off-target set size to the path of its file
+    """
+    if genome:
+        generate_genome(os.path.join(output_dir, GENOME_DIR_NAME), chromosomes, chromosome_length, seed)
+    genes_df = generate_databases(os.path.join(output_dir, DATABASES_DIR_NAME), genes, chromosomes,
+                                  chromosome_length, seed)
+    off_target_paths = {}
+    for rows in off_target_sizes:
+        off_target_paths[rows] = get_off_targets_path(output_dir, rows)
+        write_table(generate_off_targets(genes_df, rows, chromosomes, chromosome_length, seed),
+                    off_target_paths[rows])
+    return off_target_paths
+
+
+def parse_arg(argv):
+    parser = argparse.ArgumentParser(description="Generate synthetic fixtures for the benchmarks")
+    parser.add_argument("-o", "--output", help="Output directory", required=True)
+    parser.add_argument("--off-targets", nargs="+", type=int, default=[10, 100, 1000, 10000],
+                        help="Sizes of the off-target sets")
+    parser.add_argument("--genes", type=int, default=2000, help="Number of genes in the databases")
+    parser.add_argument("--chromosomes", type=int, default=3, help="Number of chromosomes")
+    parser.add_argument("--chromosome-length", type=int, default=5000000, help="Length of every chromosome")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--no-genome", action="store_true", help="Do not write the genome FASTA files")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_arg(argv[1:])
+    off_target_paths = generate_fixtures(args.output, args.off_targets, args.genes, args.chromosomes,
+                                         args.chromosome_length, args.seed, not args.no_genome)
+    print("Fixtures were written to {}".format(args.output))
+    for rows, off_target_path in off_target_paths.items():
+        print("{} off-targets: {}".format(rows, off_target_path))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,119 @@
+"""
+Startup profile of the server and the CLI. Imports a module of the app with python -X importtime in a new process,
+reports the slowest imports and checks the total import time against a budget, and that the libraries that are
+imported lazily (see app/lazy_import.py) are not imported at startup. Importing main loads the databases when the
+warm-up is enabled, --config selects a configuration without it.
+
+Example:
+    python benchmarks/import_time.py --module main --budget 1.0 --top 15
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(BENCHMARKS_DIR)
+APP_DIR = os.path.join(BASE_DIR, "app")
+
+# Libraries that only rare paths use, and that should not be imported when the server or the CLI starts
+LAZY_MODULES = ["bs4", "requests", "validators", "wget", "gffutils"]
+DEFAULT_BUDGET_SECONDS = 1.0
+IMPORT_TIME_PATTERN = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def parse_import_time(output):
+    """
+    Returns: list of the imports in the -X importtime output, as dictionaries with the module name, its depth and its
+    own and cumulative import time in seconds
+    """
+    imports = []
+    for line in output.splitlines():
+        match = IMPORT_TIME_PATTERN.match(line)
+        if match:
+            imports.append({"module": match.group(4), "depth": (len(match.group(3)) - 1) // 2,
+                            "self_seconds": int(match.group(1)) / 1e6,
+                            "cumulative_seconds": int(match.group(2)) / 1e6})
+    return imports
+
+
+def profile_import(module, app_dir=APP_DIR, config_path=None):
+    """
+    Import a module in a new process
+    Args:
+        module: name of the module
+        app_dir: directory of the app
+        config_path: configuration file of the app. None will use the default one
+
+    Returns: the imports of the process (see parse_import_time)
+    """
+    code = "import {}".format(module)
+    if config_path:
+        code = "import app_config; app_config.update_config_path({!r}); {}".format(os.path.abspath(config_path), code)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=app_dir, capture_output=True,
+                            text=True)
+    if result.returncode != 0:
+        raise RuntimeError("Importing {} failed:\n{}".format(module, result.stderr[-2000:]))
+    return parse_import_time(result.stderr)
+
+
+def get_total_seconds(imports, module):
+    """
+    Returns: the import time of the module, without the modules the interpreter imports before it
+    """
+    return sum(item["cumulative_seconds"] for item in imports if item["depth"] == 0 and item["module"] == module)
+
+
+def get_startup_profile(module, runs=3, top=15, app_dir=APP_DIR, config_path=None):
+    """
+    Import the module several times and keep the fastest run, since the first run also fills the caches of the
+    file system and the bytecode
+    Returns: the import time of the module, the slowest imports and the lazy libraries that were imported
+    """
+    profiles = [profile_import(module, app_dir, config_path) for _ in range(runs)]
+    imports = min(profiles, key=lambda run: get_total_seconds(run, module))
+    imported = {item["module"].split(".")[0] for item in imports}
+    return {"module": module, "runs": runs, "total_seconds": round(get_total_seconds(imports, module), 4),
+            "slowest": sorted(imports, key=lambda item: item["cumulative_seconds"], reverse=True)[:top],
+            "slowest_self": sorted(imports, key=lambda item: item["self_seconds"], reverse=True)[:top],
+            "eager_lazy_modules": [name for name in LAZY_MODULES if name in imported]}
+
+
+def parse_arg(argv):
+    parser = argparse.ArgumentParser(description="Startup profile of the app modules")
+    parser.add_argument("--module", default="main", help="Module of the app to import: main for the server, "
+                                                         "off_risk for the CLI")
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET_SECONDS,
+                        help="Fail when the import takes longer, in seconds")
+    parser.add_argument("--runs", type=int, default=3, help="Imports to run. The fastest one is reported")
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest imports to report")
+    parser.add_argument("--config", help="Configuration file of the app, for example one with the warm-up disabled")
+    parser.add_argument("-o", "--output", help="Output JSON file")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_arg(argv[1:])
+    profile = get_startup_profile(args.module, args.runs, args.top, config_path=args.config)
+    print("import {}: {:.3f} seconds (budget {} seconds)".format(args.module, profile["total_seconds"],
+                                                                  args.budget), file=sys.stderr)
+    for item in profile["slowest"]:
+        print("{:>10.4f} {:>10.4f}  {}{}".format(item["cumulative_seconds"], item["self_seconds"],
+                                                 "  " * item["depth"], item["module"]), file=sys.stderr)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(profile, output_file, indent=2)
+    failed = False
+    if profile["eager_lazy_modules"]:
+        print("Imported at startup: {}".format(", ".join(profile["eager_lazy_modules"])), file=sys.stderr)
+        failed = True
+    if profile["total_seconds"] > args.budget:
+        print("The import takes longer than the budget", file=sys.stderr)
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
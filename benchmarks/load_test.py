@@ -0,0 +1,182 @@
+"""
+Load generator for a running server. Sends analysis requests to /v1/on-target-analyze/ and /v1/off-target-analyze/
+from concurrent clients and reports the latency percentiles and the throughput of every endpoint as JSON.
+
+With the stand-in tools in benchmarks/fake_tools and the fixtures from fixtures.py the server can be load tested
+without the real search tools and genome (see benchmarks/README.md).
+
+Example:
+    python benchmarks/load_test.py --server http://localhost:8123 --concurrency 8 --requests 100 \
+        --off-targets-file /tmp/off-risk-bench/off_targets/off_targets_1000.tsv -o load.json
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import requests
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(BENCHMARKS_DIR)
+TEMPLATES_DIR = os.path.join(BASE_DIR, "tests", "templates")
+
+ENDPOINTS = {"on": "/v1/on-target-analyze/", "off": "/v1/off-target-analyze/"}
+# FlashFry only searches 20 nt guides, so the on-target templates of the tests can not be used with it
+DEFAULT_ON_TARGET_BODY = {"request_id": 0, "pam": "NGG", "downstream": True,
+                          "sites": [{"sequence": "CTTAAGAATACGCGTAGTCG", "mismatch": 4},
+                                    {"sequence": "ATGTCTGGTAAGACGCCCAT", "mismatch": 4}],
+                          "search_tools": ["flashfry", "cas_offinder", "crispritz"]}
+PERCENTILES = [50, 95, 99]
+
+_sessions = threading.local()
+
+
+def load_json(file_path):
+    with open(file_path) as json_file:
+        return json.load(json_file)
+
+
+def load_off_targets(file_path):
+    """
+    Returns: the off-targets of an off-target input file (see load_off_target_from_file) as request off-targets
+    """
+    off_target_df = pd.read_csv(file_path, sep="\t")
+    off_target_df = off_target_df.rename(columns={"dna": "sequence"})
+    return off_target_df[["chromosome", "start", "end", "strand", "id", "sequence"]].astype(
+        {"chromosome": str}).to_dict(orient="records")
+
+
+def build_bodies(args):
+    """
+    Returns: dictionary of endpoint name to the template of its request body
+    """
+    bodies = {"on": load_json(args.on_target_body) if args.on_target_body else dict(DEFAULT_ON_TARGET_BODY),
+              "off": load_json(args.off_target_body)}
+    if args.off_targets_file:
+        bodies["off"]["off_targets"] = load_off_targets(args.off_targets_file)
+    if args.search_tools:
+        bodies["on"]["search_tools"] = args.search_tools
+    for body in bodies.values():
+        if args.dbs:
+            body["db_list"] = args.dbs
+        if args.include:
+            body["include"] = args.include
+    return bodies
+
+
+def get_session():
+    # requests sessions are not thread safe, every client thread keeps its own connection
+    if not hasattr(_sessions, "session"):
+        _sessions.session = requests.Session()
+    return _sessions.session
+
+
+def send_request(server, endpoint, body, request_id, timeout):
+    """
+    Returns: dictionary with the endpoint, the status code (None if the request failed), the latency in seconds and
+    the error if there is one
+    """
+    body = dict(body, request_id=request_id)
+    time_start = time.perf_counter()
+    try:
+        response = get_session().post("{}{}".format(server.rstrip("/"), ENDPOINTS[endpoint]), json=body,
+                                      timeout=timeout)
+        return {"endpoint": endpoint, "status": response.status_code, "seconds": time.perf_counter() - time_start,
+                "error": None}
+    except requests.RequestException as e:
+        return {"endpoint": endpoint, "status": None, "seconds": time.perf_counter() - time_start, "error": str(e)}
+
+
+def summarize(results, elapsed):
+    """
+    Returns: the request count, status codes, errors, latency percentiles and throughput of the results
+    """
+    latencies = np.array([result["seconds"] for result in results])
+    statuses = {}
+    for result in results:
+        status = str(result["status"]) if result["status"] is not None else "error"
+        statuses[status] = statuses.get(status, 0) + 1
+    summary = {"requests": len(results), "ok": statuses.get("200", 0), "statuses": statuses,
+               "errors": sorted({result["error"] for result in results if result["error"]})[:10],
+               "throughput_rps": round(len(results) / elapsed, 3) if elapsed else None}
+    if len(latencies):
+        summary["latency_seconds"] = dict(
+            {"mean": round(float(latencies.mean()), 4), "min": round(float(latencies.min()), 4),
+             "max": round(float(latencies.max()), 4)},
+            **{"p{}".format(p): round(float(np.percentile(latencies, p)), 4) for p in PERCENTILES})
+    return summary
+
+
+def run_load(args):
+    bodies = build_bodies(args)
+    request_id_base = int(time.time()) % 100000 * 10000
+    # The endpoints are interleaved, so they are loaded at the same time
+    schedule = [endpoint for _ in range(args.requests) for endpoint in args.endpoints]
+    warm_up = [endpoint for _ in range(args.warm_up) for endpoint in args.endpoints]
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(lambda item: send_request(args.server, item[1], bodies[item[1]], request_id_base + item[0],
+                                                    args.timeout), enumerate(warm_up)))
+        time_start = time.perf_counter()
+        results = list(executor.map(
+            lambda item: send_request(args.server, item[1], bodies[item[1]],
+                                      request_id_base + len(warm_up) + item[0], args.timeout),
+            enumerate(schedule)))
+        elapsed = time.perf_counter() - time_start
+
+    endpoints = {endpoint: summarize([result for result in results if result["endpoint"] == endpoint], elapsed)
+                 for endpoint in args.endpoints}
+    return {"meta": {"date": datetime.now().isoformat(timespec="seconds"), "server": args.server,
+                     "concurrency": args.concurrency, "requests_per_endpoint": args.requests,
+                     "warm_up_per_endpoint": args.warm_up, "elapsed_seconds": round(elapsed, 3),
+                     "off_targets": len(bodies["off"].get("off_targets", [])),
+                     "search_tools": bodies["on"].get("search_tools")},
+            "endpoints": {ENDPOINTS[endpoint]: summary for endpoint, summary in endpoints.items()},
+            "all": summarize(results, elapsed)}
+
+
+def parse_arg(argv):
+    parser = argparse.ArgumentParser(description="Load test the analysis endpoints of a running server")
+    parser.add_argument("--server", default="http://localhost:8123", help="Server address")
+    parser.add_argument("--endpoints", nargs="+", choices=sorted(ENDPOINTS), default=["on", "off"],
+                        help="Endpoints to load: on for on-target analysis, off for off-target analysis")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="Concurrent clients")
+    parser.add_argument("-n", "--requests", type=int, default=20, help="Measured requests of every endpoint")
+    parser.add_argument("--warm-up", type=int, default=1, help="Requests of every endpoint before measuring")
+    parser.add_argument("--on-target-body", help="JSON body of the on-target requests. By default two guides are "
+                                                 "searched with all the search tools")
+    parser.add_argument("--off-target-body", default=os.path.join(TEMPLATES_DIR, "off_target_body_1.json"),
+                        help="JSON body of the off-target requests")
+    parser.add_argument("--off-targets-file", help="Off-target input file (for example from fixtures.py) that "
+                                                   "replaces the off-targets of the off-target body")
+    parser.add_argument("--search-tools", nargs="+", help="Search tools of the on-target requests")
+    parser.add_argument("--dbs", nargs="+", help="Databases to analyze")
+    parser.add_argument("--include", nargs="+", help="Result tables to return")
+    parser.add_argument("--timeout", type=float, default=600, help="Timeout of every request in seconds")
+    parser.add_argument("-o", "--output", help="Output JSON file. The results are printed if not given")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_arg(argv[1:])
+    load_results = run_load(args)
+    for endpoint, summary in load_results["endpoints"].items():
+        latency = summary.get("latency_seconds", {})
+        print("{}: {} requests, {} ok, p50 {}s, p95 {}s, p99 {}s, {} requests per second".format(
+            endpoint, summary["requests"], summary["ok"], latency.get("p50"), latency.get("p95"), latency.get("p99"),
+            summary["throughput_rps"]), file=sys.stderr)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(load_results, output_file, indent=2)
+    else:
+        print(json.dumps(load_results, indent=2))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,390 @@
+"""
+Microbenchmarks of the search tool output parsers, the off-target loaders, the join of the database information and
+the risk score, on synthetic inputs of 1k, 100k and 1M off-targets, and a regression gate that compares a run to the
+baseline in benchmarks/baseline.json.
+
+Example:
+    python benchmarks/microbenchmarks.py run -o current.json
+    python benchmarks/microbenchmarks.py compare benchmarks/baseline.json current.json --threshold 0.25
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import warnings
+from datetime import datetime
+from statistics import median
+from time import perf_counter
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(BENCHMARKS_DIR)
+APP_DIR = os.path.join(BASE_DIR, "app")
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from fixtures import generate_genes, generate_off_targets  # noqa: E402
+
+BASELINE_PATH = os.path.join(BENCHMARKS_DIR, "baseline.json")
+DEFAULT_SIZES = [1000, 100000, 1000000]
+# Off-targets of every FlashFry target, so the larger sizes have more targets and not only longer lists
+FLASHFRY_OFF_TARGETS_PER_TARGET = 1000
+PAM = "NGG"
+PAMS = ["AGG", "CGG", "GGG", "TGG"]
+SITE = "CTTAAGAATACGCGTAGTCG"
+
+NUCLEOTIDES = np.array(list("ACGT"))
+# Database information tables joined to the off-targets, and the fraction of the off-targets in every table
+INFORMATION_TABLES = 20
+INFORMATION_FRACTION = 0.3
+INFORMATION_VALUES = np.array(["ENSG00000141510", "ENSG00000012048", "", "ENSG00000139618"], dtype=object)
+# Genes of the gene risk table of the risk score benchmark
+RISK_GENES = 20000
+
+
+def random_sequences(rng, rows, length):
+    """
+    Returns: array of rows random nucleotide sequences
+    """
+    return NUCLEOTIDES[rng.randint(0, 4, (rows, length))].view("<U{}".format(length)).ravel()
+
+
+def random_positions(rng, rows):
+    """
+    Returns: chromosome (with the "chr" prefix like the tool outputs), position and strand arrays
+    """
+    return (np.char.add("chr", rng.randint(1, 23, rows).astype(str)), rng.randint(1, 100000000, rows),
+            np.where(rng.rand(rows) < 0.5, "+", "-"))
+
+
+def make_flashfry_outputs(rows, seed=0):
+    """
+    Returns: FlashFry discover and score outputs with rows off-targets in total
+    """
+    rng = np.random.RandomState(seed)
+    targets = max(1, rows // FLASHFRY_OFF_TARGETS_PER_TARGET)
+    sequences = np.char.add(random_sequences(rng, rows, 20), np.array(PAMS)[rng.randint(0, 4, rows)])
+    chromosomes, positions, strands = random_positions(rng, rows)
+    mismatches = rng.randint(1, 5, rows)
+    off_targets = ["{}_1_{}<{}:{}^{}>".format(sequence, mismatch, chromosome, position, "F" if strand == "+" else "R")
+                   for sequence, mismatch, chromosome, position, strand in
+                   zip(sequences, mismatches, chromosomes, positions, strands)]
+    target_sequences = np.char.add(random_sequences(rng, targets, 20), "AGG")
+    bounds = np.linspace(0, rows, targets + 1).astype(int)
+    discover = pd.DataFrame({"contig": ["sequence_{}".format(i) for i in range(targets)], "start": 0, "stop": 23,
+                             "target": target_sequences, "context": target_sequences, "overflow": "OK",
+                             "orientation": "FWD", "otCount": np.diff(bounds)})
+    score = discover.copy()
+    discover["offTargets"] = [",".join(off_targets[bounds[i]:bounds[i + 1]]) for i in range(targets)]
+    score["Doench2014OnTarget"] = rng.rand(targets).round(4)
+    score["DoenchCFD_specificityscore"] = rng.rand(targets).round(4)
+    score["Hsu2013"] = (rng.rand(targets) * 100).round(4)
+    return discover, score
+
+
+def make_cas_offinder_output(rows, seed=0):
+    rng = np.random.RandomState(seed)
+    chromosomes, positions, strands = random_positions(rng, rows)
+    return pd.DataFrame({"#Bulge type": "X", "crRNA": SITE + "NNN",
+                         "DNA": np.char.add(random_sequences(rng, rows, 20), np.array(PAMS)[rng.randint(0, 4, rows)]),
+                         "Chromosome": chromosomes, "Position": positions, "Direction": strands,
+                         "Mismatches": rng.randint(0, 5, rows), "Bulge Size": 0})
+
+
+def make_crispritz_targets(rows, seed=0):
+    """
+    Returns: CRISPRitz targets of the N padded search sequences of SITE with an RNA bulge of 1, and the RNA bulges
+    dictionary of the search (see _run_crispritz_search)
+    """
+    rng = np.random.RandomState(seed)
+    rna_bulges = {}
+    for i in range(1, len(SITE) - 1):
+        rna_bulges.setdefault("N" + SITE[:i] + SITE[i + 1:] + "N" * len(PAM), set()).add((i, SITE[i:i + 1]))
+    queries = np.array(["N" + SITE + "N" * len(PAM)] + list(rna_bulges))
+    cr_rnas = queries[rng.randint(0, len(queries), rows)]
+    chromosomes, positions, strands = random_positions(rng, rows)
+    mismatches = rng.randint(0, 5, rows)
+    return pd.DataFrame({"#Bulge_type": "X", "crRNA": cr_rnas,
+                         "DNA": np.char.add(random_sequences(rng, rows, len(SITE) + 1),
+                                            np.array(PAMS)[rng.randint(0, 4, rows)]),
+                         "Chromosome": chromosomes, "Position": positions, "Cluster Position": positions,
+                         "Direction": strands, "Mismatches": mismatches, "Bulge_Size": 0,
+                         "Total": mismatches}), rna_bulges
+
+
+def make_crispritz_output(rows, seed=0):
+    """
+    Returns: CRISPRitz output after the post processing, the input of load_crispritz_off_target
+    """
+    rng = np.random.RandomState(seed)
+    chromosomes, positions, strands = random_positions(rng, rows)
+    mismatches = rng.randint(0, 5, rows)
+    return pd.DataFrame({"#Bulge_type": "X", "crRNA": SITE + PAM,
+                         "DNA": np.char.add(random_sequences(rng, rows, 20), np.array(PAMS)[rng.randint(0, 4, rows)]),
+                         "Chromosome": chromosomes, "Position": positions, "Cluster Position": positions,
+                         "Direction": strands, "Mismatches": mismatches, "Bulge_Size": 0, "Total": mismatches})
+
+
+def make_off_target_file(rows, seed=0):
+    """
+    Returns: path of an off-target input file. The caller removes it
+    """
+    genes_df = generate_genes(200, seed=seed)
+    fd, file_path = tempfile.mkstemp(prefix="off_risk_microbenchmark_", suffix=".tsv")
+    os.close(fd)
+    generate_off_targets(genes_df, rows, seed=seed).to_csv(file_path, sep="\t", index=False)
+    return file_path
+
+
+def make_off_target_records(rows, seed=0):
+    """
+    Returns: the off-targets of a JSON request to the off-target analysis
+    """
+    off_target_df = generate_off_targets(generate_genes(200, seed=seed), rows, seed=seed)
+    off_target_df = off_target_df.drop(columns=["cr_rna"]).rename(columns={"dna": "sequence"})
+    return json.loads(off_target_df.to_json(orient="records"))
+
+
+def make_off_target_information(rows, seed=0):
+    """
+    Returns: off-target table and the information tables of the databases, grouped by off_target_id into lists with
+    empty and missing values, like the process_result of the databases
+    """
+    rng = np.random.RandomState(seed)
+    values = np.append(INFORMATION_VALUES, np.nan)
+    tables = []
+    for i in range(INFORMATION_TABLES):
+        off_target_ids = np.flatnonzero(rng.rand(rows) < INFORMATION_FRACTION)
+        value_index = rng.randint(0, len(values), (len(off_target_ids), 2))
+        tables.append(pd.DataFrame({"column_{}".format(i): [list(set(values[pair])) for pair in value_index]},
+                                   index=pd.Index(off_target_ids, name="off_target_id")))
+    return {"off_target_df": pd.DataFrame({"off_target_id": np.arange(rows)}), "tables": tables}
+
+
+def join_off_target_information(off_target_df, tables):
+    from db import OffTargetInformation
+
+    off_target_information = OffTargetInformation()
+    for table in tables:
+        off_target_information.add(table, list(table.columns))
+    return off_target_information.join(off_target_df)
+
+
+def make_risk_hits(rows, seed=0):
+    """
+    Returns: off-target table, its GENCODE, ReMap EPD and Enhancer Atlas hits and the gene risk table of the genes,
+    with OMIM and COSMIC rows for part of them
+    """
+    from gene_risk import GeneRiskTable
+
+    rng = np.random.RandomState(seed)
+    genes = np.array(["ENSG{:011d}".format(i) for i in range(RISK_GENES)], dtype=object)
+    omim_genes = genes[rng.rand(RISK_GENES) < 0.3]
+    cosmic_genes = genes[rng.rand(RISK_GENES) < 0.05]
+    omim_df = pd.DataFrame({"gene_ensembl_id": omim_genes,
+                            "disease_related": rng.choice(["Disease", "", np.nan], len(omim_genes)),
+                            "inheritance_model": rng.choice(["AD", "AR", np.nan], len(omim_genes))})
+    cosmic_df = pd.DataFrame({"gene_ensembl_id": cosmic_genes,
+                              "role_in_cancer": rng.choice(["TSG", "oncogene", np.nan], len(cosmic_genes))})
+
+    def make_hits(fraction, **columns):
+        off_target_ids = np.flatnonzero(rng.rand(rows) < fraction)
+        hits_df = pd.DataFrame({"off_target_id": off_target_ids,
+                                "gene_ensembl_id": rng.choice(genes, len(off_target_ids))})
+        for column, values in columns.items():
+            hits_df[column] = rng.choice(values, len(off_target_ids))
+        return SimpleNamespace(complete_result=hits_df)
+
+    return {"off_target_df": pd.DataFrame({"off_target_id": np.arange(rows)}),
+            "gene_risk_table": GeneRiskTable(omim_df, cosmic_df),
+            "gencode_db": make_hits(0.6, gene_type=["protein_coding", "lncRNA"],
+                                    segment=["exon", "transcript", "gene"]),
+            "remap_epd_db": make_hits(0.3), "enhancer_atlas_db": make_hits(0.3)}
+
+
+def calculate_risk_score(off_target_df, gene_risk_table, gencode_db, remap_epd_db, enhancer_atlas_db):
+    from db import calculate_score
+
+    # The OMIM and COSMIC dbs only tell which diseases to count
+    return calculate_score(off_target_df, gene_risk_table, gencode_db, enhancer_atlas_db, remap_epd_db,
+                           omim_db=True, cosmic_db=True)
+
+
+def get_benchmarks():
+    """
+    Returns: dictionary of benchmark name to a setup function, that receives the number of rows and returns the
+    arguments, and the benchmarked function
+    """
+    from off_target import load_cas_offinder_off_target, load_crispritz_off_target, load_flashfry_off_target, \
+        load_off_target_from_file, load_off_target_from_records, process_crispritz_output
+
+    return {
+        "load_flashfry_off_target": (
+            lambda rows: dict(zip(["flashfry_output", "flashfry_score"], make_flashfry_outputs(rows))),
+            load_flashfry_off_target),
+        "load_cas_offinder_off_target": (
+            lambda rows: {"cas_offinder_output": make_cas_offinder_output(rows)}, load_cas_offinder_off_target),
+        "load_crispritz_off_target": (
+            lambda rows: {"crispritz_output": make_crispritz_output(rows)}, load_crispritz_off_target),
+        "process_crispritz_output": (
+            lambda rows: dict(zip(["crispritz_output", "rna_bulges"], make_crispritz_targets(rows)), pam=PAM,
+                              pams=PAMS, downstream=True),
+            process_crispritz_output),
+        "load_off_target_from_file": (
+            lambda rows: {"input_file": make_off_target_file(rows)}, load_off_target_from_file),
+        "load_off_target_from_records": (
+            lambda rows: {"off_targets": make_off_target_records(rows)}, load_off_target_from_records),
+        "join_off_target_information": (make_off_target_information, join_off_target_information),
+        "calculate_score": (make_risk_hits, calculate_risk_score),
+    }
+
+
+def copy_arguments(kwargs):
+    # The parsers may change their input, so every repeat gets its own copy
+    return {key: value.copy() if isinstance(value, pd.DataFrame) else value for key, value in kwargs.items()}
+
+
+def run_benchmark(setup, function, rows, repeats):
+    """
+    Returns: the median, minimum and maximum run time in seconds of the function
+    """
+    kwargs = setup(rows)
+    seconds = []
+    try:
+        for _ in range(repeats):
+            repeat_kwargs = copy_arguments(kwargs)
+            time_start = perf_counter()
+            function(**repeat_kwargs)
+            seconds.append(perf_counter() - time_start)
+    finally:
+        if "input_file" in kwargs and os.path.exists(kwargs["input_file"]):
+            os.remove(kwargs["input_file"])
+    return {"seconds": round(median(seconds), 6), "min_seconds": round(min(seconds), 6),
+            "max_seconds": round(max(seconds), 6), "repeats": repeats}
+
+
+def get_git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(names, sizes, repeats, large_repeats, large_size):
+    """
+    Returns: the results of every benchmark and size, with the environment of the run
+    """
+    benchmarks = get_benchmarks()
+    results = {}
+    for name in names:
+        setup, function = benchmarks[name]
+        for rows in sizes:
+            result = run_benchmark(setup, function, rows, large_repeats if rows >= large_size else repeats)
+            result["rows_per_second"] = round(rows / result["seconds"], 1) if result["seconds"] else None
+            results["{}/{}".format(name, rows)] = result
+            print("{}/{}: {} seconds".format(name, rows, result["seconds"]), file=sys.stderr)
+    return {"meta": {"date": datetime.now().isoformat(timespec="seconds"), "git_revision": get_git_revision(),
+                     "host": socket.gethostname(), "platform": platform.platform(), "python": platform.python_version(),
+                     "pandas": pd.__version__, "numpy": np.__version__},
+            "benchmarks": results}
+
+
+def compare_results(baseline, current, threshold):
+    """
+    Args:
+        baseline: results of the baseline run
+        current: results of the current run
+        threshold: allowed slowdown as a fraction, for example 0.25 for 25%
+
+    Returns: list of (benchmark name, baseline seconds, current seconds, change) and the names of the regressions
+    """
+    rows = []
+    regressions = []
+    for name, current_result in current["benchmarks"].items():
+        baseline_result = baseline["benchmarks"].get(name)
+        if baseline_result is None:
+            rows.append((name, None, current_result["seconds"], None))
+            continue
+        change = current_result["seconds"] / baseline_result["seconds"] - 1 if baseline_result["seconds"] else 0.0
+        rows.append((name, baseline_result["seconds"], current_result["seconds"], change))
+        if change > threshold:
+            regressions.append(name)
+    return rows, regressions
+
+
+def load_json(file_path):
+    with open(file_path) as json_file:
+        return json.load(json_file)
+
+
+def write_json(data, file_path):
+    if file_path:
+        with open(file_path, "w") as output_file:
+            json.dump(data, output_file, indent=2)
+            output_file.write("\n")
+    else:
+        print(json.dumps(data, indent=2))
+
+
+def print_comparison(rows, regressions, threshold):
+    for name, baseline_seconds, current_seconds, change in rows:
+        print("{:<45} {:>12} {:>12} {:>9}{}".format(
+            name, "-" if baseline_seconds is None else "{:.4f}".format(baseline_seconds),
+            "{:.4f}".format(current_seconds), "new" if change is None else "{:+.1%}".format(change),
+            "  REGRESSION" if name in regressions else ""))
+    if regressions:
+        print("{} benchmarks are more than {:.0%} slower than the baseline".format(len(regressions), threshold))
+
+
+def parse_arg(argv):
+    parser = argparse.ArgumentParser(description="Microbenchmarks of the search tool output parsers")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the benchmarks")
+    run_parser.add_argument("--benchmarks", nargs="+", help="Benchmarks to run. All of them if not given")
+    run_parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES, help="Off-targets of the outputs")
+    run_parser.add_argument("--repeats", type=int, default=3, help="Runs of every benchmark")
+    run_parser.add_argument("--large-repeats", type=int, default=1, help="Runs of the sizes from --large-size")
+    run_parser.add_argument("--large-size", type=int, default=1000000, help="Smallest size with --large-repeats")
+    run_parser.add_argument("-o", "--output", help="Output JSON file. The results are printed if not given")
+    run_parser.add_argument("--compare", nargs="?", const=BASELINE_PATH,
+                            help="Compare to a baseline file, benchmarks/baseline.json by default")
+    run_parser.add_argument("--threshold", type=float, default=0.25, help="Allowed slowdown as a fraction")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare results to a baseline")
+    compare_parser.add_argument("baseline", help="Baseline results file")
+    compare_parser.add_argument("current", help="Current results file")
+    compare_parser.add_argument("--threshold", type=float, default=0.25, help="Allowed slowdown as a fraction")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_arg(argv[1:])
+    logging.basicConfig(level=logging.WARNING)
+    # The parsers assign to dataframe slices, the warnings would hide the results
+    warnings.simplefilter("ignore", pd.errors.SettingWithCopyWarning)
+    if args.command == "run":
+        names = args.benchmarks or list(get_benchmarks())
+        results = run_benchmarks(names, args.sizes, args.repeats, args.large_repeats, args.large_size)
+        write_json(results, args.output)
+        if not args.compare:
+            return 0
+        baseline, current = load_json(args.compare), results
+    else:
+        baseline, current = load_json(args.baseline), load_json(args.current)
+    rows, regressions = compare_results(baseline, current, args.threshold)
+    print_comparison(rows, regressions, args.threshold)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
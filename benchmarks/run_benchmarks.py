@@ -0,0 +1,157 @@
+"""
+Offline end-to-end benchmark of the off-target analysis. Runs extract_data on synthetic fixtures (see fixtures.py)
+at several scales and writes the median duration of every stage as JSON.
+
+Example:
+    python benchmarks/run_benchmarks.py --fixtures /tmp/off-risk-bench --off-targets 10 1000 100000 \
+        -o results.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from statistics import median
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(BENCHMARKS_DIR)
+APP_DIR = os.path.join(BASE_DIR, "app")
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from fixtures import DATABASES_DIR_NAME, generate_fixtures, get_off_targets_path  # noqa: E402
+
+RESULTS_FORMAT_VERSION = 1
+
+
+def get_git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_metadata(args):
+    """
+    Returns: the environment of the run, so results of different releases and machines can be told apart
+    """
+    return {"format_version": RESULTS_FORMAT_VERSION, "date": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": get_git_revision(), "host": socket.gethostname(), "platform": platform.platform(),
+            "cpu_count": os.cpu_count(), "python": platform.python_version(), "pandas": pd.__version__,
+            "numpy": np.__version__, "fixtures": os.path.abspath(args.fixtures), "databases": args.dbs,
+            "repeats": args.repeats, "warm_up_runs": args.warm_up}
+
+
+def run_once(off_targets_path, db_name_list, run_id):
+    """
+    Load the off-target file and run the analysis on it
+    Returns: dictionary of stage name to duration in seconds, including the load of the file and the total time
+    """
+    from job import Job
+    from off_risk import extract_data
+    from off_target import load_off_target_from_file
+
+    with Job("benchmark-{}".format(run_id), deadline=0) as job:
+        time_start = perf_counter()
+        load_start = perf_counter()
+        off_target_df = load_off_target_from_file(off_targets_path)
+        load_seconds = perf_counter() - load_start
+        extract_data(db_name_list, off_target_df=off_target_df, job=job)
+        total_seconds = perf_counter() - time_start
+        stages = job.timings.to_dict()
+    stages["load_off_targets"] = round(load_seconds, 6)
+    stages["total"] = round(total_seconds, 6)
+    return stages
+
+
+def summarize_runs(off_targets, runs):
+    """
+    Returns: the median of every stage over the runs and the throughput of the median run
+    """
+    stage_names = []
+    for stages in runs:
+        stage_names.extend(name for name in stages if name not in stage_names)
+    stages = {name: round(median(stages.get(name, 0.0) for stages in runs), 6) for name in stage_names}
+    total = stages.pop("total")
+    return {"off_targets": off_targets, "runs": len(runs), "total_seconds": total,
+            "min_total_seconds": min(run["total"] for run in runs),
+            "max_total_seconds": max(run["total"] for run in runs),
+            "off_targets_per_second": round(off_targets / total, 2) if total else None,
+            "stages": stages}
+
+
+def run_benchmarks(args):
+    from app_config import get_config
+    from db import update_database_base_path
+    from job import update_job_settings
+    from shared_tables import update_shared_tables_settings
+
+    from configuration_files.const import DB_NAME_LIST
+
+    if args.generate:
+        generate_fixtures(args.fixtures, args.off_targets, args.genes, seed=args.seed, genome=False)
+    update_database_base_path(os.path.join(args.fixtures, DATABASES_DIR_NAME))
+    # Every run loads the tables in this process, like a single worker
+    update_shared_tables_settings(enabled=False)
+    update_job_settings(directory=os.path.join(tempfile.gettempdir(), "off-risk-benchmark-jobs"))
+    db_name_list = DB_NAME_LIST if "all" in args.dbs else args.dbs
+    get_config()
+
+    results = []
+    for off_targets in args.off_targets:
+        off_targets_path = get_off_targets_path(args.fixtures, off_targets)
+        if not os.path.isfile(off_targets_path):
+            raise FileNotFoundError("No off-target set of size {} in {}. Run fixtures.py or use --generate".format(
+                off_targets, args.fixtures))
+        # The warm up runs load the tables and the bedtools files into the caches, as in a running server
+        for run in range(args.warm_up):
+            run_once(off_targets_path, db_name_list, "{}-warm-up-{}".format(off_targets, run))
+        runs = [run_once(off_targets_path, db_name_list, "{}-{}".format(off_targets, run))
+                for run in range(args.repeats)]
+        result = summarize_runs(off_targets, runs)
+        print("{} off-targets: {} seconds, {} off-targets per second".format(
+            off_targets, result["total_seconds"], result["off_targets_per_second"]), file=sys.stderr)
+        results.append(result)
+    return {"meta": get_metadata(args), "results": results}
+
+
+def parse_arg(argv):
+    parser = argparse.ArgumentParser(description="Offline benchmark of the off-target analysis")
+    parser.add_argument("--fixtures", help="Directory of the fixtures from fixtures.py", required=True)
+    parser.add_argument("--off-targets", nargs="+", type=int, default=[10, 100, 1000, 10000],
+                        help="Sizes of the off-target sets to run")
+    parser.add_argument("--dbs", nargs="+", default=["all"], help="Databases to analyze")
+    parser.add_argument("--repeats", type=int, default=3, help="Measured runs of every size")
+    parser.add_argument("--warm-up", type=int, default=1, help="Runs of every size before the measured runs")
+    parser.add_argument("--generate", action="store_true", help="Generate the fixtures before the run")
+    parser.add_argument("--genes", type=int, default=2000, help="Number of genes when generating the fixtures")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed when generating the fixtures")
+    parser.add_argument("-o", "--output", help="Output JSON file. The results are printed if not given")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show the log of the analysis")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_arg(argv[1:])
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    benchmark_results = run_benchmarks(args)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(benchmark_results, output_file, indent=2)
+    else:
+        print(json.dumps(benchmark_results, indent=2))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -1,5 +1,6 @@
 import httpx
 import pytest
+import gzip
 import json
 
 
@@ -26,7 +27,8 @@ def test_off_target(server, run_type, body, request):
     assert r.status_code == 200
     request_response = r.json()
     keys = list(request_response.keys())
-    assert keys == ['request_id', 'off_targets', 'flashfry_score', 'all_result', 'time']
+    assert keys == ['request_id', 'off_targets', 'flashfry_score', 'target_risk_results', 'all_result', 'time',
+                    'timings', 'memory']
 
 
 @pytest.mark.parametrize("dna_bulge, rna_bulge, run_type", [("0", "0", "cas-offinder-bulge"),
@@ -50,3 +52,65 @@ def test_flashfry(server, body, request):
     request_response = r.json()
     keys = list(request_response.keys())
     assert keys == ["flashfry-discover", "flashfry-score", "message"]
+
+
+@pytest.mark.parametrize("body", ["off_target_body_1"])
+def test_off_target_include(server, body, request):
+    off_target_body = dict(request.getfixturevalue(body))
+    off_target_body["include"] = ["off_targets", "db:GENCODE"]
+    r = httpx.post("{}/v1/off-target-analyze/".format(server), timeout=10000, json=off_target_body)
+    assert r.status_code == 200
+    request_response = r.json()
+    assert request_response["target_risk_results"] == []
+    assert request_response["flashfry_score"] == []
+    assert request_response["all_result"]["OMIM_result_list"] is None
+    assert "db:gencode:analyze" in request_response["timings"]
+
+
+def test_off_target_upload(server, off_target_body_1):
+    columns = ["chromosome", "start", "end", "strand", "id", "sequence"]
+    lines = ["\t".join(columns)] + ["\t".join(str(off_target[column]) for column in columns)
+                                   for off_target in off_target_body_1["off_targets"]]
+    r = httpx.post("{}/v1/off-target-analyze/upload/".format(server), timeout=10000,
+                   params={"request_id": off_target_body_1["request_id"], "db_list": "gencode",
+                           "on_target": off_target_body_1["on_target"]["sequence"]},
+                   content=gzip.compress("\n".join(lines).encode()),
+                   headers={"Content-Type": "application/octet-stream"})
+    assert r.status_code == 200
+    assert len(r.json()["off_targets"]) == len(off_target_body_1["off_targets"])
+
+    # A BED file with a track line
+    bed = "".join("{}\t{}\t{}\t{}\t.\t{}\n".format(*(off_target[column] for column in
+                                                        ["chromosome", "start", "end", "id", "strand"]))
+                  for off_target in off_target_body_1["off_targets"])
+    r = httpx.post("{}/v1/off-target-analyze/upload/".format(server), timeout=10000,
+                   params={"request_id": off_target_body_1["request_id"], "db_list": "gencode", "format": "bed",
+                           "on_target": off_target_body_1["on_target"]["sequence"]},
+                   files={"file": ("off_targets.bed", b"track name=x\n" + bed.encode())})
+    assert r.status_code == 200
+    assert len(r.json()["off_targets"]) == len(off_target_body_1["off_targets"])
+
+    r = httpx.post("{}/v1/off-target-analyze/upload/".format(server), params={"request_id": 1, "format": "bed"},
+                   files={"file": ("off_targets.bed", b"1\t200\t100\n")})
+    assert r.status_code == 400
+
+
+def test_off_target_invalid(server, off_target_body_1):
+    body = dict(off_target_body_1, db_list=["gencode"])
+    body["off_targets"] = [dict(off_target) for off_target in off_target_body_1["off_targets"]]
+    body["off_targets"][1]["end"] = body["off_targets"][1]["start"] - 1
+    r = httpx.post("{}/v1/off-target-analyze/".format(server), json=body)
+    assert r.status_code == 400
+    assert "End need to be larger then start (off_targets index 1)" in r.json()["text"]
+
+
+def test_delete_job_without_admin_token(server):
+    r = httpx.delete("{}/v1/jobs/{}".format(server, 987654321))
+    assert r.status_code == 403
+
+
+def test_metrics(server):
+    httpx.get(server)
+    r = httpx.get("{}/metrics".format(server))
+    assert r.status_code == 200
+    assert 'offrisk_requests_total{endpoint="/",method="GET",status="200"}' in r.text
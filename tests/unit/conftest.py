@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+APP_DIR = os.path.join(BASE_DIR, "app")
+
+# The app modules import each other by name, like when the server runs from the app directory
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+
+
+@pytest.fixture
+def state_dir(tmp_path, monkeypatch):
+    """
+    A temporary directory for the state files that the processes of the server share
+    """
+    import job
+    import shared_tables
+    import tool_pool
+
+    directory = str(tmp_path / "state")
+    monkeypatch.setattr(tool_pool, "state_dir", directory)
+    monkeypatch.setattr(shared_tables, "state_dir", directory)
+    monkeypatch.setattr(job, "jobs_dir", os.path.join(directory, "jobs"))
+    return directory
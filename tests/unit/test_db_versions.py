@@ -0,0 +1,128 @@
+import os
+
+import pytest
+
+import db
+import db_versions
+import gene_risk
+import shared_tables
+import table_store
+
+# Only table databases, so a build does not need bedtools
+DATABASES_CONF = {"omim": {"human": {"path": "OMIM/omim.tsv"}},
+                  "rbp": {"human": {"path": "RBP/rbp.tsv"}}}
+
+
+def write_databases(directory, genes):
+    os.makedirs(os.path.join(directory, "OMIM"), exist_ok=True)
+    os.makedirs(os.path.join(directory, "RBP"), exist_ok=True)
+    with open(os.path.join(directory, "OMIM", "omim.tsv"), "w") as omim_file:
+        omim_file.write("gene_ensembl_id\tdisease_related\tinheritance_model\n")
+        for gene in genes:
+            omim_file.write("{}\tdisease of {}\tAD\n".format(gene, gene))
+    with open(os.path.join(directory, "RBP", "rbp.tsv"), "w") as rbp_file:
+        rbp_file.write("gene_ensembl_id\n")
+        for gene in genes:
+            rbp_file.write("{}\n".format(gene))
+
+
+@pytest.fixture
+def base_path(tmp_path, monkeypatch):
+    path = tmp_path / "databases"
+    write_databases(str(path), ["ENSG01"])
+    monkeypatch.setattr(db, "database_base_path", str(path))
+    monkeypatch.setattr(db_versions, "_last_version_path", None)
+    monkeypatch.setattr(shared_tables, "shared_tables_enabled", False)
+    monkeypatch.setattr(table_store, "loaded_tables", {})
+    monkeypatch.setattr(gene_risk, "_gene_risk_tables", {})
+    os.makedirs(db_versions.get_versions_path())
+    return str(path)
+
+
+def build(version, source_path, activate=True):
+    # The status is written by start_build_version before the build thread starts
+    db_versions._set_status(version, db_versions.BUILDING)
+    db_versions.build_version(version, source_path, DATABASES_CONF, activate=activate)
+
+
+def test_build_and_activate(base_path, tmp_path):
+    source_path = str(tmp_path / "v1")
+    write_databases(source_path, ["ENSG01", "ENSG02"])
+    build("v1", source_path)
+
+    assert db_versions.get_version_status("v1") == db_versions.READY
+    current_link = os.path.join(base_path, db_versions.CURRENT_LINK_NAME)
+    assert os.readlink(current_link) == os.path.join(db_versions.VERSIONS_DIR_NAME, "v1")
+    assert db_versions.get_current_version() == "v1"
+    assert db_versions.read_manifest("v1")["databases"]["omim"]["source"] == os.path.join(source_path, "OMIM",
+                                                                                           "omim.tsv")
+    gene_risk_table = db.get_gene_risk_table(DATABASES_CONF, version_path=db_versions.get_current_version_path())
+    assert sorted(gene_risk_table.genes_df.index) == ["ENSG01", "ENSG02"]
+
+    # Only OMIM is new, RBP is taken from the current version
+    source_path = str(tmp_path / "v2")
+    write_databases(source_path, ["ENSG03"])
+    os.remove(os.path.join(source_path, "RBP", "rbp.tsv"))
+    build("v2", source_path)
+
+    assert os.readlink(current_link) == os.path.join(db_versions.VERSIONS_DIR_NAME, "v2")
+    assert db_versions.get_current_version() == "v2"
+    assert os.path.isdir(db_versions.get_version_path("v1"))
+    gene_risk_table = db.get_gene_risk_table(DATABASES_CONF, version_path=db_versions.get_current_version_path())
+    assert gene_risk_table.genes_df.loc["ENSG03", "omim_disease"]
+    assert list(gene_risk_table.genes_df.index[gene_risk_table.genes_df["rbp"]]) == ["ENSG01", "ENSG02"]
+
+
+def test_failed_build_removes_version(base_path, tmp_path, monkeypatch):
+    source_path = str(tmp_path / "v1")
+    write_databases(source_path, ["ENSG01"])
+    build("v1", source_path)
+
+    def fail_warm_up(*args, **kwargs):
+        raise RuntimeError("corrupt table")
+
+    monkeypatch.setattr(db_versions, "warm_up_databases", fail_warm_up)
+    build("v2", source_path)
+
+    assert db_versions.get_version_status("v2") == db_versions.FAILED
+    assert not os.path.exists(db_versions.get_version_path("v2"))
+    assert not os.path.exists(os.path.join(db_versions.get_versions_path(), ".v2.building"))
+    assert db_versions.get_current_version() == "v1"
+
+
+def test_activate_only_ready_versions(base_path, tmp_path):
+    source_path = str(tmp_path / "v1")
+    write_databases(source_path, ["ENSG01"])
+    build("v1", source_path, activate=False)
+    assert db_versions.get_current_version() is None
+
+    db_versions._set_status("v1", db_versions.FAILED, "test")
+    with pytest.raises(ValueError):
+        db_versions.activate_version("v1")
+    assert db_versions.get_current_version() is None
+
+    db_versions._set_status("v1", db_versions.READY)
+    db_versions.activate_version("v1")
+    assert db_versions.get_current_version() == "v1"
+
+
+def test_activate_outside_versions(base_path, tmp_path):
+    # A ready version outside the versions directory, whose status file is found through the "../x" name
+    source_path = str(tmp_path / "v1")
+    write_databases(source_path, ["ENSG01"])
+    build("v1", source_path, activate=False)
+    os.rename(db_versions.get_version_path("v1"), os.path.join(base_path, "x"))
+    os.makedirs(os.path.join(db_versions.get_versions_path(), "..."))
+    db_versions._set_status("../x", db_versions.READY)
+
+    with pytest.raises(ValueError):
+        db_versions.activate_version("../x")
+    assert db_versions.get_current_version() is None
+
+
+@pytest.mark.parametrize("version", ["../x", "..", "", "v1/../../x", ".hidden"])
+def test_version_name(base_path, tmp_path, version):
+    with pytest.raises(ValueError):
+        db_versions.activate_version(version)
+    with pytest.raises(ValueError):
+        db_versions.start_build_version(version, str(tmp_path), DATABASES_CONF)
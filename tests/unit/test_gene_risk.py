@@ -0,0 +1,87 @@
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+import gene_risk
+import shared_tables
+import table_store
+from db import COSMIC, OffTargetInformation, OmimDb, analyze_gene_hits, get_gene_hits
+from gene_risk import GeneRiskTable, load_gene_risk_table
+
+OMIM_COLUMNS = ["off_target_id", "gene_ensembl_id", "gene_symbol", "omim_id", "disease_related",
+                "inheritance_model"]
+COSMIC_COLUMNS = ["off_target_id", "gene_ensembl_id", "gene_symbol", "Role in Cancer"]
+
+OMIM_DF = pd.DataFrame({"gene_ensembl_id": ["ENSG01", "ENSG02", "ENSG01", "ENSG03"],
+                        "gene_symbol": ["G1", "G2", "G1", "G3"],
+                        "omim_id": [1, 2, 3, 4],
+                        "disease_related": ["disease_a", "disease_b", "disease_c", None],
+                        "inheritance_model": ["AD", "AR", "XL", None]})
+COSMIC_DF = pd.DataFrame({"gene_ensembl_id": ["ENSG02", "ENSG01"],
+                          "gene_symbol": ["G2", "G1"],
+                          "Role in Cancer": ["TSG", "oncogene"]})
+
+# ENSG01 is hit by off-targets 0 and 1, and ENSG02 by off-target 1 and by an enhancer of off-target 2
+GENCODE_HITS_DF = pd.DataFrame({"off_target_id": [0, 1, 1, 1], "gene_ensembl_id": ["ENSG01", "ENSG01", "ENSG02",
+                                                                                    "ENSG02"]})
+ENHANCER_ATLAS_HITS_DF = pd.DataFrame({"off_target_id": [2, 2], "gene_ensembl_id": ["ENSG02", ""]})
+
+
+@pytest.fixture
+def gene_tables(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared_tables, "shared_tables_enabled", False)
+    monkeypatch.setattr(table_store, "loaded_tables", {})
+    monkeypatch.setattr(gene_risk, "_gene_risk_tables", {})
+    omim_path = str(tmp_path / "omim.csv")
+    cosmic_path = str(tmp_path / "cosmic.csv")
+    OMIM_DF.to_csv(omim_path, sep="\t", index=False)
+    COSMIC_DF.to_csv(cosmic_path, sep="\t", index=False)
+    return {"omim": (omim_path, "\t"), "cosmic": (cosmic_path, "\t")}
+
+
+def get_hits():
+    return get_gene_hits(SimpleNamespace(complete_result=GENCODE_HITS_DF),
+                         SimpleNamespace(complete_result=ENHANCER_ATLAS_HITS_DF))
+
+
+def test_join_gene_hits():
+    gene_risk_table = GeneRiskTable(OMIM_DF, COSMIC_DF.rename(columns={"Role in Cancer": "role_in_cancer"}))
+    gene_hits_df = gene_risk_table.join_gene_hits(get_hits(), ["omim"])
+
+    assert gene_hits_df[["off_target_id", "gene_ensembl_id", "hit_source", "row"]].values.tolist() == [
+        [2, "ENSG02", "enhancer_atlas", 1],
+        [0, "ENSG01", "gencode", 0],
+        [1, "ENSG01", "gencode", 0],
+        [1, "ENSG02", "gencode", 1],
+        [0, "ENSG01", "gencode", 2],
+        [1, "ENSG01", "gencode", 2]]
+    assert set(gene_hits_df["db_name"]) == {"omim"}
+    assert len(gene_risk_table.join_gene_hits(get_hits()).index) == 10
+
+
+def test_gene_hit_of_several_off_targets(gene_tables):
+    gene_risk_table = load_gene_risk_table(gene_tables)
+    gene_hits_df = gene_risk_table.join_gene_hits(get_hits(), ["omim", "cosmic"])
+    off_target_information = OffTargetInformation()
+    omim_db = OmimDb(gene_tables["omim"][0], OMIM_COLUMNS)
+    cosmic_db = COSMIC(gene_tables["cosmic"][0], COSMIC_COLUMNS)
+    for current_db, db_name in [(omim_db, "omim"), (cosmic_db, "cosmic")]:
+        for hit_source in ["gencode", "enhancer_atlas", "remap_epd"]:
+            analyze_gene_hits(current_db, gene_hits_df, db_name, hit_source)
+        current_db.process_result(off_target_information)
+
+    # Every off-target of a gene has a row of it in the complete result
+    assert omim_db.complete_result[["off_target_id", "omim_id"]].values.tolist() == [[0, 1], [1, 1], [1, 2], [0, 3],
+                                                                                    [1, 3]]
+    assert len(omim_db.remap_epd.index) == 0
+
+    result_df = off_target_information.join(pd.DataFrame({"off_target_id": [0, 1, 2, 3]})).set_index("off_target_id")
+    columns = ["disease_related", "inheritance_model", "enhancer_atlas_disease_related", "cancer_related",
+               "enhancer_atlas_cancer_related"]
+    result = {column: [sorted(values) for values in result_df[column]] for column in columns}
+    assert result == {"disease_related": [["disease_a", "disease_c"], ["disease_a", "disease_b", "disease_c"], [], []],
+                      "inheritance_model": [["AD", "XL"], ["AD", "AR", "XL"], [], []],
+                      "enhancer_atlas_disease_related": [[], [], ["disease_b"], []],
+                      "cancer_related": [["oncogene"], ["TSG", "oncogene"], [], []],
+                      "enhancer_atlas_cancer_related": [[], [], ["TSG"], []]}
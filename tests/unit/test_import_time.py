@@ -0,0 +1,35 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+import yaml
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+CONFIG_PATH = os.path.join(BASE_DIR, "app", "configuration_files", "off-risk-config.yaml")
+# main and off_risk import in about one second, most of it pandas and flask
+BUDGET_SECONDS = 3
+
+
+@pytest.mark.parametrize("module", ["main", "off_risk"])
+def test_lazy_imports(module, tmp_path):
+    # Without the warm-up and with its own metrics directory, so the import does not load the databases and does not
+    # remove the metric files of a running server
+    with open(CONFIG_PATH) as config_file:
+        config = yaml.safe_load(config_file)
+    config["warm_up"]["enabled"] = False
+    config["metrics"]["enabled"] = False
+    config_path = tmp_path / "off-risk-config.yaml"
+    with open(config_path, "w") as config_file:
+        yaml.safe_dump(config, config_file)
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(tmp_path / "metrics"))
+    output_path = tmp_path / "import_time.json"
+
+    r = subprocess.run([sys.executable, os.path.join(BASE_DIR, "benchmarks", "import_time.py"), "--module", module,
+                        "--config", str(config_path), "--budget", str(BUDGET_SECONDS), "--runs", "1",
+                        "-o", str(output_path)], env=env, capture_output=True, text=True)
+    assert r.returncode == 0, r.stderr
+    with open(output_path) as output_file:
+        profile = json.load(output_file)
+    assert profile["eager_lazy_modules"] == []
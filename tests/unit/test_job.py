@@ -0,0 +1,104 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import job
+from job import Job, JobCancelled, JobDeadlineExceeded, cancel_job
+from proc_runner import run_process
+
+APP_DIR = os.path.dirname(os.path.abspath(job.__file__))
+
+# Runs a job in a new process and waits until it is cancelled
+WAIT_FOR_CANCEL_CODE = """
+import sys, time
+sys.path.insert(0, {app_dir!r})
+import job
+job.jobs_dir = {jobs_dir!r}
+with job.Job({request_id!r}) as current_job:
+    print("started", flush=True)
+    time_end = time.monotonic() + 10
+    while not current_job.is_cancelled() and time.monotonic() < time_end:
+        time.sleep(0.01)
+    try:
+        current_job.check()
+    except job.JobCancelled:
+        print("cancelled", flush=True)
+"""
+
+
+def is_running(pid):
+    """
+    Returns: True if the process exists and is not a zombie
+    """
+    try:
+        with open("/proc/{}/stat".format(pid)) as stat_file:
+            return stat_file.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+def stop_after(seconds):
+    time_stop = time.monotonic() + seconds
+    return lambda: time.monotonic() >= time_stop
+
+
+def test_deadline(state_dir):
+    with Job("deadline", deadline=0.2) as current_job:
+        current_job.check()
+        assert 0 < current_job.remaining() <= 0.2
+        time.sleep(0.3)
+        assert current_job.remaining() == 0
+        assert current_job.should_stop()
+        with pytest.raises(JobDeadlineExceeded) as error:
+            current_job.check()
+        assert error.value.status_code == 504
+    assert os.listdir(job.jobs_dir) == []
+
+
+def test_cancel_from_other_process(state_dir):
+    assert not cancel_job("cancel")
+    code = WAIT_FOR_CANCEL_CODE.format(app_dir=APP_DIR, jobs_dir=job.jobs_dir, request_id="cancel")
+    process = subprocess.Popen([sys.executable, "-c", code], stdout=subprocess.PIPE, text=True)
+    assert process.stdout.readline() == "started\n"
+
+    # A job of the same request in this process is cancelled as well
+    with Job("cancel") as current_job:
+        assert cancel_job("cancel")
+        with pytest.raises(JobCancelled) as error:
+            current_job.check()
+        assert error.value.status_code == 499
+    output, _ = process.communicate(timeout=10)
+    assert output == "cancelled\n"
+    assert os.listdir(job.jobs_dir) == []
+
+    # A new job with the same request ID is not cancelled
+    with Job("cancel") as current_job:
+        current_job.check()
+
+
+def test_stop_process_group(tmp_path):
+    # The background sleep is a grandchild of the test, in the process group of the shell
+    pid_path = tmp_path / "pid"
+    args = ["bash", "-c", "sleep 60 & echo $! > {}; wait".format(pid_path)]
+    result = run_process(args, stop_callback=stop_after(1.0), kill_grace_period=5)
+
+    assert result.stopped
+    assert result.exit_code == -15
+    assert 1.0 <= result.wall_time < 2.0
+    grandchild_pid = int(pid_path.read_text())
+    time_end = time.monotonic() + 5
+    while is_running(grandchild_pid) and time.monotonic() < time_end:
+        time.sleep(0.05)
+    assert not is_running(grandchild_pid)
+
+
+def test_kill_after_grace_period():
+    args = ["bash", "-c", "trap '' TERM; sleep 60"]
+    result = run_process(args, stop_callback=stop_after(0.2), kill_grace_period=0.5)
+
+    assert result.stopped
+    assert result.exit_code == -9
+    assert result.wall_time < 3.0
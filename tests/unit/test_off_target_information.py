@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from db import OffTargetInformation
+
+LIST_VALUES = ["a", "b", "c", "", np.nan]
+
+
+def merge_off_target_information(left_df, right_df, columns_name, column_type="list"):
+    """
+    The merge that every process_result ran before OffTargetInformation (see db.py before the user-049 change): a
+    left merge of the whole off-target table and two cleanups of the list columns
+    """
+    df_result = left_df.merge(right_df, how="left", on="off_target_id")
+    if column_type == "list":
+        for column in columns_name:
+            df_result[column] = df_result[column].apply(lambda x: [] if isinstance(x, float) else x)
+            df_result[column] = df_result[column].apply(lambda x: [i for i in x if i not in [np.nan, ""]])
+
+    return df_result
+
+
+def random_list(rng):
+    if rng.random() < 0.1:
+        return np.nan
+    return [LIST_VALUES[i] for i in rng.integers(0, len(LIST_VALUES), rng.integers(0, 4))]
+
+
+def random_tables(rng, off_targets):
+    """
+    Returns: list of (table, columns, column type) like the process_result of the databases add them. Some tables
+    have several rows for an off-target
+    """
+    tables = []
+    for table_number in range(rng.integers(3, 8)):
+        unique = rng.random() < 0.7
+        column_type = "list" if rng.random() < 0.8 else "string"
+        size = int(rng.integers(0, off_targets + 1)) if unique else int(rng.integers(1, 2 * off_targets + 1))
+        ids = rng.choice(off_targets, size=size, replace=not unique)
+        columns = ["column_{}_{}".format(table_number, i) for i in range(rng.integers(1, 3))]
+        table = pd.DataFrame({"off_target_id": ids})
+        for column in columns:
+            if column_type == "list":
+                table[column] = [random_list(rng) for _ in range(size)]
+            else:
+                table[column] = [np.nan if rng.random() < 0.2 else "source_{}".format(rng.integers(0, 5))
+                                 for _ in range(size)]
+        tables.append((table, columns, column_type))
+    return tables
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_join_equals_sequential_merges(seed):
+    rng = np.random.default_rng(seed)
+    off_targets = int(rng.integers(1, 60))
+    off_target_df = pd.DataFrame({"off_target_id": np.arange(off_targets),
+                                  "chromosome": ["chr{}".format(i % 3 + 1) for i in range(off_targets)],
+                                  "start": rng.integers(0, 10 ** 6, off_targets)})
+    # Duplicated off-targets, as in the results of several search tools
+    off_target_df = pd.concat([off_target_df, off_target_df.sample(frac=0.2, random_state=seed)], ignore_index=True)
+    tables = random_tables(rng, off_targets)
+
+    expected_df = off_target_df
+    information = OffTargetInformation()
+    for table, columns, column_type in tables:
+        expected_df = merge_off_target_information(expected_df, table, columns, column_type)
+        information.add(table, columns, column_type)
+    result_df = information.join(off_target_df)
+
+    pd.testing.assert_frame_equal(result_df, expected_df)
+    assert result_df.to_json(orient="records") == expected_df.to_json(orient="records")
@@ -0,0 +1,128 @@
+import json
+import os
+import subprocess
+import sys
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import shared_tables
+import table_store
+
+APP_DIR = os.path.dirname(os.path.abspath(shared_tables.__file__))
+
+ARRAYS = {"start": np.arange(1000, dtype=np.int64), "name": np.array([b"a", b"bb", b"ccc"], dtype="S3")}
+METADATA = {"columns": ["start", "name"]}
+
+# Attaches to the table in a new process, prints it and holds it until a line is read from stdin
+ATTACH_CODE = """
+import json, sys
+sys.path.insert(0, {app_dir!r})
+import shared_tables
+shared_tables.state_dir = {state_dir!r}
+metadata, arrays = shared_tables.attach_table({file_path!r}, "\\t")
+print(json.dumps({{"metadata": metadata,
+                   "arrays": {{name: array.tolist() if array.dtype.kind != "S" else [v.decode() for v in array]
+                              for name, array in arrays.items()}},
+                   "writeable": [array.flags.writeable for array in arrays.values()]}}), flush=True)
+sys.stdin.readline()
+shared_tables.release_tables()
+"""
+
+
+@pytest.fixture
+def table_path(tmp_path, state_dir, monkeypatch):
+    monkeypatch.setattr(shared_tables, "attached_segments", {})
+    path = tmp_path / "table.tsv"
+    path.write_text("start\tname\n1\ta\n")
+    yield str(path)
+    # The segments outlive the processes, remove the ones of the test
+    with shared_tables._locked_registry() as registry:
+        for segment_name in list(registry["segments"]):
+            shared_tables._unlink_segment(segment_name)
+            del registry["segments"][segment_name]
+
+
+def segment_exists(segment_name):
+    try:
+        shm = shared_memory.SharedMemory(name=segment_name)
+    except FileNotFoundError:
+        return False
+    shared_tables._untrack(shm)
+    shm.close()
+    return True
+
+
+def get_segment_name(file_path):
+    with shared_tables._locked_registry() as registry:
+        return registry["tables"][shared_tables._get_table_key(file_path, "\t")]["segment"]
+
+
+def start_attach(file_path, state_dir):
+    code = ATTACH_CODE.format(app_dir=APP_DIR, state_dir=state_dir, file_path=file_path)
+    process = subprocess.Popen([sys.executable, "-c", code], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               text=True)
+    line = process.stdout.readline()
+    assert line, "The child process failed"
+    return process, json.loads(line)
+
+
+def stop_attach(process):
+    process.communicate("\n", timeout=10)
+    assert process.returncode == 0
+
+
+def test_attach_from_other_process(table_path, state_dir):
+    shared_arrays = shared_tables.publish_table(table_path, "\t", METADATA, ARRAYS)
+    assert not any(array.flags.writeable for array in shared_arrays.values())
+
+    process, attached = start_attach(table_path, state_dir)
+    stop_attach(process)
+    assert attached["metadata"] == METADATA
+    assert attached["arrays"]["start"] == ARRAYS["start"].tolist()
+    assert attached["arrays"]["name"] == ["a", "bb", "ccc"]
+    assert attached["writeable"] == [False, False]
+
+
+def test_republish_changed_file(table_path, state_dir):
+    shared_tables.publish_table(table_path, "\t", METADATA, ARRAYS)
+    first_segment = get_segment_name(table_path)
+    process, _ = start_attach(table_path, state_dir)
+
+    # A new version of the file is not attached to the old segment
+    stat = os.stat(table_path)
+    os.utime(table_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert shared_tables.attach_table(table_path, "\t") is None
+    shared_tables.publish_table(table_path, "\t", METADATA, {"start": ARRAYS["start"] + 1})
+    second_segment = get_segment_name(table_path)
+    assert second_segment != first_segment
+
+    # The old segment is retired, and kept while the other process is attached to it
+    with shared_tables._locked_registry() as registry:
+        assert registry["segments"][first_segment]["retired"]
+    assert segment_exists(first_segment)
+
+    stop_attach(process)
+    shared_tables.release_tables()
+    assert not segment_exists(first_segment)
+    assert segment_exists(second_segment)
+    with shared_tables._locked_registry() as registry:
+        assert list(registry["segments"]) == [second_segment]
+
+
+def test_shared_memory_full(table_path, monkeypatch):
+    monkeypatch.setattr(shared_tables, "get_free_shared_memory", lambda: 1024)
+    with pytest.raises(shared_tables.SharedMemoryFull):
+        shared_tables.publish_table(table_path, "\t", METADATA, ARRAYS)
+    with shared_tables._locked_registry() as registry:
+        assert registry["tables"] == {}
+        assert registry["segments"] == {}
+
+    # The table is loaded for this process only
+    monkeypatch.setattr(shared_tables, "shared_tables_enabled", True)
+    monkeypatch.setattr(table_store, "loaded_tables", {})
+    table = table_store.load_table(table_path, sep="\t")
+    pd.testing.assert_frame_equal(table.to_frame(), pd.DataFrame({"start": [1], "name": ["a"]}),
+                                  check_dtype=False)
@@ -0,0 +1,129 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import tool_pool
+from tool_pool import ToolPoolFull, ToolPoolTimeout, tool_slot
+
+
+@pytest.fixture
+def pool(state_dir, monkeypatch):
+    monkeypatch.setattr(tool_pool, "pool_enabled", True)
+    monkeypatch.setattr(tool_pool, "tool_slots", {"cas_offinder": 2, "flashfry": 2, "crispritz": 1})
+    monkeypatch.setattr(tool_pool, "tool_memory_mb", {"cas_offinder": 1024, "flashfry": 4096, "crispritz": 2048})
+    monkeypatch.setattr(tool_pool, "memory_budget_mb", 6144)
+    monkeypatch.setattr(tool_pool, "max_queue_depth", 1)
+    monkeypatch.setattr(tool_pool, "wait_timeout", 5)
+    monkeypatch.setattr(tool_pool, "retry_after", 7)
+    monkeypatch.setattr(tool_pool, "POLL_INTERVAL", 0.01)
+    return tool_pool
+
+
+def wait_for(condition, timeout=5):
+    time_end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < time_end, "Timed out"
+        time.sleep(0.01)
+
+
+class WaitingThread(threading.Thread):
+    """
+    Waits for a slot of tool in the pool and holds it until release is set
+    """
+
+    def __init__(self, tool):
+        super().__init__(daemon=True)
+        self.tool = tool
+        self.acquired = threading.Event()
+        self.release = threading.Event()
+        self.error = None
+
+    def run(self):
+        try:
+            with tool_slot(self.tool):
+                self.acquired.set()
+                self.release.wait(10)
+        except Exception as e:
+            self.error = e
+
+
+def test_free_slot_without_queue(pool, monkeypatch):
+    monkeypatch.setattr(tool_pool, "max_queue_depth", 0)
+    with tool_slot("crispritz"):
+        with tool_slot("flashfry"):
+            assert pool.get_pool_status()["crispritz"] == {"running": 1, "waiting": 0}
+            assert pool.get_pool_status()["flashfry"] == {"running": 1, "waiting": 0}
+        with pytest.raises(ToolPoolFull):
+            with tool_slot("crispritz"):
+                pass
+    assert pool.get_pool_status()["crispritz"] == {"running": 0, "waiting": 0}
+
+
+def test_full_queue(pool):
+    with tool_slot("crispritz"):
+        waiting = WaitingThread("crispritz")
+        waiting.start()
+        wait_for(lambda: pool.get_pool_status()["crispritz"]["waiting"] == 1)
+
+        with pytest.raises(ToolPoolFull) as error:
+            with tool_slot("crispritz"):
+                pass
+        assert error.value.status_code == 429
+        assert error.value.retry_after == 7
+        # The queue depth is per tool
+        with tool_slot("cas_offinder"):
+            pass
+    waiting.acquired.wait(5)
+    assert waiting.acquired.is_set()
+    waiting.release.set()
+    waiting.join(5)
+    assert waiting.error is None
+    assert pool.get_pool_status()["crispritz"] == {"running": 0, "waiting": 0}
+
+
+def test_wait_timeout(pool, monkeypatch):
+    monkeypatch.setattr(tool_pool, "wait_timeout", 0.3)
+    with tool_slot("crispritz"):
+        time_start = time.monotonic()
+        with pytest.raises(ToolPoolTimeout) as error:
+            with tool_slot("crispritz"):
+                pass
+        assert time.monotonic() - time_start >= 0.3
+        assert error.value.status_code == 503
+        assert error.value.retry_after == 7
+        # The entry of the request that timed out does not stay in the queue
+        assert pool.get_pool_status()["crispritz"] == {"running": 1, "waiting": 0}
+
+
+def test_memory_budget(pool):
+    with tool_slot("flashfry"):
+        # A second FlashFry has a slot, but the two would use 8192 MB of the 6144 MB budget
+        waiting = WaitingThread("flashfry")
+        waiting.start()
+        wait_for(lambda: pool.get_pool_status()["flashfry"]["waiting"] == 1)
+        time.sleep(0.1)
+        assert not waiting.acquired.is_set()
+        # Cas-OFFinder fits in the rest of the budget
+        with tool_slot("cas_offinder"):
+            pass
+    waiting.acquired.wait(5)
+    assert waiting.acquired.is_set()
+    waiting.release.set()
+    waiting.join(5)
+
+
+def test_dead_process_slot(pool, state_dir):
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    os.makedirs(state_dir, exist_ok=True)
+    with open(os.path.join(state_dir, tool_pool.STATE_FILE_NAME), "w") as state_file:
+        json.dump({"running": [{"id": "dead", "pid": process.pid, "tool": "crispritz", "memory_mb": 2048}],
+                   "waiting": []}, state_file)
+
+    with tool_slot("crispritz"):
+        assert pool.get_pool_status()["crispritz"] == {"running": 1, "waiting": 0}